@@ -4,10 +4,12 @@ from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
-from .models import TokenData, user_collection, user_doc_to_public, UserPublic
+from .models import TokenData, user_doc_to_public, UserPublic
+from .users import UserRepository, UserStoreUnavailable, get_user_repository
 
 
 SECRET_KEY = os.getenv("AUTH_SECRET_KEY", "change-me")
@@ -26,6 +28,15 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# bcrypt is deliberately slow; run it off the event loop so other requests keep going
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_in_threadpool(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -34,11 +45,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def get_user_by_id(user_id: str) -> Optional[dict]:
-    return user_collection.find_one({"id": user_id})
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserPublic:
+async def get_user_by_id(users: UserRepository, user_id: str) -> Optional[dict]:
+    try:
+        return await users.get_by_id(user_id)
+    except UserStoreUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database connection error. Please try again later."
+        )
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    users: UserRepository = Depends(get_user_repository),
+) -> UserPublic:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,7 +73,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserPublic:
     except JWTError:
         raise credentials_exception
 
-    user_doc = get_user_by_id(token_data.user_id)
+    user_doc = await get_user_by_id(users, token_data.user_id)
     if user_doc is None:
         raise credentials_exception
     return user_doc_to_public(user_doc)
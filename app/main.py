@@ -1,9 +1,23 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .routes.auth_routes import router as auth_router
+from .users import create_user_repository
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One repository (and Mongo connection pool) per worker process
+    users = create_user_repository()
+    await users.start()
+    app.state.users = users
+    yield
+    await users.close()
 
-app = FastAPI(title="Auth Service")
+
+app = FastAPI(title="Auth Service", lifespan=lifespan)
 
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
@@ -20,5 +34,3 @@ app.include_router(auth_router)
 @app.get("/")
 def root():
     return {"status": "ok"}
-
-
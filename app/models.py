@@ -1,32 +1,7 @@
-import os
 import uuid
 from typing import Optional
 
 from pydantic import BaseModel, EmailStr, Field
-from pymongo import MongoClient
-
-
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "bus_tracking")
-
-# Create MongoDB client with connection timeout
-client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-db = client[MONGO_DB_NAME]
-user_collection = db.get_collection("users")
-
-# Create unique index on email (with error handling)
-try:
-    user_collection.create_index("email", unique=True)
-except Exception as e:
-    print(f"Warning: Could not create email index (may already exist): {e}")
-
-# Test MongoDB connection on import
-try:
-    client.admin.command('ping')
-    print(f"✅ MongoDB connected successfully to {MONGO_URI}")
-except Exception as e:
-    print(f"⚠️ Warning: MongoDB connection failed: {e}")
-    print(f"   Make sure MongoDB is running and accessible at {MONGO_URI}")
 
 
 class UserBase(BaseModel):
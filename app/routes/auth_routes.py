@@ -5,8 +5,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from ..auth import (
     create_access_token,
     get_current_user,
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
 )
 from ..models import (
     Token,
@@ -14,19 +14,26 @@ from ..models import (
     UserLogin,
     UserPublic,
     create_user_document,
-    user_collection,
     user_doc_to_public,
 )
+from ..users import DuplicateEmailError, UserRepository, UserStoreUnavailable, get_user_repository
 
 
 router = APIRouter()
 
 
+def _store_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Database connection error. Please try again later."
+    )
+
+
 @router.post("/register", response_model=UserPublic, status_code=status.HTTP_201_CREATED)
-def register_user(payload: UserCreate):
+async def register_user(payload: UserCreate, users: UserRepository = Depends(get_user_repository)):
     try:
         # Check if email already exists (application-level check)
-        existing = user_collection.find_one({"email": payload.email.lower()})
+        existing = await users.get_by_email(payload.email)
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -35,36 +42,24 @@ def register_user(payload: UserCreate):
 
         # Create user document
         user_doc = create_user_document(payload)
-        user_doc["password"] = get_password_hash(payload.password)
-        
-        # Insert user (database-level unique index will also prevent duplicates)
+        user_doc["password"] = await get_password_hash_async(payload.password)
+
+        # Insert user (the store's unique email index also prevents duplicates)
         try:
-            user_collection.insert_one(user_doc)
-        except Exception as e:
-            # Handle MongoDB duplicate key error as a fallback (race condition protection)
-            error_str = str(e).lower()
-            if "duplicate key" in error_str or "e11000" in error_str:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Email already registered"
-                )
-            # Handle MongoDB connection errors
-            elif "connection" in error_str or "timeout" in error_str:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail="Database connection error. Please try again later."
-                )
-            # Log unexpected errors for debugging
-            print(f"Unexpected error during user registration: {e}")
+            await users.create(user_doc)
+        except DuplicateEmailError:
+            # Lost a race with a concurrent registration for the same email
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to create user account: {str(e)}"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
             )
-        
+
         return user_doc_to_public(user_doc)
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
+    except UserStoreUnavailable:
+        raise _store_unavailable()
     except Exception as e:
         # Catch any other unexpected errors
         print(f"Unexpected error in register_user: {e}")
@@ -75,9 +70,12 @@ def register_user(payload: UserCreate):
 
 
 @router.post("/login", response_model=Token)
-def login_user(payload: UserLogin):
-    user_doc = user_collection.find_one({"email": payload.email.lower()})
-    if not user_doc or not verify_password(payload.password, user_doc["password"]):
+async def login_user(payload: UserLogin, users: UserRepository = Depends(get_user_repository)):
+    try:
+        user_doc = await users.get_by_email(payload.email)
+    except UserStoreUnavailable:
+        raise _store_unavailable()
+    if not user_doc or not await verify_password_async(payload.password, user_doc["password"]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     access_token = create_access_token({"sub": user_doc["id"]}, expires_delta=timedelta(minutes=60))
@@ -85,7 +83,5 @@ def login_user(payload: UserLogin):
 
 
 @router.get("/profile", response_model=UserPublic)
-def read_profile(current_user: UserPublic = Depends(get_current_user)):
+async def read_profile(current_user: UserPublic = Depends(get_current_user)):
     return current_user
-
-
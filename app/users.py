@@ -0,0 +1,176 @@
+import copy
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from fastapi import Request
+
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "bus_tracking")
+# Connections per worker process; requests beyond this wait for a free one
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# "mongo", or "memory" to run without a database (local development, tests)
+USER_STORE = os.getenv("USER_STORE", "mongo")
+
+
+class UserStoreError(Exception):
+    pass
+
+
+class DuplicateEmailError(UserStoreError):
+    pass
+
+
+class UserStoreUnavailable(UserStoreError):
+    pass
+
+
+class UserRepository(ABC):
+    """Async access to user documents (see models.create_user_document).
+
+    Route handlers get one through the `get_user_repository` dependency, so
+    tests can swap in InMemoryUserRepository via `app.dependency_overrides`.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get_by_id(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def create(self, user_doc: dict) -> None:
+        """Store a new user; raises DuplicateEmailError if the email is taken."""
+
+
+class MongoUserRepository(UserRepository):
+    """Users in the Mongo `users` collection through Motor.
+
+    All calls are awaited on the event loop, so one worker serves many
+    requests concurrently out of a connection pool sized by MONGO_MAX_POOL_SIZE.
+    """
+
+    def __init__(
+        self,
+        uri: str = MONGO_URI,
+        db_name: str = MONGO_DB_NAME,
+        max_pool_size: int = MONGO_MAX_POOL_SIZE,
+        min_pool_size: int = MONGO_MIN_POOL_SIZE,
+        **client_options,
+    ) -> None:
+        self.uri = uri
+        self.db_name = db_name
+        client_options.setdefault("maxIdleTimeMS", MONGO_MAX_IDLE_TIME_MS)
+        client_options.setdefault("waitQueueTimeoutMS", MONGO_WAIT_QUEUE_TIMEOUT_MS)
+        client_options.setdefault("serverSelectionTimeoutMS", MONGO_SERVER_SELECTION_TIMEOUT_MS)
+        self._client_options = dict(maxPoolSize=max_pool_size, minPoolSize=min_pool_size, **client_options)
+        self._client = None
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            # Created lazily so the client binds to the running event loop
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            self._client = AsyncIOMotorClient(self.uri, **self._client_options)
+            self._collection = self._client[self.db_name].get_collection("users")
+        return self._collection
+
+    async def start(self) -> None:
+        collection = self.collection
+        # Login looks users up by email and /profile by id
+        try:
+            await collection.create_index("email", unique=True)
+            await collection.create_index("id", unique=True)
+        except Exception as e:
+            print(f"Warning: Could not create user indexes (may already exist): {e}")
+        try:
+            await self._client.admin.command("ping")
+            print(f"✅ MongoDB connected successfully to {self.uri}")
+        except Exception as e:
+            print(f"⚠️ Warning: MongoDB connection failed: {e}")
+            print(f"   Make sure MongoDB is running and accessible at {self.uri}")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self._collection = None
+
+    async def _find_one(self, query: dict) -> Optional[dict]:
+        from pymongo.errors import ConnectionFailure
+
+        try:
+            return await self.collection.find_one(query, {"_id": 0})
+        except ConnectionFailure as e:
+            raise UserStoreUnavailable(str(e)) from e
+
+    async def get_by_id(self, user_id: str) -> Optional[dict]:
+        return await self._find_one({"id": user_id})
+
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        return await self._find_one({"email": email.lower()})
+
+    async def create(self, user_doc: dict) -> None:
+        from pymongo.errors import ConnectionFailure, DuplicateKeyError
+
+        try:
+            # insert_one adds _id to the document it is given
+            await self.collection.insert_one(dict(user_doc))
+        except DuplicateKeyError as e:
+            raise DuplicateEmailError(user_doc["email"]) from e
+        except ConnectionFailure as e:
+            raise UserStoreUnavailable(str(e)) from e
+
+
+class InMemoryUserRepository(UserRepository):
+    """Users in a dict, with the same uniqueness rules as the Mongo indexes."""
+
+    def __init__(self) -> None:
+        self._by_id: Dict[str, dict] = {}
+        self._by_email: Dict[str, str] = {}
+
+    async def get_by_id(self, user_id: str) -> Optional[dict]:
+        doc = self._by_id.get(user_id)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        user_id = self._by_email.get(email.lower())
+        return await self.get_by_id(user_id) if user_id is not None else None
+
+    async def create(self, user_doc: dict) -> None:
+        # No await between the check and the insert, so concurrent requests can't both pass it
+        email = user_doc["email"].lower()
+        if email in self._by_email or user_doc["id"] in self._by_id:
+            raise DuplicateEmailError(email)
+        self._by_id[user_doc["id"]] = copy.deepcopy(user_doc)
+        self._by_email[email] = user_doc["id"]
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+def create_user_repository(kind: str = USER_STORE) -> UserRepository:
+    if kind == "memory":
+        return InMemoryUserRepository()
+    if kind == "mongo":
+        return MongoUserRepository()
+    raise ValueError(f"Unknown USER_STORE: {kind!r}")
+
+
+def get_user_repository(request: Request) -> UserRepository:
+    return request.app.state.users
@@ -1,12 +1,26 @@
+import atexit
 import os
 from flask import Flask, jsonify
 from flask_cors import CORS
-from db import init_db, create_all_tables
+from db import init_db, create_all_tables, get_db_session
 import logging
 from logging import StreamHandler
 import sys
 from routes.realtime import bp as realtime_bp
+from routes.eta import bp as eta_bp
+from routes.history import bp as history_bp
 from routes.search import bp as search_bp
+from routes.stops import bp as stops_bp
+from services.arrivals import arrival_boards
+from services.broker import RedisTransport
+from services.eta import eta_engine, load_eta_routes
+from services.fleet import load_bus_routes, watch_bus_changes
+from services.matching import map_matcher
+from services.persistence import load_latest_positions, position_writer
+from services.realtime import hub
+from services.retention import schedule_maintenance
+from services.stop_index import load_db_stops
+from sqlalchemy.exc import SQLAlchemyError
 
 
 def create_app() -> Flask:
@@ -33,9 +47,56 @@ def create_app() -> Flask:
     if app.config.get("DEBUG"):
         create_all_tables(app)
 
+    # Warm in-memory indexes from the database; tables may not exist before migrations
+    watch_bus_changes()
+    with app.app_context():
+        try:
+            with get_db_session() as session:
+                load_db_stops(session)
+                load_bus_routes(session)
+                load_eta_routes(session)
+                hub.restore_positions(load_latest_positions(session))
+        except SQLAlchemyError as exc:
+            logger.warning("Skipping database warm-up: %s", exc)
+
+    # Share live positions across workers/nodes through the broker when configured
+    if app.config.get("REDIS_URL"):
+        hub.set_transport(RedisTransport(app.config["REDIS_URL"]))
+
+    # Expire buses that stopped reporting
+    hub.set_ttl(app.config["POSITION_TTL_SECONDS"])
+
+    # Snap raw GPS to route polylines before anything else sees it
+    if app.config.get("MAP_MATCHING"):
+        hub.set_ingest_stage(map_matcher.process)
+
+    # Learn observed segment speeds from live positions, then push the per-stop arrival
+    # boards they affect. Both run once per dispatcher tick, off the ingest request thread.
+    hub.add_flush_listener(eta_engine.observe_flush)
+    hub.add_flush_listener(arrival_boards.observe_flush)
+    hub.add_offline_listener(arrival_boards.drop_buses)
+
+    # Persist live positions in the background
+    if app.config.get("PERSIST_POSITIONS"):
+        position_writer.configure(
+            app.session_factory,  # type: ignore[attr-defined]
+            batch_size=app.config["POSITION_WRITER_BATCH_SIZE"],
+            flush_interval=app.config["POSITION_WRITER_FLUSH_MS"] / 1000,
+            max_queue=app.config["POSITION_WRITER_MAX_QUEUE"],
+        )
+        hub.add_listener(position_writer.enqueue, origin_only=True)
+        atexit.register(position_writer.stop)
+
+    # Daily history rollover/downsampling; enable in exactly one process
+    if app.config.get("RETENTION_JOBS_ENABLED"):
+        schedule_maintenance(app)
+
     # Blueprints
     app.register_blueprint(realtime_bp)
     app.register_blueprint(search_bp)
+    app.register_blueprint(stops_bp)
+    app.register_blueprint(history_bp)
+    app.register_blueprint(eta_bp)
 
     # Basic health and version endpoints
     @app.get("/")
@@ -50,6 +111,7 @@ def create_app() -> Flask:
                   <li><a href="/healthz">/healthz</a></li>
                   <li><a href="/version">/version</a></li>
                   <li><a href="/api/positions">/api/positions</a></li>
+                  <li><a href="/api/stops/suggest?q=circle">/api/stops/suggest</a></li>
                   <li><a href="/api/stream/positions">/api/stream/positions</a> (SSE)</li>
                 </ul>
               </body>
@@ -0,0 +1,2 @@
+# Tests import the app's top-level packages (services, routes, ...) the same way app.py does,
+# so the backend directory has to be on sys.path; pytest adds a rootdir conftest's directory.
@@ -0,0 +1,73 @@
+"""vehicle positions history: composite index, minute rollups, mysql partitions
+
+Revision ID: a3f1c9d27b64
+Revises: 849c84b07b56
+Create Date: 2026-10-18 09:12:03.418220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9d27b64'
+down_revision: Union[str, None] = '849c84b07b56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Dev databases may already have these objects from create_all (see app.py)
+    if not inspector.has_table('vehicle_position_minutes'):
+        op.create_table(
+            'vehicle_position_minutes',
+            sa.Column('bus_id', sa.Integer(), nullable=False),
+            sa.Column('minute', sa.DateTime(), nullable=False),
+            sa.Column('samples', sa.Integer(), nullable=False),
+            sa.Column('lat', sa.Float(), nullable=False),
+            sa.Column('lon', sa.Float(), nullable=False),
+            sa.Column('avg_speed', sa.Float(), nullable=True),
+            sa.Column('max_speed', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('bus_id', 'minute'),
+        )
+
+    # The init revision is empty, so vehicle_positions itself only exists via create_all
+    if not inspector.has_table('vehicle_positions'):
+        return
+
+    existing = {ix['name'] for ix in inspector.get_indexes('vehicle_positions')}
+    if 'ix_vehicle_positions_bus_id_timestamp' not in existing:
+        op.create_index('ix_vehicle_positions_bus_id_timestamp', 'vehicle_positions', ['bus_id', 'timestamp'])
+    if 'ix_vehicle_positions_bus_id' in existing:
+        op.drop_index('ix_vehicle_positions_bus_id', table_name='vehicle_positions')
+
+    if bind.dialect.name == 'mysql':
+        # Partitioned InnoDB tables cannot carry foreign keys, and the partition
+        # column must be part of every unique key (including the primary key).
+        for fk in inspector.get_foreign_keys('vehicle_positions'):
+            op.drop_constraint(fk['name'], 'vehicle_positions', type_='foreignkey')
+        op.execute('ALTER TABLE vehicle_positions DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)')
+        op.execute(
+            'ALTER TABLE vehicle_positions PARTITION BY RANGE (TO_DAYS(timestamp)) '
+            '(PARTITION pmax VALUES LESS THAN MAXVALUE)'
+        )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if inspector.has_table('vehicle_positions'):
+        if bind.dialect.name == 'mysql':
+            op.execute('ALTER TABLE vehicle_positions REMOVE PARTITIONING')
+            op.execute('ALTER TABLE vehicle_positions DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+            op.create_foreign_key(None, 'vehicle_positions', 'buses', ['bus_id'], ['id'])
+        op.create_index('ix_vehicle_positions_bus_id', 'vehicle_positions', ['bus_id'])
+        op.drop_index('ix_vehicle_positions_bus_id_timestamp', table_name='vehicle_positions')
+
+    op.drop_table('vehicle_position_minutes')
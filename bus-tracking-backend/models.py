@@ -8,6 +8,7 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     create_engine,
@@ -86,9 +87,11 @@ class Trip(Base):
 
 class VehiclePosition(Base):
     __tablename__ = "vehicle_positions"
+    # (bus_id, timestamp) keeps "one bus over a time window" an index range scan
+    __table_args__ = (Index("ix_vehicle_positions_bus_id_timestamp", "bus_id", "timestamp"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    bus_id: Mapped[int] = mapped_column(ForeignKey("buses.id"), index=True)
+    bus_id: Mapped[int] = mapped_column(ForeignKey("buses.id"))
     lat: Mapped[float] = mapped_column(Float, nullable=False)
     lon: Mapped[float] = mapped_column(Float, nullable=False)
     heading: Mapped[Optional[float]] = mapped_column(Float)
@@ -96,8 +99,24 @@ class VehiclePosition(Base):
     timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP"))
 
 
-def get_engine(database_url: str):
-    return create_engine(database_url, pool_pre_ping=True)
+class VehiclePositionMinute(Base):
+    """Per-minute downsample of vehicle_positions kept after raw rows expire."""
+
+    __tablename__ = "vehicle_position_minutes"
+
+    bus_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    minute: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    samples: Mapped[int] = mapped_column(Integer, nullable=False)
+    lat: Mapped[float] = mapped_column(Float, nullable=False)
+    lon: Mapped[float] = mapped_column(Float, nullable=False)
+    avg_speed: Mapped[Optional[float]] = mapped_column(Float)
+    max_speed: Mapped[Optional[float]] = mapped_column(Float)
+
+
+def get_engine(database_url: str, **pool_options):
+    """Engine with pre-ping on; `pool_options` (pool_size, pool_recycle, ...) go to create_engine."""
+    pool_options.setdefault("pool_pre_ping", True)
+    return create_engine(database_url, **pool_options)
 
 
 def create_session_factory(database_url: str):
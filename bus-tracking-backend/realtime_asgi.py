@@ -0,0 +1,237 @@
+"""Asyncio realtime service: the /api/positions + /api/stream/positions contract over ASGI.
+
+The Flask app pins one worker thread per open SSE connection. Here each
+stream is an async generator waiting on an asyncio.Event, so an idle viewer
+costs a coroutine and its buffer instead of a thread. Fan-out still goes
+through the shared RealtimeHub dispatcher; LoopBridge hands each tick's
+wakeups to the event loop in a single call.
+
+    uvicorn realtime_asgi:app --host 0.0.0.0 --port 5001
+
+Without REDIS_URL, positions must be ingested by the same process (POST
+here); with it, every worker shares positions through the broker.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from typing import Optional
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+
+from config import Config
+from models import create_session_factory
+from routes.realtime import MAX_BATCH_SIZE, decode_batch, parse_batch, parse_filter, parse_position, positions_payload
+from services.fleet import load_bus_routes
+from services.broker import RedisTransport
+from services.channels import position_channel
+from services.eta import load_eta_routes
+from services.matching import map_matcher
+from services.persistence import load_latest_positions, position_writer
+from services.realtime import DEFAULT_BUFFER_SIZE, DROP_OLDEST, DROP_POLICIES, KEEPALIVE_SECONDS, LoopBridge, hub
+
+
+logger = logging.getLogger("realtime_asgi")
+
+
+def _warm_up() -> None:
+    hub.set_ttl(Config.POSITION_TTL_SECONDS)
+    if Config.REDIS_URL:
+        hub.set_transport(RedisTransport(Config.REDIS_URL))
+    session_factory = create_session_factory(Config.DATABASE_URL)
+    try:
+        session = session_factory()
+        try:
+            load_bus_routes(session)
+            if Config.MAP_MATCHING:
+                load_eta_routes(session)
+            hub.restore_positions(load_latest_positions(session))
+        finally:
+            session.close()
+    except SQLAlchemyError as exc:
+        logger.warning("Skipping database warm-up: %s", exc)
+    if Config.MAP_MATCHING:
+        hub.set_ingest_stage(map_matcher.process)
+
+    if Config.PERSIST_POSITIONS:
+        position_writer.configure(
+            session_factory,
+            batch_size=Config.POSITION_WRITER_BATCH_SIZE,
+            flush_interval=Config.POSITION_WRITER_FLUSH_MS / 1000,
+            max_queue=Config.POSITION_WRITER_MAX_QUEUE,
+        )
+        hub.add_listener(position_writer.enqueue, origin_only=True)
+        atexit.register(position_writer.stop)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _warm_up()
+    app.state.bridge = LoopBridge(asyncio.get_running_loop())
+    yield
+
+
+app = FastAPI(title="Realtime Service", lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[o.strip() for o in Config.CORS_ORIGINS.split(",")],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+def _args(request: Request) -> MultiDict:
+    # parse_filter expects werkzeug-style args (get(name, default, type=...))
+    return MultiDict(request.query_params.multi_items())
+
+
+def _error(message: str, status: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+
+@app.get("/api/positions")
+def get_positions(request: Request):
+    try:
+        status, body, headers = positions_payload(_args(request), request.headers.get("if-none-match"))
+    except ValueError as exc:
+        return _error(str(exc))
+    if status == 304:
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+
+@app.post("/api/positions")
+async def post_position(request: Request):
+    try:
+        data = json.loads(await request.body())
+        pos = parse_position(data)
+    except KeyError as exc:
+        return _error(f"missing field {exc.args[0]}")
+    except (TypeError, ValueError, OverflowError) as exc:
+        return _error(str(exc))
+    # Map matching and the broker publish block; keep them off the event loop
+    await run_in_threadpool(hub.update_position, pos)
+    return {"ok": True}
+
+
+def _ingest_batch(records) -> dict:
+    positions, errors = parse_batch(records, time.time())
+    ingested = hub.update_positions(positions)
+    return {
+        "ok": not errors,
+        "accepted": len(ingested),
+        "rejected": len(errors),
+        # Parsed but dropped by map matching as physically impossible jumps
+        "discarded": len(positions) - len(ingested),
+        "errors": errors,
+    }
+
+
+@app.post("/api/positions/batch")
+async def post_positions_batch(request: Request):
+    body = await request.body()
+    mimetype = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        # UnicodeDecodeError is a ValueError too
+        records = decode_batch(body.decode(), mimetype)
+    except ValueError as exc:
+        return _error(str(exc))
+    if len(records) > MAX_BATCH_SIZE:
+        return _error(f"batch exceeds {MAX_BATCH_SIZE} records", 413)
+    return await run_in_threadpool(_ingest_batch, records)
+
+
+@app.get("/api/stream/positions")
+@app.get("/api/stream/routes/{route_id}/positions")
+async def stream_positions(request: Request, route_id: Optional[int] = None):
+    args = _args(request)
+    policy = args.get("policy", DROP_OLDEST)
+    if policy not in DROP_POLICIES:
+        return _error(f"policy must be one of {', '.join(DROP_POLICIES)}")
+    maxlen = min(max(args.get("buffer", DEFAULT_BUFFER_SIZE, type=int), 1), 4096)
+    try:
+        filt = parse_filter(args)
+    except ValueError as exc:
+        return _error(str(exc))
+    if route_id is not None:
+        filt = replace(filt, route_id=route_id)
+    sub = hub.subscribe_async(request.app.state.bridge, maxlen=maxlen, policy=policy, filter=filt)
+    return StreamingResponse(
+        sub.stream_async(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _receive_commands(websocket: WebSocket, session) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        text = message.get("text")
+        if text is None:
+            # Binary messages are not commands; answer instead of dropping the connection
+            await websocket.send_json({"type": "error", "error": "commands must be JSON text messages"})
+            continue
+        try:
+            reply = position_channel.apply(session, json.loads(text))
+        except (TypeError, ValueError) as exc:
+            reply = {"type": "error", "error": str(exc)}
+        await websocket.send_json(reply)
+
+
+@app.websocket("/api/ws/positions")
+async def ws_positions(websocket: WebSocket):
+    """Binary position frames (services/wire.py) for the routes/buses/bboxes the client subscribes to.
+
+    Commands are JSON text messages, e.g. {"op": "subscribe", "route_ids": [3]},
+    {"op": "unsubscribe", "bboxes": [[...]]} or {"op": "options", "delta": true};
+    each is acknowledged with a JSON text message. ?delta=1 enables deltas up front.
+    """
+    await websocket.accept()
+    session = position_channel.open(websocket.app.state.bridge, delta=websocket.query_params.get("delta") in ("1", "true"))
+    receiver = asyncio.create_task(_receive_commands(websocket, session))
+    try:
+        while not receiver.done():
+            waiter = asyncio.create_task(session.ready.wait())
+            await asyncio.wait({waiter, receiver}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            session.ready.clear()
+            for frame in session.next_frames():
+                await websocket.send_bytes(frame)
+        receiver.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        position_channel.close(session)
+
+
+@app.get("/api/positions/stats")
+def position_stats():
+    return {
+        "buses": hub.bus_count(),
+        "presence": hub.presence(),
+        "matching": map_matcher.stats(),
+        "writer": position_writer.stats(),
+        "transport": hub.transport_stats(),
+    }
+
+
+@app.get("/api/stream/stats")
+def stream_stats():
+    subscribers = hub.subscriber_stats()
+    return {
+        "subscribers": len(subscribers),
+        "pending": sum(s["pending"] for s in subscribers),
+        "dropped": sum(s["dropped"] for s in subscribers),
+        "websocket": position_channel.stats(),
+    }
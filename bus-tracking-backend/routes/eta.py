@@ -0,0 +1,62 @@
+import math
+
+from flask import Blueprint, Response, jsonify
+
+from services.arrivals import arrival_boards
+from services.eta import eta_engine
+from services.realtime import hub
+
+
+bp = Blueprint("eta", __name__)
+
+
+def _minutes(seconds: float) -> int:
+    return max(0, int(math.ceil(seconds / 60.0)))
+
+
+@bp.get("/api/bus/<int:bus_id>/eta/<int:stop_id>")
+def get_eta(bus_id: int, stop_id: int):
+    seconds = eta_engine.eta_seconds(bus_id, stop_id)
+    if seconds is None:
+        return jsonify({"bus_id": bus_id, "stop_id": stop_id, "eta": None, "eta_seconds": None})
+    return jsonify({"bus_id": bus_id, "stop_id": stop_id, "eta": _minutes(seconds), "eta_seconds": round(seconds)})
+
+
+@bp.get("/api/routes/<int:route_id>/etas")
+def get_route_etas(route_id: int):
+    """Next arrival at every stop of a route, plus each live bus's ETAs (seconds)."""
+    result = eta_engine.route_etas(route_id, hub.buses_on_route(route_id))
+    if result is None:
+        return jsonify({"error": "unknown route"}), 404
+    stop_ids, bus_ids, etas = result["stop_ids"], result["bus_ids"], result["etas"]
+
+    stops = [
+        {
+            "stop_id": stop_id,
+            "next_bus_id": bus_id if bus_id >= 0 else None,
+            "eta_seconds": round(eta) if math.isfinite(eta) else None,
+        }
+        for stop_id, bus_id, eta in zip(stop_ids.tolist(), result["next_bus"].tolist(), result["next_eta"].tolist())
+    ]
+    buses = [
+        {
+            "bus_id": bus_id,
+            "etas": {str(s): round(v) for s, v in zip(stop_ids.tolist(), row) if not math.isnan(v)},
+        }
+        for bus_id, row in zip(bus_ids.tolist(), etas.tolist())
+    ]
+    return jsonify({"route_id": route_id, "stops": stops, "buses": buses})
+
+
+@bp.get("/api/stream/stops/<int:stop_id>/arrivals")
+def stream_stop_arrivals(stop_id: int):
+    """SSE arrival board for one stop; a new frame is sent only when the board changes."""
+    if not arrival_boards.serves(stop_id):
+        return jsonify({"error": "stop is not on any route"}), 404
+    sub = arrival_boards.subscribe(stop_id)
+    return Response(sub.stream(), mimetype="text/event-stream")
+
+
+@bp.get("/api/stream/stops/stats")
+def stop_stream_stats():
+    return jsonify(arrival_boards.stats())
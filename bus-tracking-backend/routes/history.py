@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from flask import Blueprint, current_app, jsonify, request
+
+from db import get_db_session
+from services.persistence import to_db_time
+from services.track import columnar_payload, read_track, simplify
+
+
+bp = Blueprint("history", __name__)
+
+TRACK_FORMATS = ("columnar", "polyline")
+# A service day plus slack; longer replays should be paged by the client
+MAX_TRACK_SPAN = timedelta(hours=36)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    """Epoch seconds or ISO 8601 (naive values are taken as UTC), as naive UTC."""
+    if not value:
+        return None
+    try:
+        return to_db_time(float(value))
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@bp.get("/api/buses/<int:bus_id>/track")
+def get_track(bus_id: int):
+    """Historical path of a bus.
+    Query: from, to (epoch seconds or ISO 8601; default last hour), tolerance (meters, optional),
+    format (columnar | polyline)
+    """
+    try:
+        end = _parse_time(request.args.get("to")) or datetime.utcnow()
+        start = _parse_time(request.args.get("from")) or end - timedelta(hours=1)
+    # Epoch seconds past what datetime can hold raise OverflowError (or OSError from the platform)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({"error": "from/to must be epoch seconds or ISO 8601"}), 400
+    if start >= end:
+        return jsonify({"error": "from must be before to"}), 400
+    if end - start > MAX_TRACK_SPAN:
+        return jsonify({"error": f"range exceeds {int(MAX_TRACK_SPAN.total_seconds() // 3600)} hours"}), 400
+    fmt = request.args.get("format", "columnar")
+    if fmt not in TRACK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(TRACK_FORMATS)}"}), 400
+    tolerance = max(request.args.get("tolerance", 0.0, type=float), 0.0)
+
+    # Without the retention job nothing is downsampled, so every range is read raw
+    keep_days = current_app.config.get("POSITION_RETENTION_DAYS") if current_app.config.get("RETENTION_JOBS_ENABLED") else None
+    with get_db_session() as session:
+        track = read_track(session, bus_id, start, end, keep_days=keep_days)
+    return jsonify(columnar_payload(bus_id, simplify(track, tolerance), fmt))
@@ -1,36 +1,257 @@
 from flask import Blueprint, Response, jsonify, request
-from services.realtime import hub, Position
+from services.matching import map_matcher
+from services.persistence import position_writer
+from services.realtime import DEFAULT_BUFFER_SIZE, DEFAULT_NEAREST_K, DROP_OLDEST, DROP_POLICIES, hub, Position, PositionFilter
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
+import json
+import math
 import time
 
 
 bp = Blueprint("realtime", __name__)
 
 
+# Largest k accepted for nearest-bus queries
+MAX_NEAREST_K = 500
+
+
+def _parse_floats(value: str, count: int, name: str) -> Tuple[float, ...]:
+    try:
+        parts = tuple(float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError(f"{name} must be {count} comma-separated numbers")
+    if len(parts) != count:
+        raise ValueError(f"{name} must be {count} comma-separated numbers")
+    return parts
+
+
+def parse_filter(args) -> PositionFilter:
+    """bbox=minLon,minLat,maxLon,maxLat (Leaflet toBBoxString order), near=lat,lon, k=N."""
+    bbox = None
+    near = None
+    if args.get("bbox"):
+        bbox = _parse_floats(args["bbox"], 4, "bbox")
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+    if args.get("near"):
+        near = _parse_floats(args["near"], 2, "near")
+    k = min(max(args.get("k", DEFAULT_NEAREST_K, type=int), 1), MAX_NEAREST_K)
+    return PositionFilter(
+        bus_id=args.get("bus_id", type=int),
+        route_id=args.get("route_id", type=int),
+        bbox=bbox,
+        near=near,
+        k=k,
+    )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def positions_payload(args, if_none_match: Optional[str] = None) -> Tuple[int, str, Dict[str, str]]:
+    """(status, JSON body, headers) for GET /api/positions, shared by the Flask and ASGI apps.
+
+    Responses carry an ETag of the hub's epoch and sequence; a matching
+    If-None-Match gets 304 without touching the snapshot. The unfiltered
+    snapshot is served from the hub's pre-serialized cache. With since=<seq>
+    (and the epoch from the previous response) only buses changed after that
+    sequence are returned, as {"epoch", "seq", "full", "positions", "removed"};
+    full is true when the cursor came from another process and everything
+    was sent. `removed` lists buses that went offline since then.
+    """
+    filt = parse_filter(args)
+    since = args.get("since", type=int)
+    if since is not None and filt.near is not None:
+        raise ValueError("since cannot be combined with near")
+
+    etag = f'"{hub.epoch}-{hub.seq}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return 304, "", headers
+
+    if since is not None:
+        epoch = args.get("epoch")
+        # A cursor from another process (or an earlier run) means nothing; send everything
+        seq, full, positions, removed = hub.changes_json(since, filt, full=epoch is not None and epoch != hub.epoch)
+        body = (
+            f'{{"epoch": "{hub.epoch}", "seq": {seq}, "full": {"true" if full else "false"}, '
+            f'"positions": {positions}, "removed": {json.dumps(removed)}}}'
+        )
+    elif filt.is_empty():
+        seq, body = hub.snapshot_json()
+    else:
+        seq = hub.seq
+        body = json.dumps(hub.get_snapshot(route_id=filt.route_id, bus_id=filt.bus_id, bbox=filt.bbox, near=filt.near, k=filt.k))
+    headers["ETag"] = f'"{hub.epoch}-{seq}"'
+    return 200, body, headers
+
+
 @bp.get("/api/positions")
 def get_positions():
-    route_id = request.args.get("route_id", type=int)
-    bus_id = request.args.get("bus_id", type=int)
-    return jsonify(hub.get_snapshot(route_id=route_id, bus_id=bus_id))
+    try:
+        status, body, headers = positions_payload(request.args, request.headers.get("If-None-Match"))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return Response(body or None, status=status, mimetype="application/json", headers=headers)
+
+
+# Upper bound on records accepted by one batch request
+MAX_BATCH_SIZE = 50000
+# Reported timestamps further than this from the server clock are rejected
+MAX_CLOCK_SKEW_SECONDS = 24 * 3600
+
+
+def _finite(value, name: str) -> float:
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a finite number")
+    return number
+
+
+def _bus_id(value) -> int:
+    bus_id = int(value)
+    # Sent as a u32 on the binary WebSocket feed
+    if not 0 <= bus_id < 2 ** 32:
+        raise ValueError("bus_id must be between 0 and 4294967295")
+    return bus_id
+
+
+def parse_position(data: dict, now: Optional[float] = None) -> Position:
+    """Raises KeyError for a missing field, TypeError/ValueError/OverflowError for a bad one."""
+    now = now or time.time()
+    latitude = _finite(data["latitude"], "latitude")
+    longitude = _finite(data["longitude"], "longitude")
+    if not -90.0 <= latitude <= 90.0:
+        raise ValueError("latitude must be between -90 and 90")
+    if not -180.0 <= longitude <= 180.0:
+        raise ValueError("longitude must be between -180 and 180")
+    timestamp = _finite(data.get("timestamp") or now, "timestamp")
+    if abs(timestamp - now) > MAX_CLOCK_SKEW_SECONDS:
+        raise ValueError("timestamp must be within a day of the server clock")
+    return Position(
+        bus_id=_bus_id(data["bus_id"]),
+        latitude=latitude,
+        longitude=longitude,
+        heading=_finite(data.get("heading"), "heading") if data.get("heading") is not None else None,
+        speed=_finite(data.get("speed"), "speed") if data.get("speed") is not None else None,
+        timestamp=timestamp,
+    )
 
 
 @bp.post("/api/positions")
 def post_position():
     data = request.get_json(force=True)
-    pos = Position(
-        bus_id=int(data["bus_id"]),
-        latitude=float(data["latitude"]),
-        longitude=float(data["longitude"]),
-        heading=float(data.get("heading")) if data.get("heading") is not None else None,
-        speed=float(data.get("speed")) if data.get("speed") is not None else None,
-        timestamp=float(data.get("timestamp") or time.time()),
-    )
-    hub.update_position(pos)
+    try:
+        position = parse_position(data)
+    except KeyError as exc:
+        return jsonify({"error": f"missing field {exc.args[0]}"}), 400
+    except (TypeError, ValueError, OverflowError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    hub.update_position(position)
     return jsonify({"ok": True})
 
 
+def decode_batch(body: str, mimetype: str) -> List:
+    """Records from a JSON array ({"positions": [...]} also accepted) or an NDJSON body."""
+    if mimetype in ("application/x-ndjson", "application/jsonl"):
+        records = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as exc:
+                records.append(exc)
+        return records
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get("positions")
+    if not isinstance(data, list):
+        raise ValueError("expected a JSON array of positions")
+    return data
+
+
+def parse_batch(records: List, now: float) -> Tuple[List[Position], List[dict]]:
+    """Valid positions plus per-record errors ({"index", "error"})."""
+    positions: List[Position] = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            if not isinstance(record, dict):
+                raise ValueError("record must be an object")
+            positions.append(parse_position(record, now))
+        except KeyError as exc:
+            errors.append({"index": index, "error": f"missing field {exc.args[0]}"})
+        except (TypeError, ValueError, OverflowError) as exc:
+            errors.append({"index": index, "error": str(exc)})
+    return positions, errors
+
+
+@bp.post("/api/positions/batch")
+def post_positions_batch():
+    try:
+        records = decode_batch(request.get_data(as_text=True), request.mimetype)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"batch exceeds {MAX_BATCH_SIZE} records"}), 413
+
+    positions, errors = parse_batch(records, time.time())
+    ingested = hub.update_positions(positions)
+    return jsonify({
+        "ok": not errors,
+        "accepted": len(ingested),
+        "rejected": len(errors),
+        # Parsed but dropped by map matching as physically impossible jumps
+        "discarded": len(positions) - len(ingested),
+        "errors": errors,
+    })
+
+
 @bp.get("/api/stream/positions")
-def stream_positions():
-    sub = hub.subscribe()
+@bp.get("/api/stream/routes/<int:route_id>/positions")
+def stream_positions(route_id: Optional[int] = None):
+    policy = request.args.get("policy", DROP_OLDEST)
+    if policy not in DROP_POLICIES:
+        return jsonify({"error": f"policy must be one of {', '.join(DROP_POLICIES)}"}), 400
+    maxlen = min(max(request.args.get("buffer", DEFAULT_BUFFER_SIZE, type=int), 1), 4096)
+    try:
+        filt = parse_filter(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if route_id is not None:
+        filt = replace(filt, route_id=route_id)
+    sub = hub.subscribe(maxlen=maxlen, policy=policy, filter=filt)
     return Response(sub.stream(), mimetype="text/event-stream")
 
 
+@bp.get("/api/positions/stats")
+def position_stats():
+    return jsonify({
+        "buses": hub.bus_count(),
+        "presence": hub.presence(),
+        "matching": map_matcher.stats(),
+        "writer": position_writer.stats(),
+        "transport": hub.transport_stats(),
+    })
+
+
+@bp.get("/api/stream/stats")
+def stream_stats():
+    subscribers = hub.subscriber_stats()
+    return jsonify({
+        "subscribers": len(subscribers),
+        "pending": sum(s["pending"] for s in subscribers),
+        "dropped": sum(s["dropped"] for s in subscribers),
+        "clients": subscribers,
+    })
+
+
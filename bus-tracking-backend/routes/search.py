@@ -1,23 +1,45 @@
-import csv
-import os
 from flask import Blueprint, jsonify, request
 
+from services.journey import Journey, format_hhmm, parse_hhmm, planner
+from services.stop_index import stop_index
+from services.timetable import timetable
+
 bp = Blueprint("search", __name__)
 
-# Load routes data from CSV
-def load_routes_data():
-    routes_data = []
-    csv_path = os.path.join(os.path.dirname(__file__), "..", "data", "routes.csv")
-    
-    try:
-        with open(csv_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                routes_data.append(row)
-    except FileNotFoundError:
-        print(f"Routes CSV not found at {csv_path}")
-    
-    return routes_data
+
+def _fare(stops_traveled: int) -> int:
+    return max(10, stops_traveled * 5)
+
+
+def _resolve_ids(name: str):
+    return [alias for stop_id in stop_index.resolve(name) for alias in stop_index.aliases(stop_id)]
+
+
+def _journey_result(journey: Journey) -> dict:
+    legs = []
+    for leg in journey.legs:
+        stops_traveled = leg.to_index - leg.from_index
+        legs.append({
+            "serviceName": f"Bus {leg.bus_id}",
+            "departureTime": format_hhmm(leg.departure),
+            "arrivalTime": format_hhmm(leg.arrival),
+            "fare": _fare(stops_traveled),
+            "fromStop": stop_index.name_of(leg.from_stop_id) or leg.from_stop_id,
+            "toStop": stop_index.name_of(leg.to_stop_id) or leg.to_stop_id,
+            "stops": stops_traveled,
+        })
+    return {
+        "serviceName": " → ".join(leg["serviceName"] for leg in legs),
+        "departureTime": legs[0]["departureTime"],
+        "arrivalTime": legs[-1]["arrivalTime"],
+        "fare": sum(leg["fare"] for leg in legs),
+        "fromStop": legs[0]["fromStop"],
+        "toStop": legs[-1]["toStop"],
+        "stops": sum(leg["stops"] for leg in legs),
+        "transfers": journey.transfers,
+        "legs": legs,
+    }
+
 
 @bp.get("/api/search/bus")
 def search_bus():
@@ -27,65 +49,45 @@ def search_bus():
     from_name = request.args.get("fromPlaceName", "").strip().lower()
     to_name = request.args.get("toPlaceName", "").strip().lower()
     date = request.args.get("journeyDate", "today")
-    
-    routes_data = load_routes_data()
+
     results = []
-    
-    # Find routes that go from source to destination
-    for route in routes_data:
-        stop_name = route['stop_name'].lower()
-        
-        # Check if this route passes through the from/to stops
-        if from_name in stop_name or to_name in stop_name:
-            # Find the bus route and calculate journey details
-            bus_id = route['bus_id']
-            
-            # Get all stops for this bus
-            bus_stops = [r for r in routes_data if r['bus_id'] == bus_id]
-            
-            # Find from and to stop indices
-            from_stop = None
-            to_stop = None
-            
-            for i, stop in enumerate(bus_stops):
-                if from_name in stop['stop_name'].lower():
-                    from_stop = stop
-                if to_name in stop['stop_name'].lower():
-                    to_stop = stop
-            
-            # If we found both stops, support both forward and reverse direction
-            if from_stop and to_stop:
-                from_idx = next(i for i, s in enumerate(bus_stops) if s['stop_id'] == from_stop['stop_id'])
-                to_idx = next(i for i, s in enumerate(bus_stops) if s['stop_id'] == to_stop['stop_id'])
-
-                if from_idx < to_idx:
-                    # Forward direction
-                    stops_traveled = to_idx - from_idx
-                    fare = max(10, stops_traveled * 5)
-                    results.append({
-                        "serviceName": f"Bus {bus_id}",
-                        "departureTime": from_stop['departure_time'],
-                        "arrivalTime": to_stop['arrival_time'],
-                        "fare": fare,
-                        "fromStop": from_stop['stop_name'],
-                        "toStop": to_stop['stop_name'],
-                        "stops": stops_traveled,
-                    })
-                elif from_idx > to_idx:
-                    # Reverse direction (assume same service operates both ways)
-                    stops_traveled = from_idx - to_idx
-                    fare = max(10, stops_traveled * 5)
-                    # Swap for reverse travel times if present; otherwise keep placeholders
-                    results.append({
-                        "serviceName": f"Bus {bus_id} (Reverse)",
-                        "departureTime": from_stop.get('departure_time') or from_stop.get('arrival_time') or "",
-                        "arrivalTime": to_stop.get('arrival_time') or to_stop.get('departure_time') or "",
-                        "fare": fare,
-                        "fromStop": from_stop['stop_name'],
-                        "toStop": to_stop['stop_name'],
-                        "stops": stops_traveled,
-                    })
-    
+
+    # Resolve both ends to canonical stop ids, then compare stop indices per bus
+    from_ids = _resolve_ids(from_name)
+    to_ids = _resolve_ids(to_name)
+    for bus_id, from_idx, to_idx in timetable.find_direct(from_ids, to_ids):
+        bus_stops = timetable.bus_stops(bus_id)
+        from_stop = bus_stops[from_idx]
+        to_stop = bus_stops[to_idx]
+
+        if from_idx < to_idx:
+            # Forward direction
+            stops_traveled = to_idx - from_idx
+            fare = _fare(stops_traveled)
+            results.append({
+                "serviceName": f"Bus {bus_id}",
+                "departureTime": from_stop.departure_time,
+                "arrivalTime": to_stop.arrival_time,
+                "fare": fare,
+                "fromStop": from_stop.stop_name,
+                "toStop": to_stop.stop_name,
+                "stops": stops_traveled,
+            })
+        else:
+            # Reverse direction (assume same service operates both ways)
+            stops_traveled = from_idx - to_idx
+            fare = _fare(stops_traveled)
+            # Swap for reverse travel times if present; otherwise keep placeholders
+            results.append({
+                "serviceName": f"Bus {bus_id} (Reverse)",
+                "departureTime": from_stop.departure_time or from_stop.arrival_time or "",
+                "arrivalTime": to_stop.arrival_time or to_stop.departure_time or "",
+                "fare": fare,
+                "fromStop": from_stop.stop_name,
+                "toStop": to_stop.stop_name,
+                "stops": stops_traveled,
+            })
+
     # Remove duplicates and sort by departure time
     seen = set()
     unique_results = []
@@ -94,33 +96,28 @@ def search_bus():
         if key not in seen:
             seen.add(key)
             unique_results.append(result)
-    
+
     # Sort by departure time
     unique_results.sort(key=lambda x: x['departureTime'])
-    
-    # If no results found, return some default options
+
+    # No single bus covers the trip: fall back to journeys with transfers
     if not unique_results:
-        unique_results = [
-            {
-                "serviceName": f"{from_name.title()} → {to_name.title()} Local",
-                "departureTime": "08:00",
-                "arrivalTime": "08:30",
-                "fare": 15,
-                "fromStop": from_name.title(),
-                "toStop": to_name.title(),
-                "stops": 3
-            },
-            {
-                "serviceName": f"{from_name.title()} → {to_name.title()} Express",
-                "departureTime": "09:00",
-                "arrivalTime": "09:20",
-                "fare": 20,
-                "fromStop": from_name.title(),
-                "toStop": to_name.title(),
-                "stops": 2
-            }
-        ]
-    
+        unique_results = [_journey_result(j) for j in planner.plan(from_ids, to_ids)]
+
     return jsonify({"date": date, "results": unique_results})
 
 
+@bp.get("/api/search/journey")
+def search_journey():
+    """Earliest-arrival journeys with transfers.
+    Query: fromPlaceName, toPlaceName, departAfter (HH:MM, optional), maxTransfers (optional, max 3)
+    """
+    from_ids = _resolve_ids(request.args.get("fromPlaceName", ""))
+    to_ids = _resolve_ids(request.args.get("toPlaceName", ""))
+    depart_after = parse_hhmm(request.args.get("departAfter", "00:00"))
+    if depart_after is None:
+        return jsonify({"error": "departAfter must be HH:MM"}), 400
+    max_transfers = min(max(request.args.get("maxTransfers", 2, type=int), 0), 3)
+
+    journeys = planner.plan(from_ids, to_ids, depart_after=depart_after, max_transfers=max_transfers)
+    return jsonify({"results": [_journey_result(j) for j in journeys]})
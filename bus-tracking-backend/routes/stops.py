@@ -0,0 +1,18 @@
+from dataclasses import asdict
+
+from flask import Blueprint, jsonify, request
+
+from services.stop_index import stop_index
+
+
+bp = Blueprint("stops", __name__)
+
+
+@bp.get("/api/stops/suggest")
+def suggest_stops():
+    """Autocomplete stop names.
+    Query: q, limit (optional, max 50)
+    """
+    query = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+    return jsonify([asdict(m) for m in stop_index.suggest(query, limit=limit)])
@@ -0,0 +1,186 @@
+import math
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set
+
+from services.eta import EtaEngine, eta_engine
+from services.realtime import COALESCE, Position, RealtimeHub, Subscriber, encode_event, hub
+
+
+# Arrivals listed per board
+BOARD_SIZE = 5
+BOARD_BUFFER_SIZE = 8
+
+
+class ArrivalBoards:
+    """Per-stop arrival boards pushed to SSE subscribers.
+
+    Only stops with at least one subscriber are tracked. On every hub update
+    the moved bus's ETAs are recomputed for the watched stops downstream of it
+    (plus the ones it just passed, to drop it from them); a board is
+    re-rendered only for those stops and published only when its frame differs
+    from the last one sent.
+    """
+
+    def __init__(self, engine: EtaEngine = eta_engine, realtime: RealtimeHub = hub, size: int = BOARD_SIZE) -> None:
+        self._engine = engine
+        self._hub = realtime
+        self.size = size
+        self._lock = Lock()
+        self._subscribers: Dict[int, List[Subscriber]] = {}
+        # stop -> {bus: eta seconds}, for watched stops only
+        self._etas: Dict[int, Dict[int, float]] = {}
+        # bus -> watched stops currently listing it
+        self._bus_stops: Dict[int, Set[int]] = {}
+        # route -> number of watched stops on it
+        self._watched_routes: Dict[int, int] = {}
+        self._frames: Dict[int, str] = {}
+        self.renders = 0
+        self.published = 0
+
+    def serves(self, stop_id: int) -> bool:
+        return bool(self._engine.routes_serving(stop_id))
+
+    def subscribe(self, stop_id: int) -> Subscriber:
+        sub = Subscriber(maxlen=BOARD_BUFFER_SIZE, policy=COALESCE)
+        with self._lock:
+            if stop_id not in self._subscribers:
+                self._watch_locked(stop_id)
+            self._subscribers.setdefault(stop_id, []).append(sub)
+            frame = self._frames.get(stop_id) or self._render_locked(stop_id)
+            self._frames[stop_id] = frame
+        sub.publish(frame, {stop_id: frame})
+
+        def _on_close():
+            with self._lock:
+                subs = self._subscribers.get(stop_id)
+                if subs is None or sub not in subs:
+                    return
+                subs.remove(sub)
+                if not subs:
+                    del self._subscribers[stop_id]
+                    self._unwatch_locked(stop_id)
+        sub.on_close = _on_close
+        return sub
+
+    def _watch_locked(self, stop_id: int) -> None:
+        etas: Dict[int, float] = {}
+        for route_id in self._engine.routes_serving(stop_id):
+            self._watched_routes[route_id] = self._watched_routes.get(route_id, 0) + 1
+            for bus_id in self._hub.buses_on_route(route_id):
+                eta = self._engine.eta_seconds(bus_id, stop_id)
+                if eta is not None:
+                    etas[bus_id] = eta
+                    self._bus_stops.setdefault(bus_id, set()).add(stop_id)
+        self._etas[stop_id] = etas
+
+    def _unwatch_locked(self, stop_id: int) -> None:
+        for route_id in self._engine.routes_serving(stop_id):
+            remaining = self._watched_routes.get(route_id, 0) - 1
+            if remaining > 0:
+                self._watched_routes[route_id] = remaining
+            else:
+                self._watched_routes.pop(route_id, None)
+        for bus_id in self._etas.pop(stop_id, {}):
+            stops = self._bus_stops.get(bus_id)
+            if stops is not None:
+                stops.discard(stop_id)
+                if not stops:
+                    del self._bus_stops[bus_id]
+        self._frames.pop(stop_id, None)
+
+    def observe(self, positions: Iterable[Position]) -> None:
+        """Refresh the boards affected by these buses."""
+        if not self._subscribers:
+            return
+        with self._lock:
+            changed: Set[int] = set()
+            for pos in positions:
+                self._update_bus_locked(pos.bus_id, changed)
+            for stop_id in changed:
+                self._publish_locked(stop_id)
+
+    def observe_flush(self, batch: Dict[int, Position]) -> None:
+        """Hub flush listener: runs on the dispatcher thread, after the ETA engine has seen the batch."""
+        self.observe(batch.values())
+
+    def drop_buses(self, bus_ids: List[int]) -> None:
+        """Hub offline listener: remove expired buses from every board listing them."""
+        if not self._subscribers:
+            return
+        with self._lock:
+            changed: Set[int] = set()
+            for bus_id in bus_ids:
+                stops = self._bus_stops.pop(bus_id, set())
+                for stop_id in stops:
+                    board = self._etas.get(stop_id)
+                    if board is not None:
+                        board.pop(bus_id, None)
+                changed |= stops
+            for stop_id in changed:
+                self._publish_locked(stop_id)
+
+    def _update_bus_locked(self, bus_id: int, changed: Set[int]) -> None:
+        previous = self._bus_stops.get(bus_id, set())
+        route_id = self._hub.route_of(bus_id)
+        current: Set[int] = set()
+        if route_id in self._watched_routes:
+            result = self._engine.bus_etas(bus_id)
+            if result is not None:
+                geom, nxt, etas = result
+                for stop_id, eta in zip(geom.stop_ids[nxt:].tolist(), etas.tolist()):
+                    board = self._etas.get(stop_id)
+                    if board is not None:
+                        board[bus_id] = eta
+                        current.add(stop_id)
+        # Stops the bus has passed (or left the route of) no longer list it
+        for stop_id in previous - current:
+            board = self._etas.get(stop_id)
+            if board is not None:
+                board.pop(bus_id, None)
+        if current:
+            self._bus_stops[bus_id] = current
+        else:
+            self._bus_stops.pop(bus_id, None)
+        changed |= current
+        changed |= previous
+
+    def _render_locked(self, stop_id: int) -> str:
+        self.renders += 1
+        board = self._etas.get(stop_id, {})
+        soonest = sorted(board.items(), key=lambda item: item[1])[: self.size]
+        arrivals = [
+            {
+                "bus_id": bus_id,
+                "route_id": self._hub.route_of(bus_id),
+                # Boards show whole minutes, so sub-minute jitter does not re-emit them
+                "eta": max(0, int(math.ceil(eta / 60.0))),
+            }
+            for bus_id, eta in soonest
+        ]
+        return encode_event({"type": "arrivals", "stop_id": stop_id, "arrivals": arrivals})
+
+    def _publish_locked(self, stop_id: int) -> None:
+        subs = self._subscribers.get(stop_id)
+        if not subs:
+            return
+        frame = self._render_locked(stop_id)
+        if frame == self._frames.get(stop_id):
+            return
+        self._frames[stop_id] = frame
+        self.published += 1
+        parts = {stop_id: frame}
+        for sub in subs:
+            sub.publish(frame, parts)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "stops": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "tracked_buses": len(self._bus_stops),
+                "renders": self.renders,
+                "published": self.published,
+            }
+
+
+arrival_boards = ArrivalBoards()
@@ -0,0 +1,440 @@
+import fcntl
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from threading import Condition, Lock, Thread
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMIT_INTERVAL = 0.05
+DEFAULT_COMMIT_BATCH = 500
+# Rewrite the write-ahead file as a counter snapshot once it grows past this
+DEFAULT_COMPACT_BYTES = 64 * 1024 * 1024
+# Pause before retrying a group commit the database refused
+RETRY_DELAY = 1.0
+MAX_SEATS_PER_BOOKING = 10
+# Service days open for booking, counted from today
+DEFAULT_ADVANCE_DAYS = 30
+
+
+class BookingError(Exception):
+    """A booking the engine refuses; the message is safe to return to clients."""
+
+
+class UnknownBus(BookingError):
+    pass
+
+
+class SoldOut(BookingError):
+    pass
+
+
+class InventoryUnavailable(BookingError):
+    """The engine is not open here (not started, or another process owns the inventory)."""
+
+
+@dataclass(slots=True)
+class Booking:
+    seq: int
+    user_id: int
+    bus_id: int
+    trip: str
+    seats: int
+    fare: float
+    # Whole seconds, so a DATETIME column stores it exactly
+    booked_at: str
+    recovered: bool = False
+
+
+TripKey = Tuple[int, str]
+Writer = Callable[[List[Booking]], None]
+
+
+class BookingEngine:
+    """Seat reservations against in-memory per-(bus, trip) counters, persisted by group commit.
+
+    book() checks and bumps the trip's counter under one lock, so two
+    requests can never both take the last seat, and appends the booking to
+    a write-ahead file (a single O_APPEND write). It returns only once the
+    file has been fsynced past the booking. fsyncs are group commits: one
+    caller syncs on behalf of everyone who appended meanwhile, so a burst
+    of bookings shares a few fsyncs. A background thread hands everything
+    queued to `writer` as one batch (one transaction), then logs a commit
+    marker. On start the file is replayed: counters come back from it, and
+    bookings past the last marker are committed again, marked `recovered`
+    so the writer can skip the ones (by seq) that did reach the database.
+
+    Counters live in one process. An exclusive lock on `<wal>.lock` stops a
+    second process from opening the same inventory, which could oversell.
+    """
+
+    def __init__(
+        self,
+        commit_interval: float = DEFAULT_COMMIT_INTERVAL,
+        batch_size: int = DEFAULT_COMMIT_BATCH,
+        compact_bytes: int = DEFAULT_COMPACT_BYTES,
+        advance_days: int = DEFAULT_ADVANCE_DAYS,
+    ) -> None:
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.compact_bytes = compact_bytes
+        self.advance_days = advance_days
+        self._lock = Lock()
+        self._capacity: Dict[int, int] = {}
+        self._booked: Dict[TripKey, int] = {}
+        self._seq = 0
+        self._writer: Optional[Writer] = None
+        self._wal_path: Optional[str] = None
+        self._wal_fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._queue: Deque[Booking] = deque()
+        self._cond = Condition()
+        # Write-ahead file durable up to this seq; one thread at a time runs the fsync
+        self._sync_cond = Condition()
+        self._synced_seq = 0
+        self._syncing = False
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+        self.booked_total = 0
+        self.refused = 0
+        self.committed = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.last_commit_ms = 0.0
+        self.fsyncs = 0
+
+    def configure(self, commit_interval: float, batch_size: int, advance_days: Optional[int] = None) -> None:
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        if advance_days is not None:
+            self.advance_days = advance_days
+
+    @property
+    def is_open(self) -> bool:
+        return self._wal_fd is not None
+
+    def load_capacities(self, capacities: Dict[int, int]) -> None:
+        """Seats per bus; later loads override earlier ones for the same bus."""
+        with self._lock:
+            self._capacity.update({bus_id: seats for bus_id, seats in capacities.items() if seats and seats > 0})
+
+    def open(self, wal_path: str, writer: Writer, min_seq: int = 0) -> None:
+        """Take ownership of the inventory in `wal_path`, replay it and start committing.
+
+        Seqs continue after `min_seq` (the highest the writer has stored), so
+        they stay unique even if the write-ahead file was lost.
+        """
+        lock_fd = os.open(wal_path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            raise InventoryUnavailable("seat inventory is owned by another process")
+        with self._lock:
+            self._lock_fd = lock_fd
+            self._wal_path = wal_path
+            self._writer = writer
+            pending = self._replay_locked(wal_path)
+            self._seq = max(self._seq, min_seq)
+            self._synced_seq = self._seq
+            self._wal_fd = os.open(wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if pending:
+            logger.info("Re-committing %d bookings from %s", len(pending), wal_path)
+            with self._cond:
+                self._queue.extend(pending)
+                self._ensure_thread()
+
+    def _replay_locked(self, wal_path: str) -> List[Booking]:
+        pending: Dict[int, Booking] = {}
+        if not os.path.exists(wal_path):
+            return []
+        with open(wal_path, encoding="utf-8") as wal:
+            for line in wal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write was never acknowledged
+                    logger.warning("Skipping unreadable booking log line")
+                    continue
+                if "book" in record or "pending" in record:
+                    booking = Booking(**(record.get("book") or record["pending"]), recovered=True)
+                    if "book" in record:
+                        key = (booking.bus_id, booking.trip)
+                        self._booked[key] = self._booked.get(key, 0) + booking.seats
+                    self._seq = max(self._seq, booking.seq)
+                    pending[booking.seq] = booking
+                elif "commit" in record:
+                    upto = record["commit"]
+                    for seq in [s for s in pending if s <= upto]:
+                        del pending[seq]
+                elif "counts" in record:
+                    self._booked = {(bus_id, trip): n for bus_id, trip, n in record["counts"]}
+                    self._seq = max(self._seq, record["seq"])
+        return sorted(pending.values(), key=lambda b: b.seq)
+
+    def remaining(self, bus_id: int, trip: Optional[str] = None) -> Optional[int]:
+        with self._lock:
+            capacity = self._capacity.get(bus_id)
+            if capacity is None:
+                return None
+            return capacity - self._booked.get((bus_id, trip or default_trip()), 0)
+
+    def book(self, user_id: int, bus_id: int, fare: float, trip: Optional[str] = None, seats: int = 1) -> Booking:
+        if not 1 <= seats <= MAX_SEATS_PER_BOOKING:
+            raise BookingError(f"seats must be between 1 and {MAX_SEATS_PER_BOOKING}")
+        trip = parse_trip(trip, self.advance_days)
+        key = (bus_id, trip)
+        with self._lock:
+            if self._wal_fd is None:
+                raise InventoryUnavailable("booking engine is not open")
+            capacity = self._capacity.get(bus_id)
+            if capacity is None:
+                self.refused += 1
+                raise UnknownBus(f"no seat inventory for bus {bus_id}")
+            taken = self._booked.get(key, 0)
+            if taken + seats > capacity:
+                self.refused += 1
+                raise SoldOut(f"only {capacity - taken} seats left on bus {bus_id} for trip {trip}")
+            booking = Booking(
+                seq=self._seq + 1,
+                user_id=user_id,
+                bus_id=bus_id,
+                trip=trip,
+                seats=seats,
+                fare=fare,
+                booked_at=datetime.now().replace(microsecond=0).isoformat(),
+            )
+            # Logged inside the lock so the file is in seq order; nothing is reserved if it fails
+            self._append_locked({"book": _record(booking)})
+            self._seq = booking.seq
+            self._booked[key] = taken + seats
+            self.booked_total += seats
+            # Queued under the same lock, so compaction never sees it counted but not pending
+            with self._cond:
+                self._queue.append(booking)
+                self._ensure_thread()
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify()
+        # Acknowledged only once durable: a crash after this cannot sell the seat again
+        self._sync_to(booking.seq)
+        return booking
+
+    def _sync_to(self, seq: int) -> None:
+        with self._sync_cond:
+            while self._synced_seq < seq:
+                if self._syncing:
+                    # Another caller's fsync is running; it may already cover `seq`
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                # Everything up to the current seq is already written (seq is bumped after the append)
+                target = self._seq
+                fd = self._wal_fd
+                self._sync_cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self.fsyncs += 1
+                self._synced_seq = max(self._synced_seq, target)
+
+    def _append_locked(self, record: dict) -> None:
+        os.write(self._wal_fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+
+    def _ensure_thread(self) -> None:
+        # Started lazily so a forked worker gets its own thread
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = Thread(target=self._run, name="booking-commit", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size and not self._stopped:
+                    self._cond.wait(timeout=self.commit_interval)
+                if self._stopped and not self._queue:
+                    return
+            if not self.commit() and self._queue:
+                time.sleep(RETRY_DELAY)
+
+    def commit(self) -> bool:
+        """Group-commit everything queued right now, batch_size bookings per transaction.
+
+        Returns False if the writer failed; the batch stays queued (and in the
+        write-ahead file) for the next attempt.
+        """
+        while True:
+            with self._cond:
+                if not self._queue:
+                    break
+                batch = [self._queue[i] for i in range(min(len(self._queue), self.batch_size))]
+            started = time.perf_counter()
+            self._sync_to(batch[-1].seq)
+            try:
+                self._writer(batch)
+            except Exception:
+                self.failed_commits += 1
+                logger.exception("Failed to commit %d bookings", len(batch))
+                return False
+            with self._lock:
+                self._append_locked({"commit": batch[-1].seq})
+            with self._cond:
+                for _ in batch:
+                    self._queue.popleft()
+            self.committed += len(batch)
+            self.commits += 1
+            self.last_commit_ms = (time.perf_counter() - started) * 1000
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self) -> None:
+        if os.fstat(self._wal_fd).st_size < self.compact_bytes:
+            return
+        with self._lock, self._cond, self._sync_cond:
+            # The descriptor is swapped below; never under a running fsync
+            while self._syncing:
+                self._sync_cond.wait()
+            tmp = self._wal_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as out:
+                counts = [[bus_id, trip, n] for (bus_id, trip), n in self._booked.items()]
+                out.write(json.dumps({"counts": counts, "seq": self._seq}, separators=(",", ":")) + "\n")
+                # Not yet committed: replayed for the database, already part of the counts
+                for booking in self._queue:
+                    out.write(json.dumps({"pending": _record(booking)}, separators=(",", ":")) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, self._wal_path)
+            os.close(self._wal_fd)
+            self._wal_fd = os.open(self._wal_path, os.O_WRONLY | os.O_APPEND)
+            # The snapshot was fsynced and covers every booking so far
+            self._synced_seq = self._seq
+        logger.info("Compacted booking log to %d trip counters", len(counts))
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._lock, self._sync_cond:
+            while self._syncing:
+                self._sync_cond.wait()
+            if self._wal_fd is not None:
+                os.fsync(self._wal_fd)
+                os.close(self._wal_fd)
+                self._wal_fd = None
+            self._synced_seq = self._seq
+            self._sync_cond.notify_all()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            trips = len(self._booked)
+            buses = len(self._capacity)
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "buses": buses,
+            "trips": trips,
+            "seats_booked": self.booked_total,
+            "refused": self.refused,
+            "queued": queued,
+            "committed": self.committed,
+            "commits": self.commits,
+            "failed_commits": self.failed_commits,
+            "fsyncs": self.fsyncs,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+        }
+
+
+def _record(booking: Booking) -> dict:
+    record = asdict(booking)
+    del record["recovered"]
+    return record
+
+
+def default_trip() -> str:
+    # Without an explicit trip, a bus's seats are sold per service day
+    return date.today().isoformat()
+
+
+def parse_trip(trip: Optional[str], advance_days: int = DEFAULT_ADVANCE_DAYS) -> str:
+    """A trip is a service day: an ISO date from today to `advance_days` ahead (default today).
+
+    Anything else would open a fresh seat counter for the bus, so it is refused.
+    """
+    if trip is None or trip == "":
+        return default_trip()
+    if not isinstance(trip, str):
+        raise BookingError("trip must be a service date (YYYY-MM-DD)")
+    try:
+        day = date.fromisoformat(trip)
+    except ValueError:
+        raise BookingError("trip must be a service date (YYYY-MM-DD)")
+    today = date.today()
+    last = today + timedelta(days=advance_days)
+    if not today <= day <= last:
+        raise BookingError(f"trip must be between {today.isoformat()} and {last.isoformat()}")
+    return day.isoformat()
+
+
+def capacities_from_buses(session) -> Dict[int, int]:
+    from models import Bus
+
+    return {bus_id: capacity for bus_id, capacity in session.query(Bus.id, Bus.capacity) if capacity}
+
+
+def capacities_from_mongo(collection, plates: Dict[str, int]) -> Dict[int, int]:
+    """`seats` of imported bus documents (utils/import_buses.py), matched to Bus ids by plate/bus_number."""
+    seats: Dict[int, int] = {}
+    for doc in collection.find({"seats": {"$gt": 0}}, {"bus_number": 1, "seats": 1, "_id": 0}):
+        bus_id = plates.get(str(doc.get("bus_number") or "").strip().upper())
+        if bus_id is not None:
+            seats[bus_id] = int(doc["seats"])
+    return seats
+
+
+def bus_plates(session) -> Dict[str, int]:
+    from models import Bus
+
+    return {plate.strip().upper(): bus_id for bus_id, plate in session.query(Bus.id, Bus.plate)}
+
+
+def seed_inventory(engine: "BookingEngine", session, collection: Optional[object] = None) -> None:
+    """Mongo `seats` fill in buses whose Bus.capacity is unset; Bus.capacity wins otherwise."""
+    capacities: Dict[int, int] = {}
+    if collection is not None:
+        capacities.update(capacities_from_mongo(collection, bus_plates(session)))
+    capacities.update(capacities_from_buses(session))
+    engine.load_capacities(capacities)
+    logger.info("Loaded seat capacity for %d buses", len(capacities))
+
+
+def ticket_rows(bookings: Iterable[Booking]) -> List[dict]:
+    """One tickets row per seat, as the legacy table expects."""
+    return [
+        {
+            "user_id": b.user_id,
+            "bus_id": b.bus_id,
+            "trip": b.trip,
+            "fare": b.fare,
+            "timestamp": datetime.fromisoformat(b.booked_at),
+        }
+        for b in bookings
+        for _ in range(b.seats)
+    ]
+
+
+booking_engine = BookingEngine()
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Condition, Lock, Thread
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.realtime import Position, RealtimeHub
+from services.resp import RespConnection, RespError
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "bus-tracking:positions"
+SNAPSHOT_KEY = "bus-tracking:latest"
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+# Batch ids remembered per worker to drop redelivered batches
+DEDUP_WINDOW = 4096
+
+
+def _record(pos: Position) -> list:
+    return [pos.bus_id, pos.latitude, pos.longitude, pos.heading, pos.speed, pos.timestamp, pos.progress_m, pos.next_stop_id]
+
+
+def _position(record: list) -> Position:
+    # Records from workers predating map matching carry only the first six fields
+    bus_id, lat, lon, heading, speed, ts = record[:6]
+    progress, next_stop = (record[6:8] + [None, None])[:2]
+    return Position(
+        bus_id=bus_id, latitude=lat, longitude=lon, heading=heading, speed=speed, timestamp=ts,
+        progress_m=progress, next_stop_id=next_stop,
+    )
+
+
+def encode_batch(positions: List[Position], batch_id: Optional[str] = None) -> bytes:
+    records = [_record(p) for p in positions]
+    if batch_id is None:
+        return json.dumps(records, separators=(",", ":")).encode()
+    return json.dumps({"id": batch_id, "positions": records}, separators=(",", ":")).encode()
+
+
+def decode_message(data: bytes) -> Tuple[Optional[str], List[Position]]:
+    """(batch id, positions); untagged batches (older workers) have no id."""
+    message = json.loads(data)
+    if isinstance(message, dict):
+        return message.get("id"), [_position(r) for r in message["positions"]]
+    return None, [_position(r) for r in message]
+
+
+def decode_batch(data: bytes) -> List[Position]:
+    return decode_message(data)[1]
+
+
+class RedisTransport:
+    """Hub transport over a Redis-protocol broker, for several workers or nodes.
+
+    Ingest writes the newest record per bus into a shared hash (the snapshot
+    any worker can rebuild from) and PUBLISHes the batch, in one pipelined
+    round trip. Every worker, the publishing one included, applies a batch
+    only when it arrives on its subscription, so each process sees each
+    update exactly once and every SSE client (attached to one process) gets
+    it once. After (re)subscribing, a worker reloads the snapshot hash to
+    cover anything it missed while disconnected. Buses that expire are
+    removed from the hash so a new worker does not restore them; the HDEL
+    runs on the transport's own expiry thread, not the hub dispatcher.
+
+    Every batch carries an id, and workers drop ids they have already
+    applied. A publish whose reply was lost can therefore be retried once
+    without subscribers seeing it twice. If the broker stays unreachable the
+    batch is applied locally, and its id is remembered in case the lost
+    attempt was delivered after all.
+    """
+
+    def __init__(self, url: str, channel: str = CHANNEL, snapshot_key: str = SNAPSHOT_KEY) -> None:
+        self.url = url
+        self.channel = channel
+        self.snapshot_key = snapshot_key
+        self._hub: Optional[RealtimeHub] = None
+        self._pub = RespConnection(url)
+        self._pub_lock = Lock()
+        self._sub: Optional[RespConnection] = None
+        self._thread: Optional[Thread] = None
+        self._thread_lock = Lock()
+        self._pid = os.getpid()
+        self._stopped = False
+        self._batch_prefix = os.urandom(6).hex()
+        self._batch_seq = 0
+        self._applied: "OrderedDict[str, None]" = OrderedDict()
+        self._applied_lock = Lock()
+        self._expired: Set[int] = set()
+        self._expiry_cond = Condition()
+        self._expiry_thread: Optional[Thread] = None
+        self.published = 0
+        self.received = 0
+        self.duplicates = 0
+        self.fallbacks = 0
+        self.reconnects = 0
+
+    def start(self, hub: RealtimeHub) -> None:
+        self._hub = hub
+        hub.add_offline_listener(self._on_offline)
+
+    def _check_fork(self) -> None:
+        # Sockets inherited from a pre-fork parent must not be shared with it
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._batch_prefix = os.urandom(6).hex()
+            self._pub = RespConnection(self.url)
+            self._sub = None
+            self._thread = None
+            self._expiry_thread = None
+
+    def ensure_running(self) -> None:
+        with self._thread_lock:
+            self._check_fork()
+            if self._stopped:
+                return
+            if self._expiry_thread is None or not self._expiry_thread.is_alive():
+                self._expiry_thread = Thread(target=self._run_expiry, name="realtime-broker-expiry", daemon=True)
+                self._expiry_thread.start()
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name="realtime-broker", daemon=True)
+            self._thread.start()
+            # Serve the shared snapshot straight away rather than after the subscription is up
+            try:
+                self._hub.restore_positions(self.load_snapshot())
+            except (OSError, ConnectionError, RespError) as exc:
+                logger.warning("Could not load broker snapshot: %s", exc)
+
+    def publish(self, positions: List[Position]) -> None:
+        self.ensure_running()
+        latest: Dict[int, Position] = {}
+        for pos in positions:
+            latest[pos.bus_id] = pos
+        fields: list = []
+        for bus_id, pos in latest.items():
+            fields.append(bus_id)
+            fields.append(json.dumps(_record(pos), separators=(",", ":")))
+        with self._pub_lock:
+            self._batch_seq += 1
+            batch_id = f"{self._batch_prefix}:{self._batch_seq}"
+            commands = [["HSET", self.snapshot_key, *fields], ["PUBLISH", self.channel, encode_batch(positions, batch_id)]]
+            # A retry may repeat a PUBLISH that did go out before the failure; receivers drop the duplicate
+            for attempt in range(2):
+                try:
+                    if not self._pub.connected:
+                        self._pub.connect()
+                    replies = self._pub.pipeline(commands)
+                    break
+                except (OSError, ConnectionError) as exc:
+                    self._pub.close()
+                    if attempt:
+                        logger.warning("Broker publish failed, applying locally: %s", exc)
+                        self.fallbacks += 1
+                        self._apply(batch_id, positions)
+                        return
+        errors = [r for r in replies if isinstance(r, RespError)]
+        if errors:
+            logger.warning("Broker rejected publish: %s", errors[0])
+        self.published += 1
+
+    def _apply(self, batch_id: Optional[str], positions: List[Position]) -> None:
+        if batch_id is not None:
+            with self._applied_lock:
+                if batch_id in self._applied:
+                    self.duplicates += 1
+                    return
+                self._applied[batch_id] = None
+                if len(self._applied) > DEDUP_WINDOW:
+                    self._applied.popitem(last=False)
+        self._hub.apply(positions)
+
+    def _on_offline(self, bus_ids: List[int]) -> None:
+        # Called on the hub dispatcher: hand the ids over rather than wait on a broker round trip
+        if self._stopped:
+            return
+        with self._expiry_cond:
+            self._expired.update(bus_ids)
+            self._expiry_cond.notify()
+        self.ensure_running()
+
+    def _run_expiry(self) -> None:
+        while True:
+            with self._expiry_cond:
+                while not self._expired and not self._stopped:
+                    self._expiry_cond.wait()
+                if self._stopped:
+                    return
+                bus_ids = sorted(self._expired)
+                self._expired.clear()
+            # Every worker expires the bus; HDEL is idempotent
+            with self._pub_lock:
+                try:
+                    if not self._pub.connected:
+                        self._pub.connect()
+                    self._pub.execute("HDEL", self.snapshot_key, *bus_ids)
+                except (OSError, ConnectionError, RespError) as exc:
+                    self._pub.close()
+                    logger.warning("Could not remove expired buses from the broker snapshot: %s", exc)
+
+    def load_snapshot(self) -> List[Position]:
+        conn = RespConnection(self.url)
+        try:
+            reply = conn.execute("HGETALL", self.snapshot_key) or []
+        finally:
+            conn.close()
+        return [_position(json.loads(value)) for value in reply[1::2]]
+
+    def _run(self) -> None:
+        delay = RECONNECT_MIN_DELAY
+        while not self._stopped:
+            sub = RespConnection(self.url, timeout=None)
+            self._sub = sub
+            try:
+                sub.connect()
+                sub.execute("SUBSCRIBE", self.channel)
+                self._hub.restore_positions(self.load_snapshot())
+                delay = RECONNECT_MIN_DELAY
+                while not self._stopped:
+                    message = sub.read_reply()
+                    if not isinstance(message, list) or len(message) != 3 or message[0] != b"message":
+                        continue
+                    self.received += 1
+                    try:
+                        self._apply(*decode_message(message[2]))
+                    except (ValueError, TypeError):
+                        logger.exception("Malformed broker message")
+            except (OSError, ConnectionError, RespError) as exc:
+                if self._stopped:
+                    return
+                self.reconnects += 1
+                logger.warning("Broker subscription lost (%s); retrying in %.1fs", exc, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            finally:
+                sub.close()
+
+    def close(self) -> None:
+        self._stopped = True
+        with self._expiry_cond:
+            self._expiry_cond.notify_all()
+        with self._pub_lock:
+            self._pub.close()
+        if self._sub is not None:
+            self._sub.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": "redis",
+            "channel": self.channel,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "published": self.published,
+            "received": self.received,
+            "fallbacks": self.fallbacks,
+            "duplicates": self.duplicates,
+            "reconnects": self.reconnects,
+        }
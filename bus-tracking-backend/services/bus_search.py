@@ -0,0 +1,123 @@
+import base64
+import json
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.timetable import normalize_name
+
+
+EXACT = "exact"
+PREFIX = "prefix"
+MATCH_MODES = (EXACT, PREFIX)
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Equality/prefix on the places, then the page order: exact searches read
+# one contiguous index range already sorted by (depart, _id)
+SEARCH_INDEX = [("from_norm", 1), ("to_norm", 1), ("depart", 1), ("_id", 1)]
+SEARCH_INDEX_NAME = "from_norm_to_norm_depart"
+
+PUBLIC_FIELDS = ("bus_number", "service_name", "from", "to", "depart", "arrive", "fare", "seats")
+
+
+def normalize_place(value: Optional[str]) -> str:
+    return normalize_name(value or "")
+
+
+def search_fields(bus: dict) -> Dict[str, str]:
+    """Normalized copies of from/to stored next to the originals for indexed matching."""
+    return {"from_norm": normalize_place(bus.get("from")), "to_norm": normalize_place(bus.get("to"))}
+
+
+def ensure_search_index(collection) -> None:
+    collection.create_index(SEARCH_INDEX, name=SEARCH_INDEX_NAME)
+
+
+def backfill_search_fields(collection, batch_size: int = 1000) -> int:
+    """Add from_norm/to_norm to documents imported before they existed."""
+    from pymongo import UpdateOne
+
+    updated = 0
+    ops = []
+    for doc in collection.find({"from_norm": {"$exists": False}}, {"from": 1, "to": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": search_fields(doc)}))
+        if len(ops) >= batch_size:
+            updated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += collection.bulk_write(ops, ordered=False).modified_count
+    return updated
+
+
+def _place_filter(value: str, match: str):
+    norm = normalize_place(value)
+    if match == EXACT:
+        return norm
+    # Anchored and case-sensitive on the lowercased field, so it becomes an index range
+    return {"$regex": "^" + re.escape(norm)}
+
+
+def encode_cursor(depart: Optional[str], doc_id) -> str:
+    raw = json.dumps([depart, str(doc_id)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        depart, doc_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    return depart, doc_id
+
+
+def build_query(source: str, destination: str, match: str = PREFIX, cursor: Optional[str] = None) -> dict:
+    if match not in MATCH_MODES:
+        raise ValueError(f"match must be one of {', '.join(MATCH_MODES)}")
+    if not normalize_place(source) or not normalize_place(destination):
+        raise ValueError("source and destination are required")
+    query: dict = {"from_norm": _place_filter(source, match), "to_norm": _place_filter(destination, match)}
+    if cursor:
+        from bson import ObjectId
+        from bson.errors import InvalidId
+
+        depart, doc_id = decode_cursor(cursor)
+        try:
+            after_id = ObjectId(doc_id)
+        except InvalidId:
+            raise ValueError("invalid cursor")
+        # Keyset pagination: everything after the last (depart, _id) returned
+        query["$or"] = [{"depart": {"$gt": depart}}, {"depart": depart, "_id": {"$gt": after_id}}]
+    return query
+
+
+def search(
+    collection,
+    source: str,
+    destination: str,
+    match: str = PREFIX,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """One page of buses from `source` to `destination`, ordered by departure, plus the next cursor."""
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    query = build_query(source, destination, match, cursor)
+    projection = {field: 1 for field in PUBLIC_FIELDS}
+    docs: Iterable[dict] = (
+        collection.find(query, projection)
+        .sort([("depart", 1), ("_id", 1)])
+        .limit(limit + 1)
+    )
+    page = []
+    next_cursor = None
+    for doc in docs:
+        if len(page) == limit:
+            last = page[-1]
+            next_cursor = encode_cursor(last.get("depart"), last["_id"])
+            break
+        page.append(doc)
+    return page, next_cursor
+
+
+def public_bus(doc: dict) -> dict:
+    return {field: doc.get(field) for field in PUBLIC_FIELDS}
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+from threading import Lock
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from services.geo import BBox, in_bbox
+from services.realtime import LoopBridge, Position, RealtimeHub, hub
+from services.wire import WireState, encodable, encode_frames, encode_full, encode_offline_frames
+
+
+logger = logging.getLogger(__name__)
+
+# Per-connection subscription limits
+MAX_SUBSCRIPTIONS = 500
+
+
+def _ids(values, name: str) -> List[int]:
+    if not isinstance(values, list):
+        raise ValueError(f"{name} must be a list of integers")
+    return [int(v) for v in values]
+
+
+def _bboxes(values) -> List[BBox]:
+    if not isinstance(values, list):
+        raise ValueError("bboxes must be a list of [minLon, minLat, maxLon, maxLat]")
+    out = []
+    for value in values:
+        if not isinstance(value, list) or len(value) != 4:
+            raise ValueError("bboxes must be a list of [minLon, minLat, maxLon, maxLat]")
+        bbox = tuple(float(v) for v in value)
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+        out.append(bbox)
+    return out
+
+
+class WsSession:
+    """One WebSocket client: its subscriptions, pending updates and delta state.
+
+    The dispatcher thread offers positions (coalesced to the newest per bus);
+    the connection's task takes them and sends one binary frame. Filters are
+    immutable sets swapped on change, so the dispatcher never sees a partial
+    update.
+    """
+
+    def __init__(self, bridge: LoopBridge, delta: bool = False) -> None:
+        self._bridge = bridge
+        self.ready = asyncio.Event()
+        self._lock = Lock()
+        self._pending: Dict[int, Position] = {}
+        self._records: Dict[int, bytes] = {}
+        self._sent: Dict[int, WireState] = {}
+        # Buses this connection has been sent, so it hears when they go offline
+        self._known: Set[int] = set()
+        self._offline: List[int] = []
+        self.delta = delta
+        self.all = False
+        self.bus_ids: FrozenSet[int] = frozenset()
+        self.route_ids: FrozenSet[int] = frozenset()
+        self.bboxes: Tuple[BBox, ...] = ()
+        self.frames = 0
+        self.bytes_sent = 0
+        self.positions_sent = 0
+
+    def set_delta(self, delta: bool) -> None:
+        if delta and not self.delta:
+            # Start from a clean slate: the next record per bus is sent in full
+            self._sent = {}
+        self.delta = delta
+
+    def is_empty(self) -> bool:
+        return not (self.all or self.bus_ids or self.route_ids or self.bboxes)
+
+    def matches(self, pos: Position, route_id: Optional[int]) -> bool:
+        if self.all or pos.bus_id in self.bus_ids or (route_id is not None and route_id in self.route_ids):
+            return True
+        return any(in_bbox(b, pos.latitude, pos.longitude) for b in self.bboxes)
+
+    def offer(self, items: List[Tuple[Position, Optional[bytes]]]) -> None:
+        """Queue (position, pre-encoded full record or None) pairs, then wake the connection once."""
+        if not items:
+            return
+        with self._lock:
+            for pos, record in items:
+                self._pending[pos.bus_id] = pos
+                self._known.add(pos.bus_id)
+                if record is not None:
+                    self._records[pos.bus_id] = record
+                else:
+                    self._records.pop(pos.bus_id, None)
+        self._bridge.wake(self)
+
+    def offer_offline(self, bus_ids: List[int]) -> None:
+        """Queue offline notices for the buses among `bus_ids` this connection has been sent."""
+        with self._lock:
+            gone = [b for b in bus_ids if b in self._known]
+            if not gone:
+                return
+            for bus_id in gone:
+                self._known.discard(bus_id)
+                self._pending.pop(bus_id, None)
+                self._records.pop(bus_id, None)
+            self._offline.extend(gone)
+        self._bridge.wake(self)
+
+    def next_frames(self) -> List[bytes]:
+        """Everything pending: positions frames, then offline frames (either may be absent)."""
+        with self._lock:
+            positions = list(self._pending.values())
+            records = self._records
+            offline = self._offline
+            self._pending = {}
+            self._records = {}
+            self._offline = []
+        frames: List[bytes] = []
+        if positions:
+            frames.extend(encode_frames(positions, self._sent if self.delta else None, records))
+            self.positions_sent += len(positions)
+        if offline:
+            for bus_id in offline:
+                self._sent.pop(bus_id, None)
+            frames.extend(encode_offline_frames(offline))
+        self.frames += len(frames)
+        self.bytes_sent += sum(len(f) for f in frames)
+        return frames
+
+    def subscriptions(self) -> Dict[str, object]:
+        return {
+            "all": self.all,
+            "bus_ids": sorted(self.bus_ids),
+            "route_ids": sorted(self.route_ids),
+            "bboxes": [list(b) for b in self.bboxes],
+            "delta": self.delta,
+        }
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "subscriptions": len(self.bus_ids) + len(self.route_ids) + len(self.bboxes) + int(self.all),
+            "delta": self.delta,
+            "frames": self.frames,
+            "bytes": self.bytes_sent,
+            "positions": self.positions_sent,
+        }
+
+
+class PositionChannel:
+    """Routes each dispatcher tick to WebSocket sessions by route, bus and bbox subscriptions."""
+
+    def __init__(self, realtime: RealtimeHub = hub) -> None:
+        self._hub = realtime
+        self._lock = Lock()
+        self._sessions: Dict[WsSession, None] = {}
+        self._attached = False
+
+    def open(self, bridge: LoopBridge, delta: bool = False) -> WsSession:
+        session = WsSession(bridge, delta=delta)
+        with self._lock:
+            self._sessions[session] = None
+            if not self._attached:
+                self._hub.add_flush_listener(self._on_flush)
+                self._hub.add_offline_listener(self._on_offline)
+                self._attached = True
+        return session
+
+    def close(self, session: WsSession) -> None:
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def _on_flush(self, batch: Dict[int, Position]) -> None:
+        with self._lock:
+            sessions = [s for s in self._sessions if not s.is_empty()]
+        if not sessions:
+            return
+        routes = {bus_id: self._hub.route_of(bus_id) for bus_id in batch}
+        # Full records are packed once per tick and shared by non-delta sessions
+        records: Dict[int, bytes] = {}
+        for session in sessions:
+            try:
+                items: List[Tuple[Position, Optional[bytes]]] = []
+                for bus_id, pos in batch.items():
+                    if not encodable(pos) or not session.matches(pos, routes[bus_id]):
+                        continue
+                    record = None
+                    if not session.delta:
+                        record = records.get(bus_id)
+                        if record is None:
+                            record = records[bus_id] = encode_full(pos)
+                    items.append((pos, record))
+                session.offer(items)
+            except Exception:
+                # This session misses the tick; the others still get theirs
+                logger.exception("Failed to queue WebSocket positions for one session")
+
+    def _on_offline(self, bus_ids: List[int]) -> None:
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.offer_offline(bus_ids)
+
+    def apply(self, session: WsSession, command: dict) -> Dict[str, object]:
+        """Handle a client command; returns the ack. Raises ValueError on bad input.
+
+        {"op": "subscribe" | "unsubscribe", "all": bool, "route_ids": [..], "bus_ids": [..],
+         "bboxes": [[minLon, minLat, maxLon, maxLat], ..]} or {"op": "options", "delta": bool}
+        """
+        if not isinstance(command, dict):
+            raise ValueError("command must be an object")
+        op = command.get("op")
+        if op == "options":
+            session.set_delta(bool(command.get("delta", session.delta)))
+            return {"type": "ack", "op": op, "subscriptions": session.subscriptions()}
+        if op not in ("subscribe", "unsubscribe"):
+            raise ValueError("op must be subscribe, unsubscribe or options")
+
+        bus_ids = set(_ids(command.get("bus_ids", []), "bus_ids"))
+        route_ids = set(_ids(command.get("route_ids", []), "route_ids"))
+        bboxes = _bboxes(command.get("bboxes", []))
+        if op == "subscribe":
+            total = len(session.bus_ids | bus_ids) + len(session.route_ids | route_ids) + len(session.bboxes) + len(bboxes)
+            if total > MAX_SUBSCRIPTIONS:
+                raise ValueError(f"at most {MAX_SUBSCRIPTIONS} subscriptions per connection")
+            session.bus_ids = session.bus_ids | bus_ids
+            session.route_ids = session.route_ids | route_ids
+            session.bboxes = session.bboxes + tuple(b for b in bboxes if b not in session.bboxes)
+            if command.get("all"):
+                session.all = True
+            self._send_snapshot(session, command.get("all"), bus_ids, route_ids, bboxes)
+        else:
+            session.bus_ids = session.bus_ids - bus_ids
+            session.route_ids = session.route_ids - route_ids
+            session.bboxes = tuple(b for b in session.bboxes if b not in bboxes)
+            if command.get("all"):
+                session.all = False
+        return {"type": "ack", "op": op, "subscriptions": session.subscriptions()}
+
+    def _send_snapshot(self, session: WsSession, everything, bus_ids, route_ids, bboxes) -> None:
+        # Newly subscribed buses get their current position straight away
+        snapshots: List[Dict[str, object]] = []
+        if everything:
+            snapshots.extend(self._hub.get_snapshot())
+        else:
+            for bus_id in bus_ids:
+                snapshots.extend(self._hub.get_snapshot(bus_id=bus_id))
+            for route_id in route_ids:
+                snapshots.extend(self._hub.get_snapshot(route_id=route_id))
+            for bbox in bboxes:
+                snapshots.extend(self._hub.get_snapshot(bbox=bbox))
+        session.offer([(Position(**snap), None) for snap in snapshots])
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            sessions = list(self._sessions)
+        per_session = [s.stats() for s in sessions]
+        return {
+            "connections": len(sessions),
+            "frames": sum(s["frames"] for s in per_session),
+            "bytes": sum(s["bytes"] for s in per_session),
+            "positions": sum(s["positions"] for s in per_session),
+        }
+
+
+position_channel = PositionChannel()
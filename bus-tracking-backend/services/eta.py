@@ -0,0 +1,313 @@
+import logging
+import math
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.geo import METERS_PER_DEGREE
+from services.journey import parse_hhmm
+from services.realtime import Position, RealtimeHub, hub
+from services.timetable import TimetableIndex, timetable
+
+
+logger = logging.getLogger(__name__)
+
+# Used for segments with neither a schedule nor observations (~20 km/h city bus)
+DEFAULT_SPEED_MPS = 5.5
+# Weight of the observed speed against the schedule once a segment has observations
+OBSERVED_WEIGHT = 0.7
+# EWMA smoothing for observed segment speeds
+SPEED_ALPHA = 0.3
+# Speed samples outside this range (m/s) are GPS noise, not traffic
+MIN_SAMPLE_SPEED = 0.5
+MAX_SAMPLE_SPEED = 35.0
+MAX_SAMPLE_GAP_S = 300.0
+# Segments searched around a bus's previous match before falling back to the whole route
+LOCAL_WINDOW = 3
+# A local match farther than this from the route triggers a full re-projection
+MAX_LOCAL_OFFSET_M = 150.0
+
+
+@dataclass
+class Projection:
+    segment: int
+    progress_m: float
+    offset_m: float
+    timestamp: float
+
+
+class RouteGeometry:
+    """Ordered stop polyline of one route with precomputed cumulative distances and times."""
+
+    def __init__(
+        self,
+        route_id: int,
+        stop_ids: Sequence[int],
+        lats: Sequence[float],
+        lons: Sequence[float],
+        travel_s: Optional[Sequence[float]] = None,
+        dwell_s: Optional[Sequence[float]] = None,
+    ) -> None:
+        self.route_id = route_id
+        self.stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        self._stop_pos = {int(s): i for i, s in enumerate(stop_ids)}
+        lat = np.asarray(lats, dtype=np.float64)
+        lon = np.asarray(lons, dtype=np.float64)
+        # Local equirectangular projection in meters around the route's mean latitude
+        self._k = math.cos(math.radians(float(lat.mean())))
+        self.x = lon * self._k * METERS_PER_DEGREE
+        self.y = lat * METERS_PER_DEGREE
+        dx = np.diff(self.x)
+        dy = np.diff(self.y)
+        self.seg_len = np.hypot(dx, dy)
+        self._dx, self._dy = dx, dy
+        self._seg_len2 = np.maximum(self.seg_len ** 2, 1e-9)
+        self.cum_m = np.concatenate(([0.0], np.cumsum(self.seg_len)))
+
+        n_seg = len(self.seg_len)
+        sched = np.asarray(travel_s, dtype=np.float64) if travel_s is not None else np.full(n_seg, np.nan)
+        fallback = self.seg_len / DEFAULT_SPEED_MPS
+        self.sched_s = np.where(np.isfinite(sched) & (sched > 0), sched, fallback)
+        self.dwell_s = np.asarray(dwell_s, dtype=np.float64) if dwell_s is not None else np.zeros(len(stop_ids))
+        self.observed_mps = np.full(n_seg, np.nan)
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
+
+    def stop_index(self, stop_id: int) -> Optional[int]:
+        return self._stop_pos.get(stop_id)
+
+    def to_xy(self, lat: float, lon: float) -> Tuple[float, float]:
+        return lon * self._k * METERS_PER_DEGREE, lat * METERS_PER_DEGREE
+
+    def to_latlon(self, x: float, y: float) -> Tuple[float, float]:
+        return y / METERS_PER_DEGREE, x / (self._k * METERS_PER_DEGREE)
+
+    def segment_at(self, progress_m: float) -> int:
+        """Segment containing a distance along the route."""
+        seg = int(np.searchsorted(self.cum_m, progress_m, side="right")) - 1
+        return min(max(seg, 0), len(self.seg_len) - 1)
+
+    def _project_range(self, px: float, py: float, lo: int, hi: int) -> Tuple[int, float, float]:
+        qx = px - self.x[lo:hi]
+        qy = py - self.y[lo:hi]
+        t = np.clip((qx * self._dx[lo:hi] + qy * self._dy[lo:hi]) / self._seg_len2[lo:hi], 0.0, 1.0)
+        ex = qx - t * self._dx[lo:hi]
+        ey = qy - t * self._dy[lo:hi]
+        d2 = ex * ex + ey * ey
+        i = int(np.argmin(d2))
+        seg = lo + i
+        return seg, float(self.cum_m[seg] + t[i] * self.seg_len[seg]), float(math.sqrt(d2[i]))
+
+    def project(self, lat: float, lon: float, hint: Optional[int] = None) -> Tuple[int, float, float]:
+        """(segment, meters along route, meters off route) for a point.
+
+        With a hint (the bus's previous segment) only a few neighbouring segments
+        are examined; the whole route is scanned only when that match is poor.
+        """
+        px, py = self.to_xy(lat, lon)
+        n_seg = len(self.seg_len)
+        if hint is not None:
+            lo, hi = max(0, hint - 1), min(n_seg, hint + LOCAL_WINDOW + 1)
+            seg, progress, offset = self._project_range(px, py, lo, hi)
+            if offset <= MAX_LOCAL_OFFSET_M:
+                return seg, progress, offset
+        return self._project_range(px, py, 0, n_seg)
+
+    def segment_times(self) -> np.ndarray:
+        observed = self.seg_len / self.observed_mps
+        blended = OBSERVED_WEIGHT * observed + (1 - OBSERVED_WEIGHT) * self.sched_s
+        return np.where(np.isfinite(blended), blended, self.sched_s)
+
+    def arrival_offsets(self) -> np.ndarray:
+        """Seconds from departing stop 0 to arriving at each stop, dwell at intermediate stops included."""
+        seg = self.segment_times() + self.dwell_s[:-1]
+        seg[0] -= self.dwell_s[0]
+        return np.concatenate(([0.0], np.cumsum(seg)))
+
+    def record_speed(self, segment: int, speed_mps: float) -> None:
+        current = self.observed_mps[segment]
+        self.observed_mps[segment] = speed_mps if np.isnan(current) else (
+            SPEED_ALPHA * speed_mps + (1 - SPEED_ALPHA) * current
+        )
+
+
+class EtaEngine:
+    """Projects live hub positions onto route polylines to estimate stop arrivals."""
+
+    def __init__(self, realtime: RealtimeHub = hub, schedule: TimetableIndex = timetable) -> None:
+        self._hub = realtime
+        self._schedule = schedule
+        self._lock = Lock()
+        self._routes: Dict[int, RouteGeometry] = {}
+        self._stop_routes: Dict[int, List[int]] = {}
+        self._projections: Dict[int, Projection] = {}
+
+    def load_routes(self, session) -> None:
+        from models import Route, RouteStop, Stop
+
+        rows = (
+            session.query(Route.id, Route.code, Stop.id, Stop.lat, Stop.lon)
+            .join(RouteStop, RouteStop.route_id == Route.id)
+            .join(Stop, Stop.id == RouteStop.stop_id)
+            .filter(Route.active == 1)
+            .order_by(Route.id, RouteStop.sequence)
+            .all()
+        )
+        grouped: Dict[int, Tuple[str, List[int], List[float], List[float]]] = {}
+        for route_id, code, stop_id, lat, lon in rows:
+            entry = grouped.setdefault(route_id, (code, [], [], []))
+            entry[1].append(stop_id)
+            entry[2].append(lat)
+            entry[3].append(lon)
+
+        routes: Dict[int, RouteGeometry] = {}
+        for route_id, (code, stop_ids, lats, lons) in grouped.items():
+            if len(stop_ids) < 2:
+                continue
+            travel_s, dwell_s = self._scheduled_times(code, len(stop_ids))
+            routes[route_id] = RouteGeometry(route_id, stop_ids, lats, lons, travel_s, dwell_s)
+        stop_routes: Dict[int, List[int]] = {}
+        for route_id, geom in routes.items():
+            for stop_id in geom.stop_ids.tolist():
+                stop_routes.setdefault(stop_id, []).append(route_id)
+        with self._lock:
+            self._routes = routes
+            self._stop_routes = stop_routes
+            self._projections.clear()
+        logger.info("Loaded ETA geometry for %d routes", len(routes))
+
+    def _scheduled_times(self, code: str, n_stops: int) -> Tuple[Optional[List[float]], Optional[List[float]]]:
+        # routes.csv rows are keyed by the route code (e.g. B101), in stop order
+        stops = self._schedule.bus_stops(code)
+        if len(stops) != n_stops:
+            return None, None
+        travel: List[float] = []
+        for here, there in zip(stops, stops[1:]):
+            dep = parse_hhmm(here.departure_time or here.arrival_time)
+            arr = parse_hhmm(there.arrival_time or there.departure_time)
+            travel.append((arr - dep) * 60.0 if dep is not None and arr is not None else float("nan"))
+        dwell = [float(s.duration_in_minutes) * 60.0 for s in stops]
+        return travel, dwell
+
+    def route(self, route_id: int) -> Optional[RouteGeometry]:
+        return self._routes.get(route_id)
+
+    def routes_serving(self, stop_id: int) -> List[int]:
+        return self._stop_routes.get(stop_id, [])
+
+    def observe(self, positions: Iterable[Position]) -> None:
+        """Refresh each bus's projection and learn segment speeds."""
+        for pos in positions:
+            route_id = self._hub.route_of(pos.bus_id)
+            geom = self._routes.get(route_id) if route_id is not None else None
+            if geom is None:
+                continue
+            with self._lock:
+                prev = self._projections.get(pos.bus_id)
+                seg, progress, offset = self._locate(geom, pos, prev)
+                self._projections[pos.bus_id] = Projection(seg, progress, offset, pos.timestamp)
+                if prev is None or abs(seg - prev.segment) > 1:
+                    continue
+                dt = pos.timestamp - prev.timestamp
+                if 0 < dt <= MAX_SAMPLE_GAP_S:
+                    speed = (progress - prev.progress_m) / dt
+                    if MIN_SAMPLE_SPEED <= speed <= MAX_SAMPLE_SPEED:
+                        geom.record_speed(seg, speed)
+
+    def observe_flush(self, batch: Dict[int, Position]) -> None:
+        """Hub flush listener: runs on the dispatcher thread, not the request that posted the fixes."""
+        self.observe(batch.values())
+
+    @staticmethod
+    def _locate(geom: RouteGeometry, pos: Position, prev: Optional[Projection]) -> Tuple[int, float, float]:
+        # Map-matched positions already carry their progress along the route
+        if pos.progress_m is not None:
+            return geom.segment_at(pos.progress_m), pos.progress_m, 0.0
+        return geom.project(pos.latitude, pos.longitude, prev.segment if prev else None)
+
+    def _projection(self, bus_id: int, geom: RouteGeometry) -> Optional[Projection]:
+        pos = self._hub.latest(bus_id)
+        if pos is None:
+            return None
+        with self._lock:
+            proj = self._projections.get(bus_id)
+            if proj is None or proj.timestamp != pos.timestamp:
+                seg, progress, offset = self._locate(geom, pos, proj)
+                proj = Projection(seg, progress, offset, pos.timestamp)
+                self._projections[bus_id] = proj
+        return proj
+
+    def bus_etas(self, bus_id: int) -> Optional[Tuple[RouteGeometry, int, np.ndarray]]:
+        """(route, first downstream stop index, seconds to each downstream stop)."""
+        route_id = self._hub.route_of(bus_id)
+        geom = self._routes.get(route_id) if route_id is not None else None
+        if geom is None:
+            return None
+        proj = self._projection(bus_id, geom)
+        if proj is None:
+            return None
+        offsets = geom.arrival_offsets()
+        seg = proj.segment
+        frac = (proj.progress_m - geom.cum_m[seg]) / max(geom.seg_len[seg], 1e-9)
+        remaining = (1.0 - frac) * geom.segment_times()[seg]
+        nxt = seg + 1
+        return geom, nxt, remaining + offsets[nxt:] - offsets[nxt]
+
+    def eta_seconds(self, bus_id: int, stop_id: int) -> Optional[float]:
+        result = self.bus_etas(bus_id)
+        if result is None:
+            return None
+        geom, nxt, etas = result
+        idx = geom.stop_index(stop_id)
+        if idx is None or idx < nxt:
+            return None
+        return float(etas[idx - nxt])
+
+    def route_etas(self, route_id: int, bus_ids: Sequence[int]) -> Optional[Dict[str, object]]:
+        """Seconds from every bus on the route to every stop, as one broadcast computation.
+
+        Returns stop ids, bus ids and an ETA matrix (buses x stops, NaN where a
+        bus has already passed the stop), plus the soonest bus and ETA per stop
+        (-1 / inf when no bus is coming).
+        """
+        geom = self._routes.get(route_id)
+        if geom is None:
+            return None
+        projections = [(b, self._projection(b, geom)) for b in bus_ids]
+        projections = [(b, p) for b, p in projections if p is not None]
+        stop_ids = geom.stop_ids
+        if not projections:
+            return {
+                "stop_ids": stop_ids,
+                "bus_ids": np.empty(0, dtype=np.int64),
+                "etas": np.empty((0, len(geom))),
+                "next_bus": np.full(len(geom), -1, dtype=np.int64),
+                "next_eta": np.full(len(geom), np.inf),
+            }
+
+        buses = np.array([b for b, _ in projections], dtype=np.int64)
+        seg = np.array([p.segment for _, p in projections], dtype=np.int64)
+        progress = np.array([p.progress_m for _, p in projections])
+        seg_times = geom.segment_times()
+        offsets = geom.arrival_offsets()
+        frac = (progress - geom.cum_m[seg]) / np.maximum(geom.seg_len[seg], 1e-9)
+        remaining = (1.0 - frac) * seg_times[seg]
+        nxt = seg + 1
+        etas = remaining[:, None] + offsets[None, :] - offsets[nxt][:, None]
+        etas[np.arange(len(geom))[None, :] < nxt[:, None]] = np.nan
+
+        filled = np.where(np.isnan(etas), np.inf, etas)
+        best = filled.argmin(axis=0)
+        next_eta = filled[best, np.arange(len(geom))]
+        next_bus = np.where(np.isfinite(next_eta), buses[best], -1)
+        return {"stop_ids": stop_ids, "bus_ids": buses, "etas": etas, "next_bus": next_bus, "next_eta": next_eta}
+
+
+eta_engine = EtaEngine()
+
+
+def load_eta_routes(session) -> None:
+    eta_engine.load_routes(session)
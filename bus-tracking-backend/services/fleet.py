@@ -0,0 +1,49 @@
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Bus
+from services.realtime import hub
+
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "fleet_bus_changes"
+_watching = False
+
+
+def load_bus_routes(session) -> None:
+    pairs = session.query(Bus.id, Bus.route_id).all()
+    hub.load_bus_routes(pairs)
+    logger.info("Loaded route links for %d buses", len(pairs))
+
+
+def _after_flush(session, flush_context) -> None:
+    changes = session.info.setdefault(_PENDING_KEY, {})
+    for obj in session.new.union(session.dirty):
+        if isinstance(obj, Bus) and obj.id is not None:
+            changes[obj.id] = obj.route_id
+    for obj in session.deleted:
+        if isinstance(obj, Bus) and obj.id is not None:
+            changes[obj.id] = None
+
+
+def _after_commit(session) -> None:
+    for bus_id, route_id in session.info.pop(_PENDING_KEY, {}).items():
+        hub.set_bus_route(bus_id, route_id)
+
+
+def _after_rollback(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def watch_bus_changes() -> None:
+    """Keep the hub's bus -> route map in step with committed Bus rows."""
+    global _watching
+    if _watching:
+        return
+    event.listen(Session, "after_flush", _after_flush)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_rollback", _after_rollback)
+    _watching = True
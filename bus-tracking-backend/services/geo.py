@@ -0,0 +1,133 @@
+import heapq
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+
+# ~1.1 km cells: a city viewport touches tens of cells, not thousands
+DEFAULT_CELL_DEG = 0.01
+
+BBox = Tuple[float, float, float, float]
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def in_bbox(bbox: BBox, lat: float, lon: float) -> bool:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+
+class GridIndex:
+    """Uniform lat/lon grid of point ids, updated in O(1) per move.
+
+    Not thread-safe; the owner serializes access (RealtimeHub holds its lock).
+    """
+
+    def __init__(self, cell_deg: float = DEFAULT_CELL_DEG) -> None:
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._where: Dict[int, Tuple[int, int]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def update(self, key: int, lat: float, lon: float) -> None:
+        cell = self._cell(lat, lon)
+        old = self._where.get(key)
+        if old != cell:
+            if old is not None:
+                self._discard(key, old)
+            self._cells.setdefault(cell, set()).add(key)
+            self._where[key] = cell
+        self._points[key] = (lat, lon)
+
+    def remove(self, key: int) -> None:
+        cell = self._where.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+        self._points.pop(key, None)
+
+    def _discard(self, key: int, cell: Tuple[int, int]) -> None:
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def within(self, bbox: BBox) -> List[int]:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        lo_r, lo_c = self._cell(min_lat, min_lon)
+        hi_r, hi_c = self._cell(max_lat, max_lon)
+        n_cells = (hi_r - lo_r + 1) * (hi_c - lo_c + 1)
+        if n_cells > len(self._cells):
+            # Huge box relative to occupancy: walk occupied cells instead of the range
+            candidates: Iterable[int] = (
+                key for (r, c), members in self._cells.items()
+                if lo_r <= r <= hi_r and lo_c <= c <= hi_c
+                for key in members
+            )
+        else:
+            candidates = (
+                key for r in range(lo_r, hi_r + 1) for c in range(lo_c, hi_c + 1)
+                for key in self._cells.get((r, c), ())
+            )
+        points = self._points
+        return [key for key in candidates if in_bbox(bbox, *points[key])]
+
+    def nearest(self, lat: float, lon: float, k: int, max_distance_m: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Up to k (id, meters) pairs ordered by distance, searching rings of cells outward."""
+        if k <= 0 or not self._points:
+            return []
+        r0, c0 = self._cell(lat, lon)
+        # Conservative meters per cell step: longitude cells shrink with latitude
+        cell_m = self.cell_deg * METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + self.cell_deg, 89.9))), 0.01)
+        found: List[Tuple[float, int]] = []
+        seen = 0
+        ring = 0
+        while True:
+            for r, c in self._ring(r0, c0, ring):
+                for key in self._cells.get((r, c), ()):
+                    seen += 1
+                    found.append((haversine_m(lat, lon, *self._points[key]), key))
+            # Anything beyond this ring is at least `ring` whole cells away
+            bound = ring * cell_m
+            found.sort()
+            if len(found) >= k and found[k - 1][0] <= bound:
+                break
+            if seen >= len(self._points) or (max_distance_m is not None and bound > max_distance_m):
+                break
+            ring += 1
+            if (2 * ring + 1) ** 2 > 4 * len(self._cells):
+                # Sparse fleet far from the query: rings would mostly probe empty cells
+                found = [(haversine_m(lat, lon, *point), key) for key, point in self._points.items()]
+                found = heapq.nsmallest(k, found)
+                break
+        result = [(key, dist) for dist, key in found[:k]]
+        if max_distance_m is not None:
+            result = [(key, dist) for key, dist in result if dist <= max_distance_m]
+        return result
+
+    @staticmethod
+    def _ring(r0: int, c0: int, ring: int) -> Iterable[Tuple[int, int]]:
+        if ring == 0:
+            yield (r0, c0)
+            return
+        for c in range(c0 - ring, c0 + ring + 1):
+            yield (r0 - ring, c)
+            yield (r0 + ring, c)
+        for r in range(r0 - ring + 1, r0 + ring):
+            yield (r, c0 - ring)
+            yield (r, c0 + ring)
@@ -0,0 +1,272 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services.stop_index import StopIndex, stop_index
+from services.timetable import TimetableIndex, timetable
+
+
+INF = 1 << 30
+
+# Minutes a rider needs to change buses at a shared stop
+DEFAULT_TRANSFER_MINUTES = 2
+
+
+def parse_hhmm(value: str) -> Optional[int]:
+    try:
+        hours, minutes = value.split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_hhmm(minutes: int) -> str:
+    return f"{(minutes // 60) % 24:02d}:{minutes % 60:02d}"
+
+
+@dataclass
+class Leg:
+    bus_id: str
+    from_stop_id: str
+    to_stop_id: str
+    from_index: int
+    to_index: int
+    departure: int
+    arrival: int
+
+
+@dataclass
+class Journey:
+    legs: List[Leg] = field(default_factory=list)
+
+    @property
+    def departure(self) -> int:
+        return self.legs[0].departure
+
+    @property
+    def arrival(self) -> int:
+        return self.legs[-1].arrival
+
+    @property
+    def transfers(self) -> int:
+        return len(self.legs) - 1
+
+
+class _Connections:
+    """Timetable flattened into parallel arrays of elementary hops, sorted by departure."""
+
+    def __init__(self, source: TimetableIndex, stops: StopIndex) -> None:
+        self.trips: List[str] = []
+        self.stop_ids: List[str] = []
+        stop_slots: Dict[str, int] = {}
+        rows: List[Tuple[int, int, int, int, int, int]] = []
+
+        def slot(stop_id: str) -> int:
+            canonical = stops.canonical_id(stop_id)
+            if canonical not in stop_slots:
+                stop_slots[canonical] = len(self.stop_ids)
+                self.stop_ids.append(canonical)
+            return stop_slots[canonical]
+
+        # One trip per CSV bus run; each consecutive stop pair becomes a connection
+        for bus_id, bus_stops in source.buses().items():
+            trip = len(self.trips)
+            self.trips.append(bus_id)
+            for idx in range(len(bus_stops) - 1):
+                here, there = bus_stops[idx], bus_stops[idx + 1]
+                dep = parse_hhmm(here.departure_time or here.arrival_time)
+                arr = parse_hhmm(there.arrival_time or there.departure_time)
+                if dep is None or arr is None or arr < dep:
+                    continue
+                rows.append((dep, arr, slot(here.stop_id), slot(there.stop_id), trip, idx))
+        rows.sort()
+
+        self.stop_slots = stop_slots
+        self.dep_time = [r[0] for r in rows]
+        self.arr_time = [r[1] for r in rows]
+        self.dep_stop = [r[2] for r in rows]
+        self.arr_stop = [r[3] for r in rows]
+        self.trip = [r[4] for r in rows]
+        self.seq = [r[5] for r in rows]
+
+        # Per trip, its connections in stop order; per stop, the connections leaving it in scan order
+        self.trip_conns: List[List[int]] = [[] for _ in self.trips]
+        self.stop_deps: Dict[int, List[int]] = {}
+        for c, row in enumerate(rows):
+            self.trip_conns[row[4]].append(c)
+            self.stop_deps.setdefault(row[2], []).append(c)
+        self.conn_pos = [0] * len(rows)
+        for conns in self.trip_conns:
+            conns.sort(key=self.seq.__getitem__)
+            for pos, c in enumerate(conns):
+                self.conn_pos[c] = pos
+
+
+class JourneyPlanner:
+    """Earliest-arrival planner using the Connection Scan Algorithm with transfer rounds.
+
+    arrival[k][stop] holds the earliest arrival using at most k legs, so one scan
+    over the time-sorted connections answers every transfer budget at once.
+    """
+
+    def __init__(self, source: TimetableIndex = timetable, stops: StopIndex = stop_index) -> None:
+        self._source = source
+        self._stops = stops
+        self._lock = Lock()
+        self._version = -1
+        self._connections: Optional[_Connections] = None
+
+    def _get_connections(self) -> _Connections:
+        self._source.buses()
+        if self._connections is None or self._version != self._source.version:
+            with self._lock:
+                if self._connections is None or self._version != self._source.version:
+                    version = self._source.version
+                    self._connections = _Connections(self._source, self._stops)
+                    self._version = version
+        return self._connections
+
+    def plan(
+        self,
+        from_ids: Sequence[str],
+        to_ids: Sequence[str],
+        depart_after: int = 0,
+        max_transfers: int = 2,
+        transfer_minutes: int = DEFAULT_TRANSFER_MINUTES,
+    ) -> List[Journey]:
+        """Pareto set over (arrival, transfers): one journey per transfer count that arrives earlier."""
+        conn = self._get_connections()
+        origins = {conn.stop_slots[s] for s in map(self._stops.canonical_id, from_ids) if s in conn.stop_slots}
+        targets = {conn.stop_slots[s] for s in map(self._stops.canonical_id, to_ids) if s in conn.stop_slots}
+        if not origins or not targets or origins & targets:
+            return []
+
+        max_legs = max_transfers + 1
+        n_stops = len(conn.stop_ids)
+        arrival = [[INF] * n_stops for _ in range(max_legs + 1)]
+        labels: List[List[Optional[Tuple[int, int]]]] = [[None] * n_stops for _ in range(max_legs + 1)]
+        for o in origins:
+            for k in range(max_legs + 1):
+                arrival[k][o] = depart_after
+        trip_legs = [0] * len(conn.trips)
+        trip_enter = [-1] * len(conn.trips)
+        # Earliest target arrival per leg count. Each level is pruned against its own best only:
+        # a journey with fewer legs that arrives later is still Pareto-optimal
+        best = [INF] * (max_legs + 1)
+        # Highest leg count that can still improve; levels above it are settled
+        top = max_legs
+        riding: List[int] = []
+
+        dep_time, arr_time = conn.dep_time, conn.arr_time
+        dep_stop, arr_stop, trip_of = conn.dep_stop, conn.arr_stop, conn.trip
+        # Loosest open transfer budget: if a stop is unreachable here it is unreachable at every open level
+        reachable = arrival[top - 1]
+        stopped_at = len(dep_time)
+        # With a single leg allowed there is nothing to scan for: go straight to the direct search
+        bound = best[top] if top > 1 else -1
+        for c in range(bisect_left(dep_time, depart_after), len(dep_time)):
+            dep = dep_time[c]
+            if dep >= bound:
+                while top and dep >= best[top]:
+                    top -= 1
+                if top <= 1:
+                    # Only direct trips can still improve; finish those without scanning the rest of the day
+                    stopped_at = c
+                    break
+                reachable = arrival[top - 1]
+                bound = best[top]
+            trip = trip_of[c]
+            current = trip_legs[trip]
+            if not current and reachable[dep_stop[c]] > dep:
+                continue
+
+            # Board (or re-board with fewer legs) if the stop was reached in time
+            if current != 1:
+                s = dep_stop[c]
+                for k in range(1, min(current, top + 1) if current else top + 1):
+                    reached = arrival[k - 1][s]
+                    if reached < INF and reached + (transfer_minutes if k > 1 else 0) <= dep:
+                        trip_legs[trip] = current = k
+                        trip_enter[trip] = c
+                        if k == 1:
+                            riding.append(trip)
+                        break
+                if not current or current > top:
+                    continue
+
+            a, t = arr_stop[c], arr_time[c]
+            for k in range(current, top + 1):
+                # arrival[k] and best[k] are non-increasing in k, so stop at the first level we cannot improve
+                if t >= arrival[k][a] or t >= best[k]:
+                    break
+                arrival[k][a] = t
+                labels[k][a] = (trip_enter[trip], c)
+                if a in targets:
+                    best[k] = t
+                    bound = best[top]
+
+        if top == 1:
+            self._finish_direct(conn, stopped_at, origins, targets, arrival[1], labels[1], best, trip_legs, trip_enter, riding)
+
+        journeys: List[Journey] = []
+        previous = INF
+        for k in range(1, max_legs + 1):
+            target = min(targets, key=lambda s: arrival[k][s])
+            if arrival[k][target] >= previous:
+                continue
+            previous = arrival[k][target]
+            journeys.append(self._reconstruct(conn, labels, k, target))
+        return journeys
+
+    def _finish_direct(
+        self, conn: _Connections, start: int, origins, targets, arrival, labels, best, trip_legs, trip_enter, riding
+    ) -> None:
+        """Single-leg journeys from connection `start` on: trips already boarded at an origin, then new boardings."""
+        dep_time, arr_time, arr_stop = conn.dep_time, conn.arr_time, conn.arr_stop
+
+        def ride(trip: int, enter: int) -> None:
+            conns = conn.trip_conns[trip]
+            for x in conns[conn.conn_pos[enter]:]:
+                if dep_time[x] >= best[1]:
+                    return
+                a = arr_stop[x]
+                if a in targets and arr_time[x] < arrival[a]:
+                    arrival[a] = best[1] = arr_time[x]
+                    labels[a] = (enter, x)
+
+        for trip in riding:
+            ride(trip, trip_enter[trip])
+        for o in origins:
+            deps = conn.stop_deps.get(o, [])
+            for x in deps[bisect_left(deps, start):]:
+                if dep_time[x] >= best[1]:
+                    break
+                trip = conn.trip[x]
+                # An earlier boarding of the same trip covers everything this one could reach
+                if trip_legs[trip] == 1:
+                    continue
+                trip_legs[trip] = 1
+                trip_enter[trip] = x
+                ride(trip, x)
+
+    def _reconstruct(self, conn: _Connections, labels, k: int, stop: int) -> Journey:
+        legs: List[Leg] = []
+        while k > 0 and labels[k][stop] is not None:
+            enter, exit_ = labels[k][stop]
+            legs.append(Leg(
+                bus_id=conn.trips[conn.trip[enter]],
+                from_stop_id=conn.stop_ids[conn.dep_stop[enter]],
+                to_stop_id=conn.stop_ids[conn.arr_stop[exit_]],
+                from_index=conn.seq[enter],
+                to_index=conn.seq[exit_] + 1,
+                departure=conn.dep_time[enter],
+                arrival=conn.arr_time[exit_],
+            ))
+            stop = conn.dep_stop[enter]
+            k -= 1
+        legs.reverse()
+        return Journey(legs)
+
+
+planner = JourneyPlanner()
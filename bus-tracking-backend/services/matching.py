@@ -0,0 +1,240 @@
+import math
+from dataclasses import replace
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from services.eta import EtaEngine, RouteGeometry, eta_engine
+from services.geo import haversine_m
+from services.realtime import Position, RealtimeHub, hub
+
+
+# Bucket size of the per-route segment index (meters)
+CELL_M = 250.0
+# Fixes within this distance of their route are snapped onto it
+MAX_SNAP_M = 60.0
+# Fastest plausible ground speed (~130 km/h), plus slack for GPS error and snapping
+MAX_SPEED_MPS = 36.0
+GPS_ERROR_M = 50.0
+# A move this long against the bus's own reported heading is a jump, not driving
+MIN_HEADING_CHECK_M = 80.0
+MAX_HEADING_DIFF = 135.0
+# Below this speed (m/s) reported headings are noise
+MIN_HEADING_SPEED = 1.0
+# Jump checks only compare fixes this close in time
+MAX_CHECK_GAP_S = 300.0
+# After this many jump rejections in a row the new location wins (the old fix was the outlier)
+MAX_REJECT_STREAK = 3
+# Candidate segments facing against the heading, or behind the last match, cost this much extra
+HEADING_PENALTY_M = 40.0
+BACKTRACK_PENALTY_M = 40.0
+BACKTRACK_TOLERANCE_M = 30.0
+
+REJECT_REASONS = ("stale", "speed", "heading")
+
+# Per segment: x0, y0, dx, dy, squared length, distance along route at its start, length, bearing
+Segment = Tuple[float, float, float, float, float, float, float, float]
+
+
+def _angle(a: float, b: float) -> float:
+    diff = abs(a - b) % 360.0
+    return 360.0 - diff if diff > 180.0 else diff
+
+
+def _bearing(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dx = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.degrees(math.atan2(dx, lat2 - lat1)) % 360.0
+
+
+class SegmentIndex:
+    """Segments of one route bucketed by grid cell, for nearest-segment lookups.
+
+    A segment is listed in every cell that lies within the snap radius of it,
+    so a lookup reads a single cell and projects onto the few segments there
+    instead of scanning the route. Coordinates are the route's local meters
+    (RouteGeometry.to_xy).
+    """
+
+    def __init__(self, geom: RouteGeometry, cell_m: float = CELL_M, radius_m: float = MAX_SNAP_M) -> None:
+        self.geom = geom
+        self.cell_m = cell_m
+        self.radius_m = radius_m
+        self._segments: List[Segment] = []
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        x = geom.x.tolist()
+        y = geom.y.tolist()
+        cum = geom.cum_m.tolist()
+        # Cell centers this close to a segment may hold points within the radius of it
+        reach = radius_m + cell_m * math.sqrt(0.5)
+        for i in range(len(x) - 1):
+            dx, dy = x[i + 1] - x[i], y[i + 1] - y[i]
+            length = math.hypot(dx, dy)
+            segment = (x[i], y[i], dx, dy, max(length * length, 1e-9), cum[i], length, math.degrees(math.atan2(dx, dy)) % 360.0)
+            self._segments.append(segment)
+            for cx in range(math.floor((min(x[i], x[i + 1]) - radius_m) / cell_m), math.floor((max(x[i], x[i + 1]) + radius_m) / cell_m) + 1):
+                for cy in range(math.floor((min(y[i], y[i + 1]) - radius_m) / cell_m), math.floor((max(y[i], y[i + 1]) + radius_m) / cell_m) + 1):
+                    _, _, offset = self._project(segment, (cx + 0.5) * cell_m, (cy + 0.5) * cell_m)
+                    if offset <= reach:
+                        self._cells.setdefault((cx, cy), []).append(i)
+
+    @staticmethod
+    def _project(segment: Segment, x: float, y: float) -> Tuple[float, float, float]:
+        x0, y0, dx, dy, len2 = segment[:5]
+        t = min(max(((x - x0) * dx + (y - y0) * dy) / len2, 0.0), 1.0)
+        sx, sy = x0 + t * dx, y0 + t * dy
+        return sx, sy, math.hypot(x - sx, y - sy)
+
+    def nearest(
+        self, x: float, y: float, heading: Optional[float] = None, prev_progress: Optional[float] = None
+    ) -> Optional[Tuple[int, float, float, float]]:
+        """(segment, snapped x, snapped y, meters along route) of the best segment within the radius.
+
+        Among nearby segments (loops, out-and-back streets) one facing the
+        bus's heading and not behind its previous match is preferred.
+        """
+        best: Optional[Tuple[int, float, float, float]] = None
+        best_cost = math.inf
+        for i in self._cells.get((math.floor(x / self.cell_m), math.floor(y / self.cell_m)), ()):
+            segment = self._segments[i]
+            sx, sy, offset = self._project(segment, x, y)
+            if offset > self.radius_m:
+                continue
+            progress = segment[5] + math.hypot(sx - segment[0], sy - segment[1])
+            cost = offset
+            if heading is not None and _angle(heading, segment[7]) > 90.0:
+                cost += HEADING_PENALTY_M
+            if prev_progress is not None and progress < prev_progress - BACKTRACK_TOLERANCE_M:
+                cost += BACKTRACK_PENALTY_M
+            if cost < best_cost:
+                best_cost = cost
+                best = (i, sx, sy, progress)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+
+class MapMatcher:
+    """Ingest stage: drops physically impossible fixes and snaps the rest onto the bus's route.
+
+    Each fix is checked against the bus's previous accepted one (earlier in
+    the same batch, else the hub's latest, which is shared across workers):
+    it is rejected if it is older, implies a ground speed no bus reaches, or
+    moves a long way against its own reported heading. A fix with the same
+    timestamp replaces the previous one. Accepted fixes within
+    MAX_SNAP_M of the route polyline are moved onto it and annotated with
+    their distance along the route and the next stop. Route polylines come
+    from the ETA engine (RouteStop/Stop order); segment indexes are built on
+    first use and rebuilt when the geometry is reloaded.
+    """
+
+    def __init__(
+        self,
+        engine: EtaEngine = eta_engine,
+        realtime: RealtimeHub = hub,
+        max_snap_m: float = MAX_SNAP_M,
+        max_speed_mps: float = MAX_SPEED_MPS,
+    ) -> None:
+        self._engine = engine
+        self._hub = realtime
+        self.max_snap_m = max_snap_m
+        self.max_speed_mps = max_speed_mps
+        self._lock = Lock()
+        self._indexes: Dict[int, SegmentIndex] = {}
+        self._streaks: Dict[int, int] = {}
+        self.snapped = 0
+        self.off_route = 0
+        self.unrouted = 0
+        self.rejected: Dict[str, int] = {reason: 0 for reason in REJECT_REASONS}
+
+    def _index(self, route_id: int) -> Optional[SegmentIndex]:
+        geom = self._engine.route(route_id)
+        if geom is None:
+            return None
+        index = self._indexes.get(route_id)
+        if index is None or index.geom is not geom:
+            index = self._indexes[route_id] = SegmentIndex(geom, radius_m=self.max_snap_m)
+        return index
+
+    def process(self, positions: List[Position]) -> List[Position]:
+        """Matched positions to ingest, in order; rejected fixes are left out."""
+        accepted: List[Position] = []
+        latest: Dict[int, Position] = {}
+        with self._lock:
+            for pos in positions:
+                prev = latest.get(pos.bus_id) or self._hub.latest(pos.bus_id)
+                reason = self._check(pos, prev)
+                if reason == "stale":
+                    # Older than what the bus already reported; never overridden by the streak
+                    self.rejected[reason] += 1
+                    continue
+                if reason is not None:
+                    streak = self._streaks.get(pos.bus_id, 0) + 1
+                    if streak < MAX_REJECT_STREAK:
+                        self._streaks[pos.bus_id] = streak
+                        self.rejected[reason] += 1
+                        continue
+                self._streaks.pop(pos.bus_id, None)
+                matched = self._match(pos, prev)
+                latest[pos.bus_id] = matched
+                accepted.append(matched)
+        return accepted
+
+    def _check(self, pos: Position, prev: Optional[Position]) -> Optional[str]:
+        if prev is None:
+            return None
+        dt = pos.timestamp - prev.timestamp
+        if dt < 0:
+            return "stale"
+        # Same timestamp (a resend, or fixes that both took the batch's arrival time): the later one
+        # replaces the earlier, as it would without matching
+        if dt == 0 or dt > MAX_CHECK_GAP_S:
+            return None
+        dist = haversine_m(prev.latitude, prev.longitude, pos.latitude, pos.longitude)
+        if dist - GPS_ERROR_M > self.max_speed_mps * dt:
+            return "speed"
+        if pos.heading is not None and dist >= MIN_HEADING_CHECK_M and (pos.speed is None or pos.speed >= MIN_HEADING_SPEED):
+            if _angle(_bearing(prev.latitude, prev.longitude, pos.latitude, pos.longitude), pos.heading) > MAX_HEADING_DIFF:
+                return "heading"
+        return None
+
+    def _match(self, pos: Position, prev: Optional[Position]) -> Position:
+        route_id = self._hub.route_of(pos.bus_id)
+        index = self._index(route_id) if route_id is not None else None
+        if index is None:
+            self.unrouted += 1
+            return pos
+        geom = index.geom
+        x, y = geom.to_xy(pos.latitude, pos.longitude)
+        moving = pos.heading is not None and (pos.speed is None or pos.speed >= MIN_HEADING_SPEED)
+        best = index.nearest(
+            x, y,
+            heading=pos.heading if moving else None,
+            prev_progress=prev.progress_m if prev is not None else None,
+        )
+        if best is None:
+            self.off_route += 1
+            return replace(pos, progress_m=None, next_stop_id=None)
+        seg, sx, sy, progress = best
+        lat, lon = geom.to_latlon(sx, sy)
+        self.snapped += 1
+        # ~1 cm is plenty; keeps the JSON short
+        return replace(
+            pos,
+            latitude=round(lat, 7),
+            longitude=round(lon, 7),
+            progress_m=round(progress, 1),
+            next_stop_id=int(geom.stop_ids[seg + 1]),
+        )
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "snapped": self.snapped,
+                "off_route": self.off_route,
+                "unrouted": self.unrouted,
+                "rejected": dict(self.rejected),
+                "routes_indexed": len(self._indexes),
+            }
+
+
+map_matcher = MapMatcher()
@@ -0,0 +1,197 @@
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from threading import Condition, Thread
+from typing import Deque, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, insert, select
+
+from models import VehiclePosition
+from services.realtime import Position
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_QUEUE = 100000
+
+
+def to_db_time(ts: float) -> datetime:
+    # vehicle_positions stores naive UTC datetimes
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def from_db_time(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class PositionWriter:
+    """Write-behind buffer that persists positions to vehicle_positions in bulk.
+
+    Ingest appends to a bounded deque (oldest rows are dropped when full); a
+    background thread flushes every `flush_interval` seconds or as soon as
+    `batch_size` rows are waiting, using one executemany INSERT per batch.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Deque[Position] = deque()
+        self._cond = Condition()
+        self._session_factory = None
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def configure(self, session_factory, batch_size: int, flush_interval: float, max_queue: int) -> None:
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+    def enqueue(self, positions: Iterable[Position]) -> None:
+        if self._session_factory is None:
+            return
+        with self._cond:
+            for pos in positions:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popleft()
+                    self.dropped += 1
+                self._queue.append(pos)
+            self._ensure_thread()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_thread(self) -> None:
+        # Started lazily so gunicorn workers each get their own thread after fork
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = Thread(target=self._run, name="position-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size and not self._stopped:
+                    self._cond.wait(timeout=self.flush_interval)
+                if self._stopped and not self._queue:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # The batch is already off the queue; keep the thread alive for the next one
+                logger.exception("Position writer flush failed")
+
+    def flush(self) -> int:
+        """Write everything queued right now, batch_size rows per statement."""
+        total = 0
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return total
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+            self._write(batch)
+            total += len(batch)
+
+    @staticmethod
+    def _row(p: Position) -> dict:
+        return {
+            "bus_id": p.bus_id,
+            "lat": p.latitude,
+            "lon": p.longitude,
+            "heading": p.heading,
+            "speed": p.speed,
+            "timestamp": to_db_time(p.timestamp),
+        }
+
+    def _write(self, batch: List[Position]) -> None:
+        rows = []
+        for p in batch:
+            # A timestamp datetime cannot represent fails that row only, not the batch
+            try:
+                rows.append(self._row(p))
+            except (ValueError, OverflowError, OSError):
+                self.failed += 1
+                logger.warning("Dropping position for bus %s with bad timestamp %r", p.bus_id, p.timestamp)
+        if not rows:
+            return
+        started = time.perf_counter()
+        session = self._session_factory()
+        try:
+            session.execute(insert(VehiclePosition), rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            self.failed += len(rows)
+            logger.exception("Failed to persist %d positions", len(rows))
+            return
+        finally:
+            session.close()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.written += len(rows)
+        self.flushes += 1
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            depth = len(self._queue)
+        return {
+            "queue_depth": depth,
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+
+position_writer = PositionWriter()
+
+
+def load_latest_positions(session) -> List[Position]:
+    """Most recent persisted row per bus, used to rehydrate the hub on startup."""
+    latest = (
+        select(VehiclePosition.bus_id, func.max(VehiclePosition.timestamp).label("ts"))
+        .group_by(VehiclePosition.bus_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(VehiclePosition)
+        .join(latest, (VehiclePosition.bus_id == latest.c.bus_id) & (VehiclePosition.timestamp == latest.c.ts))
+    ).scalars()
+    positions: Dict[int, Position] = {}
+    for row in rows:
+        positions[row.bus_id] = Position(
+            bus_id=row.bus_id,
+            latitude=row.lat,
+            longitude=row.lon,
+            heading=row.heading,
+            speed=row.speed,
+            timestamp=from_db_time(row.timestamp),
+        )
+    return list(positions.values())
@@ -0,0 +1,195 @@
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+
+INITIAL_CAPACITY = 1024
+
+
+@dataclass(slots=True)
+class Position:
+    bus_id: int
+    latitude: float
+    longitude: float
+    heading: Optional[float] = None
+    speed: Optional[float] = None
+    timestamp: float = 0.0
+    # Set by map matching (services.matching): meters along the route and the next stop
+    progress_m: Optional[float] = None
+    next_stop_id: Optional[int] = None
+
+
+def _num(value: float) -> str:
+    # json.dumps renders floats with repr(); NaN marks a missing heading/speed
+    return "null" if value != value else repr(value)
+
+
+def _stop(value: int) -> str:
+    return "null" if value < 0 else str(value)
+
+
+def position_json(pos: Position) -> str:
+    """Same JSON as json.dumps(asdict(pos)) (heading/speed/progress at store precision), without the dict round trip."""
+    heading = "null" if pos.heading is None else repr(round(float(pos.heading), 2))
+    speed = "null" if pos.speed is None else repr(round(float(pos.speed), 2))
+    progress = "null" if pos.progress_m is None else repr(round(float(pos.progress_m), 1))
+    next_stop = "null" if pos.next_stop_id is None else str(pos.next_stop_id)
+    return (
+        f'{{"bus_id": {pos.bus_id}, "latitude": {pos.latitude!r}, "longitude": {pos.longitude!r}, '
+        f'"heading": {heading}, "speed": {speed}, "timestamp": {pos.timestamp!r}, '
+        f'"progress_m": {progress}, "next_stop_id": {next_stop}}}'
+    )
+
+
+class PositionStore:
+    """Latest position per bus as struct-of-arrays columns indexed by a dense slot.
+
+    Coordinates and timestamps are float64; heading and speed are float32
+    (NaN = unknown) and read back rounded to 0.01; route progress is kept to
+    0.1 m and the next stop is -1 when unmatched. Freed slots are reused,
+    so the columns stay as dense as the live fleet. Not thread-safe: the hub
+    guards it with its lock.
+    """
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY) -> None:
+        self._slots: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._high = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int) -> None:
+        def grow(old: Optional[np.ndarray], dtype, fill) -> np.ndarray:
+            column = np.full(capacity, fill, dtype=dtype)
+            if old is not None:
+                column[: len(old)] = old
+            return column
+
+        self.bus_id = grow(getattr(self, "bus_id", None), np.int64, -1)
+        self.lat = grow(getattr(self, "lat", None), np.float64, np.nan)
+        self.lon = grow(getattr(self, "lon", None), np.float64, np.nan)
+        self.heading = grow(getattr(self, "heading", None), np.float32, np.nan)
+        self.speed = grow(getattr(self, "speed", None), np.float32, np.nan)
+        self.ts = grow(getattr(self, "ts", None), np.float64, np.nan)
+        self.progress = grow(getattr(self, "progress", None), np.float64, np.nan)
+        self.next_stop = grow(getattr(self, "next_stop", None), np.int64, -1)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, bus_id: int) -> bool:
+        return bus_id in self._slots
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._slots)
+
+    def slot(self, bus_id: int) -> Optional[int]:
+        return self._slots.get(bus_id)
+
+    def put(self, pos: Position) -> int:
+        slot = self._slots.get(pos.bus_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                if self._high == len(self.ts):
+                    self._alloc(len(self.ts) * 2)
+                slot = self._high
+                self._high += 1
+            self._slots[pos.bus_id] = slot
+            self.bus_id[slot] = pos.bus_id
+        self.lat[slot] = pos.latitude
+        self.lon[slot] = pos.longitude
+        self.heading[slot] = np.nan if pos.heading is None else pos.heading
+        self.speed[slot] = np.nan if pos.speed is None else pos.speed
+        self.ts[slot] = pos.timestamp
+        self.progress[slot] = np.nan if pos.progress_m is None else pos.progress_m
+        self.next_stop[slot] = -1 if pos.next_stop_id is None else pos.next_stop_id
+        return slot
+
+    def remove(self, bus_id: int) -> bool:
+        slot = self._slots.pop(bus_id, None)
+        if slot is None:
+            return False
+        self.bus_id[slot] = -1
+        self.ts[slot] = np.nan
+        self._free.append(slot)
+        return True
+
+    def timestamp(self, bus_id: int) -> Optional[float]:
+        slot = self._slots.get(bus_id)
+        return None if slot is None else float(self.ts[slot])
+
+    def coords(self, bus_id: int):
+        slot = self._slots[bus_id]
+        return float(self.lat[slot]), float(self.lon[slot])
+
+    def get(self, bus_id: int) -> Optional[Position]:
+        slot = self._slots.get(bus_id)
+        if slot is None:
+            return None
+        heading = float(self.heading[slot])
+        speed = float(self.speed[slot])
+        progress = float(self.progress[slot])
+        next_stop = int(self.next_stop[slot])
+        return Position(
+            bus_id=bus_id,
+            latitude=float(self.lat[slot]),
+            longitude=float(self.lon[slot]),
+            heading=None if math.isnan(heading) else round(heading, 2),
+            speed=None if math.isnan(speed) else round(speed, 2),
+            timestamp=float(self.ts[slot]),
+            progress_m=None if math.isnan(progress) else round(progress, 1),
+            next_stop_id=None if next_stop < 0 else next_stop,
+        )
+
+    def live_slots(self) -> np.ndarray:
+        return np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+
+    def slots_of(self, bus_ids: Sequence[int]) -> np.ndarray:
+        get = self._slots.get
+        return np.fromiter((s for s in map(get, bus_ids) if s is not None), dtype=np.int64)
+
+    def _columns(self, slots: np.ndarray):
+        return (
+            self.bus_id[slots].tolist(),
+            self.lat[slots].tolist(),
+            self.lon[slots].tolist(),
+            np.round(self.heading[slots].astype(np.float64), 2).tolist(),
+            np.round(self.speed[slots].astype(np.float64), 2).tolist(),
+            self.ts[slots].tolist(),
+            np.round(self.progress[slots], 1).tolist(),
+            self.next_stop[slots].tolist(),
+        )
+
+    def to_json(self, slots: np.ndarray) -> str:
+        """JSON array of the given slots: columns are gathered with one fancy index each."""
+        if len(slots) == 0:
+            return "[]"
+        rows = zip(*self._columns(slots))
+        return "[" + ", ".join(
+            f'{{"bus_id": {b}, "latitude": {la!r}, "longitude": {lo!r}, '
+            f'"heading": {_num(h)}, "speed": {_num(s)}, "timestamp": {t!r}, '
+            f'"progress_m": {_num(p)}, "next_stop_id": {_stop(n)}}}'
+            for b, la, lo, h, s, t, p, n in rows
+        ) + "]"
+
+    def to_dicts(self, slots: np.ndarray) -> List[Dict[str, object]]:
+        return [
+            {
+                "bus_id": b,
+                "latitude": la,
+                "longitude": lo,
+                "heading": None if h != h else h,
+                "speed": None if s != s else s,
+                "timestamp": t,
+                "progress_m": None if p != p else p,
+                "next_stop_id": None if n < 0 else n,
+            }
+            for b, la, lo, h, s, t, p, n in zip(*self._columns(slots))
+        ]
+
+    def nbytes(self) -> int:
+        columns = (self.bus_id, self.lat, self.lon, self.heading, self.speed, self.ts, self.progress, self.next_stop)
+        return sum(c.nbytes for c in columns)
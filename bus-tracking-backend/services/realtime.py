@@ -1,88 +1,715 @@
+import asyncio
+import heapq
 import json
+import logging
 import time
-from collections import defaultdict
-from dataclasses import dataclass, asdict
-from threading import Lock
-from typing import Dict, Generator, List, Optional
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from threading import Condition, Event, Lock, Thread
+from typing import AsyncGenerator, Callable, Deque, Dict, Generator, List, Optional, OrderedDict as OrderedDictT, Set, Tuple
 
+from services.geo import BBox, GridIndex, in_bbox
+from services.position_store import Position, PositionStore, position_json
 
-@dataclass
-class Position:
-    bus_id: int
-    latitude: float
-    longitude: float
-    heading: Optional[float] = None
-    speed: Optional[float] = None
-    timestamp: float = 0.0
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DROP_POLICIES = (DROP_OLDEST, COALESCE)
+DEFAULT_BUFFER_SIZE = 256
+KEEPALIVE_SECONDS = 15
+# Dispatcher batching window: updates arriving within one tick share a frame
+DISPATCH_INTERVAL = 0.05
+DEFAULT_NEAREST_K = 10
+# Buses silent for this long are expired from the live state (0 disables)
+DEFAULT_POSITION_TTL = 600
+# How often the dispatcher checks the expiry heap when no updates arrive
+EXPIRY_CHECK_INTERVAL = 1.0
+
+
+@dataclass(frozen=True)
+class PositionFilter:
+    """Subset of the fleet a snapshot or stream is restricted to (all given criteria must hold)."""
+
+    bus_id: Optional[int] = None
+    route_id: Optional[int] = None
+    bbox: Optional[BBox] = None
+    near: Optional[Tuple[float, float]] = None
+    k: int = DEFAULT_NEAREST_K
+
+    def is_empty(self) -> bool:
+        return self.bus_id is None and self.route_id is None and self.bbox is None and self.near is None
+
+
+def encode_event(message: dict) -> str:
+    return f"data: {json.dumps(message)}\n\n"
+
+
+class InProcessTransport:
+    """Default hub transport: published batches are applied to this process's hub directly.
+
+    Transports decouple ingest from fan-out. `publish` is called by the
+    process that received the positions; the transport must eventually call
+    `hub.apply` exactly once per process with every published batch (see
+    services.broker.RedisTransport for the multi-process variant).
+    """
+
+    def start(self, hub: "RealtimeHub") -> None:
+        self._hub = hub
+
+    def ensure_running(self) -> None:
+        pass
+
+    def publish(self, positions: List[Position]) -> None:
+        self._hub.apply(positions)
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "in-process"}
 
 
 class RealtimeHub:
-    def __init__(self) -> None:
-        self._latest: Dict[int, Position] = {}
-        self._subscribers: List["Subscriber"] = []
+    """Latest position per bus plus SSE fan-out.
+
+    Ingest hands positions to the transport, which applies them to every
+    process's hub (only this one by default). Applying records the position
+    and queues it; a background dispatcher wakes once per tick, coalesces
+    queued updates per bus, encodes each SSE event once and hands the same
+    frame to every subscriber.
+    """
+
+    def __init__(self, dispatch_interval: float = DISPATCH_INTERVAL, ttl: float = DEFAULT_POSITION_TTL) -> None:
+        # Latest position per bus, struct-of-arrays (see services.position_store)
+        self._store = PositionStore()
+        self._pending: Dict[int, Position] = {}
+        self._grid = GridIndex()
+        self._bus_route: Dict[int, int] = {}
+        self._route_buses: Dict[int, Set[int]] = {}
+        self._listeners: List[Callable[[List[Position]], None]] = []
+        self._origin_listeners: List[Callable[[List[Position]], None]] = []
+        self._flush_listeners: List[Callable[[Dict[int, Position]], None]] = []
+        self._offline_listeners: List[Callable[[List[int]], None]] = []
+        # Optional stage every ingested batch passes through first (e.g. map matching)
+        self._ingest_stage: Optional[Callable[[List[Position]], List[Position]]] = None
+        # Insertion-ordered set: O(1) unsubscribe with tens of thousands of streams
+        self._subscribers: Dict["Subscriber", None] = {}
         self._lock = Lock()
+        self._dispatch_interval = dispatch_interval
+        self._wakeup = Event()
+        self._dispatcher: Optional[Thread] = None
+        # Change tracking for conditional/delta polling: every stored update bumps
+        # the global sequence; _changes keeps buses ordered by their last change
+        # so "changed since N" walks only the tail. The epoch tells clients when
+        # a sequence comes from another process (restart, other worker).
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._changes: OrderedDictT[int, int] = OrderedDict()
+        self._snapshot_cache: Optional[Tuple[int, str]] = None
+        # TTL expiry: at most one heap entry per live bus, keyed by its deadline
+        # when pushed. Updates only move _last_seen (O(1)); a popped entry whose
+        # bus was seen since is pushed back with the new deadline (O(log n)).
+        self.ttl = ttl
+        self._last_seen: Dict[int, float] = {}
+        self._expiry_heap: List[Tuple[float, int]] = []
+        self._in_heap: Set[int] = set()
+        self._offline: Dict[int, float] = {}
+        self.expired_total = 0
+        self._transport = InProcessTransport()
+        self._transport.start(self)
+
+    def set_transport(self, transport) -> None:
+        old, self._transport = self._transport, transport
+        old.close()
+        transport.start(self)
+
+    def add_listener(self, listener: Callable[[List[Position]], None], origin_only: bool = False) -> None:
+        """Call `listener` with every applied batch (after the hub has stored it).
+
+        With a shared transport every process applies every batch; listeners
+        with side effects that must happen once (e.g. persistence) pass
+        origin_only=True and run only in the process that ingested the batch.
+        """
+        listeners = self._origin_listeners if origin_only else self._listeners
+        if listener not in listeners:
+            listeners.append(listener)
+
+    def add_flush_listener(self, listener: Callable[[Dict[int, Position]], None]) -> None:
+        """Call `listener` from the dispatcher once per tick with the coalesced batch (bus id -> newest)."""
+        if listener not in self._flush_listeners:
+            self._flush_listeners.append(listener)
+
+    def set_ingest_stage(self, stage: Optional[Callable[[List[Position]], List[Position]]]) -> None:
+        """Run `stage` over each batch before it is published; it returns the positions to keep."""
+        self._ingest_stage = stage
+
+    def add_offline_listener(self, listener: Callable[[List[int]], None]) -> None:
+        """Call `listener` with the ids of buses that just expired (from the dispatcher thread)."""
+        if listener not in self._offline_listeners:
+            self._offline_listeners.append(listener)
+
+    def set_ttl(self, ttl: float) -> None:
+        with self._lock:
+            self.ttl = ttl
+            self._expiry_heap = []
+            self._in_heap = set()
+            if ttl > 0:
+                for bus_id, seen in self._last_seen.items():
+                    self._schedule_locked(bus_id, seen)
+
+    def _notify(self, listeners: List[Callable[[List[Position]], None]], positions: List[Position]) -> None:
+        for listener in listeners:
+            try:
+                listener(positions)
+            except Exception:
+                logger.exception("Position listener failed")
 
     def update_position(self, pos: Position) -> None:
+        self.update_positions([pos])
+
+    def update_positions(self, positions: List[Position]) -> List[Position]:
+        """Ingest a batch: publish it through the transport; later entries win per bus.
+
+        Returns the positions actually ingested (after the ingest stage).
+        """
+        if positions and self._ingest_stage is not None:
+            positions = self._ingest_stage(positions)
+        if not positions:
+            return positions
+        self._notify(self._origin_listeners, positions)
+        self._transport.publish(positions)
+        return positions
+
+    def apply(self, positions: List[Position]) -> None:
+        """Store and fan out a published batch under one lock acquisition (called by the transport)."""
+        now = time.time()
+        with self._lock:
+            for pos in positions:
+                self._store_locked(pos, now)
+            self._ensure_dispatcher()
+        self._wakeup.set()
+        self._notify(self._listeners, positions)
+
+    def ensure_transport(self) -> None:
+        # Broker transports start their receive loop lazily, once per worker after fork
+        self._transport.ensure_running()
+
+    def transport_stats(self) -> Dict[str, object]:
+        return self._transport.stats()
+
+    def restore_positions(self, positions: List[Position]) -> None:
+        """Seed latest state (e.g. from the database) without broadcasting or notifying listeners."""
+        with self._lock:
+            for pos in positions:
+                current = self._store.timestamp(pos.bus_id)
+                if current is not None and current >= pos.timestamp:
+                    continue
+                self._store.put(pos)
+                self._grid.update(pos.bus_id, pos.latitude, pos.longitude)
+                self._touch_locked(pos.bus_id)
+                # Restored rows count as seen at their own timestamp, so stale ones expire right away
+                self._seen_locked(pos.bus_id, pos.timestamp)
+            self._ensure_dispatcher()
+
+    def load_bus_routes(self, pairs: List[Tuple[int, Optional[int]]]) -> None:
+        """Replace the bus -> route linkage (e.g. from the buses table at startup)."""
+        bus_route = {bus_id: route_id for bus_id, route_id in pairs if route_id is not None}
+        route_buses: Dict[int, Set[int]] = {}
+        for bus_id, route_id in bus_route.items():
+            route_buses.setdefault(route_id, set()).add(bus_id)
+        with self._lock:
+            self._bus_route = bus_route
+            self._route_buses = route_buses
+            # Route-filtered delta polls must see buses whose membership may have changed
+            for bus_id in list(self._store):
+                self._touch_locked(bus_id)
+
+    def set_bus_route(self, bus_id: int, route_id: Optional[int]) -> None:
+        with self._lock:
+            old = self._bus_route.pop(bus_id, None)
+            if old is not None:
+                members = self._route_buses.get(old)
+                if members is not None:
+                    members.discard(bus_id)
+                    if not members:
+                        del self._route_buses[old]
+            if route_id is not None:
+                self._bus_route[bus_id] = route_id
+                self._route_buses.setdefault(route_id, set()).add(bus_id)
+            if old != route_id and bus_id in self._store:
+                self._touch_locked(bus_id)
+
+    def latest(self, bus_id: int) -> Optional[Position]:
+        with self._lock:
+            return self._store.get(bus_id)
+
+    def buses_on_route(self, route_id: int) -> List[int]:
+        with self._lock:
+            return list(self._route_buses.get(route_id, ()))
+
+    def bus_count(self) -> int:
+        return len(self._store)
+
+    def route_of(self, bus_id: int) -> Optional[int]:
+        return self._bus_route.get(bus_id)
+
+    def _store_locked(self, pos: Position, now: Optional[float] = None) -> None:
+        self._store.put(pos)
+        self._pending[pos.bus_id] = pos
+        self._grid.update(pos.bus_id, pos.latitude, pos.longitude)
+        self._touch_locked(pos.bus_id)
+        # Liveness follows arrival time, not the device clock
+        self._seen_locked(pos.bus_id, time.time() if now is None else now)
+
+    def _seen_locked(self, bus_id: int, seen: float) -> None:
+        self._last_seen[bus_id] = seen
+        self._offline.pop(bus_id, None)
+        if self.ttl > 0 and bus_id not in self._in_heap:
+            self._schedule_locked(bus_id, seen)
+
+    def _schedule_locked(self, bus_id: int, seen: float) -> None:
+        heapq.heappush(self._expiry_heap, (seen + self.ttl, bus_id))
+        self._in_heap.add(bus_id)
+
+    def expire(self, now: Optional[float] = None) -> List[int]:
+        """Drop buses not seen for `ttl` seconds; emits "offline" events. Returns the expired ids."""
+        if self.ttl <= 0:
+            return []
+        now = time.time() if now is None else now
+        expired: List[Tuple[int, float, float, float, Optional[int]]] = []
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                _, bus_id = heapq.heappop(heap)
+                self._in_heap.discard(bus_id)
+                seen = self._last_seen.get(bus_id)
+                if seen is None or bus_id not in self._store:
+                    continue
+                if seen + self.ttl > now:
+                    self._schedule_locked(bus_id, seen)
+                    continue
+                lat, lon = self._store.coords(bus_id)
+                expired.append((bus_id, seen, lat, lon, self._bus_route.get(bus_id)))
+                self._store.remove(bus_id)
+                self._grid.remove(bus_id)
+                self._pending.pop(bus_id, None)
+                del self._last_seen[bus_id]
+                self._offline[bus_id] = seen
+                self._touch_locked(bus_id)
+            if not expired:
+                return []
+            self.expired_total += len(expired)
+            subs = list(self._subscribers)
+
+        parts = {
+            bus_id: encode_event({"type": "offline", "payload": {"bus_id": bus_id, "last_seen": seen}})
+            for bus_id, seen, _, _, _ in expired
+        }
+        for sub in subs:
+            filt = sub.filter
+            if filt is None or filt.near is not None:
+                selected = parts
+            else:
+                selected = {
+                    bus_id: parts[bus_id]
+                    for bus_id, _, lat, lon, route_id in expired
+                    if (filt.bus_id is None or filt.bus_id == bus_id)
+                    and (filt.route_id is None or filt.route_id == route_id)
+                    and (filt.bbox is None or in_bbox(filt.bbox, lat, lon))
+                }
+            if selected:
+                sub.publish("".join(selected.values()), selected)
+        ids = [bus_id for bus_id, _, _, _, _ in expired]
+        self._notify(self._offline_listeners, ids)
+        return ids
+
+    def presence(self) -> Dict[str, int]:
+        with self._lock:
+            return {"online": len(self._store), "offline": len(self._offline), "expired_total": self.expired_total}
+
+    def _touch_locked(self, bus_id: int) -> None:
+        self._seq += 1
+        self._changes[bus_id] = self._seq
+        self._changes.move_to_end(bus_id)
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def snapshot_json(self) -> Tuple[int, str]:
+        """(seq, JSON array of every bus), serialized once per sequence number."""
+        self.ensure_transport()
+        with self._lock:
+            cached = self._snapshot_cache
+            if cached is not None and cached[0] == self._seq:
+                return cached
+            body = self._store.to_json(self._store.live_slots())
+            self._snapshot_cache = (self._seq, body)
+            return self._snapshot_cache
+
+    def changes_json(
+        self, since: int, filt: Optional[PositionFilter] = None, full: bool = False
+    ) -> Tuple[int, bool, str, List[int]]:
+        """(seq, full, JSON array, removed ids) of buses changed after `since`, newest last.
+
+        Cost is proportional to the number of changed buses. With full=True
+        (e.g. the cursor came from another process), or a `since` ahead of the
+        current sequence, every bus is returned and the result is marked
+        full. `filt` may restrict by bus, route and bbox (not near).
+        Buses expired since then are listed in `removed` (route/bbox filters
+        cannot be checked for them any more, so only bus_id narrows it).
+        """
+        self.ensure_transport()
+        with self._lock:
+            full = full or since > self._seq
+            if full:
+                bus_ids = list(self._changes)
+            else:
+                bus_ids = []
+                for bus_id, version in reversed(self._changes.items()):
+                    if version <= since:
+                        break
+                    bus_ids.append(bus_id)
+                bus_ids.reverse()
+            removed = [] if full else [b for b in bus_ids if b not in self._store]
+            if filt is not None and filt.bus_id is not None:
+                removed = [b for b in removed if b == filt.bus_id]
+            if filt is not None and not filt.is_empty():
+                bus_ids = [b for b in bus_ids if b in self._store and self._matches_locked(filt, b)]
+            body = self._store.to_json(self._store.slots_of(bus_ids))
+            return self._seq, full, body, removed
+
+    def _nearest_locked(self, filt: PositionFilter) -> List[Tuple[int, float]]:
+        lat, lon = filt.near  # type: ignore[misc]
+        if filt.bus_id is None and filt.route_id is None and filt.bbox is None:
+            return self._grid.nearest(lat, lon, filt.k)
+        # Other criteria shrink the candidate set, so rank the matching buses directly
+        ranked = self._grid.nearest(lat, lon, len(self._grid))
+        return [(b, d) for b, d in ranked if self._matches_locked(filt, b)][:filt.k]
+
+    def _matches_locked(self, filt: PositionFilter, bus_id: int, pos: Optional[Position] = None) -> bool:
+        # `near` is a ranking, not a predicate; callers handle it via _nearest_locked.
+        # Coordinates come from `pos` when given, else from the store.
+        if filt.bus_id is not None and bus_id != filt.bus_id:
+            return False
+        if filt.route_id is not None and self._bus_route.get(bus_id) != filt.route_id:
+            return False
+        if filt.bbox is not None:
+            lat, lon = (pos.latitude, pos.longitude) if pos is not None else self._store.coords(bus_id)
+            if not in_bbox(filt.bbox, lat, lon):
+                return False
+        return True
+
+    def _ensure_dispatcher(self) -> None:
+        # Started lazily so gunicorn workers each get their own thread after fork
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = Thread(target=self._dispatch_loop, name="realtime-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            if self._wakeup.wait(timeout=EXPIRY_CHECK_INTERVAL):
+                self._wakeup.clear()
+                time.sleep(self._dispatch_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Realtime dispatch failed")
+            try:
+                self.expire()
+            except Exception:
+                logger.exception("Position expiry failed")
+
+    def flush(self) -> None:
+        """Fan out everything queued since the last tick."""
         with self._lock:
-            self._latest[pos.bus_id] = pos
+            batch = self._pending
+            self._pending = {}
             subs = list(self._subscribers)
-        data = json.dumps({"type": "position", "payload": asdict(pos)})
+            if not batch:
+                return
+            # Filtered streams share one selection per distinct filter
+            selections: Dict[PositionFilter, Set[int]] = {}
+            for s in subs:
+                filt = s.filter
+                if filt is None or filt in selections:
+                    continue
+                if filt.near is not None:
+                    selections[filt] = {b for b, _ in self._nearest_locked(filt)} & batch.keys()
+                elif filt == PositionFilter(route_id=filt.route_id, k=filt.k):
+                    # Plain per-route channel: one set intersection
+                    selections[filt] = self._route_buses.get(filt.route_id, set()) & batch.keys()
+                else:
+                    selections[filt] = {b for b, pos in batch.items() if self._matches_locked(filt, b, pos)}
+
+        for listener in self._flush_listeners:
+            try:
+                listener(batch)
+            except Exception:
+                logger.exception("Flush listener failed")
+        if not subs:
+            return
+
+        parts = {bus_id: f'data: {{"type": "position", "payload": {position_json(pos)}}}\n\n' for bus_id, pos in batch.items()}
+        frame = "".join(parts.values())
+        filtered: Dict[PositionFilter, Tuple[str, Dict[int, str]]] = {}
+        for filt, selected in selections.items():
+            sub_parts = {b: event for b, event in parts.items() if b in selected}
+            filtered[filt] = ("".join(sub_parts.values()), sub_parts)
         for s in subs:
-            s.publish(data)
+            if s.filter is None:
+                s.publish(frame, parts)
+                continue
+            sub_frame, sub_parts = filtered[s.filter]
+            if sub_parts:
+                s.publish(sub_frame, sub_parts)
 
-    def get_snapshot(self, route_id: Optional[int] = None, bus_id: Optional[int] = None):
+    def get_snapshot(
+        self,
+        route_id: Optional[int] = None,
+        bus_id: Optional[int] = None,
+        bbox: Optional[BBox] = None,
+        near: Optional[Tuple[float, float]] = None,
+        k: int = DEFAULT_NEAREST_K,
+    ):
+        self.ensure_transport()
+        filt = PositionFilter(bus_id=bus_id, route_id=route_id, bbox=bbox, near=near, k=k)
         with self._lock:
-            values = list(self._latest.values())
-        if bus_id is not None:
-            values = [p for p in values if p.bus_id == bus_id]
-        # route filter is a no-op for now until buses link to routes in memory
-        return [asdict(v) for v in values]
+            if near is not None:
+                ranked = self._nearest_locked(filt)
+                rows = self._store.to_dicts(self._store.slots_of([b for b, _ in ranked]))
+                for row, (_, d) in zip(rows, ranked):
+                    row["distance_m"] = round(d, 1)
+                return rows
+            # Start from the narrowest candidate set, then apply the remaining criteria
+            if bus_id is not None:
+                candidates = [bus_id]
+            elif route_id is not None:
+                candidates = list(self._route_buses.get(route_id, ()))
+            elif bbox is not None:
+                candidates = self._grid.within(bbox)
+            else:
+                return self._store.to_dicts(self._store.live_slots())
+            selected = [b for b in candidates if b in self._store and self._matches_locked(filt, b)]
+            return self._store.to_dicts(self._store.slots_of(selected))
 
-    def subscribe(self) -> "Subscriber":
-        sub = Subscriber()
+    def subscribe(
+        self,
+        maxlen: int = DEFAULT_BUFFER_SIZE,
+        policy: str = DROP_OLDEST,
+        filter: Optional[PositionFilter] = None,
+    ) -> "Subscriber":
+        return self._register(Subscriber(maxlen=maxlen, policy=policy), filter)
+
+    def subscribe_async(
+        self,
+        bridge: "LoopBridge",
+        maxlen: int = DEFAULT_BUFFER_SIZE,
+        policy: str = DROP_OLDEST,
+        filter: Optional[PositionFilter] = None,
+    ) -> "AsyncSubscriber":
+        """Subscriber drained by an asyncio task on the bridge's event loop."""
+        return self._register(AsyncSubscriber(bridge, maxlen=maxlen, policy=policy), filter)
+
+    def _register(self, sub: "Subscriber", filter: Optional[PositionFilter]):
+        self.ensure_transport()
+        sub.filter = None if filter is None or filter.is_empty() else filter
         with self._lock:
-            self._subscribers.append(sub)
+            self._subscribers[sub] = None
         def _on_close():
             with self._lock:
-                if sub in self._subscribers:
-                    self._subscribers.remove(sub)
+                self._subscribers.pop(sub, None)
         sub.on_close = _on_close
         return sub
 
+    def subscriber_stats(self) -> List[Dict[str, object]]:
+        with self._lock:
+            subs = list(self._subscribers)
+        return [s.stats() for s in subs]
+
 
 class Subscriber:
-    def __init__(self) -> None:
-        self._buffer: List[str] = []
-        self._lock = Lock()
+    """Bounded per-client buffer drained by an SSE generator.
+
+    When the buffer is full, "drop_oldest" discards the oldest message while
+    "coalesce" first collapses queued messages to the latest one per key (bus).
+    Counters (in frames) let operators see which clients are falling behind.
+    """
+
+    def __init__(self, maxlen: int = DEFAULT_BUFFER_SIZE, policy: str = DROP_OLDEST) -> None:
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(DROP_POLICIES)}")
+        if maxlen < 1:
+            raise ValueError("maxlen must be positive")
+        self.maxlen = maxlen
+        self.policy = policy
+        self._buffer: Deque[Tuple[Optional[Dict[int, str]], str]] = deque()
+        self._cond = Condition()
         self._closed = False
         self.on_close = None
+        self.filter: Optional[PositionFilter] = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
 
-    def publish(self, data: str) -> None:
-        with self._lock:
-            if not self._closed:
-                self._buffer.append(data)
+    def publish(self, frame: str, parts: Optional[Dict[int, str]] = None) -> None:
+        """Queue a pre-encoded SSE frame; parts maps bus id to its event within the frame."""
+        with self._cond:
+            if self._closed:
+                return
+            self.published += 1
+            if len(self._buffer) >= self.maxlen:
+                if self.policy == COALESCE:
+                    self._coalesce()
+                if len(self._buffer) >= self.maxlen:
+                    self._buffer.popleft()
+                    self.dropped += 1
+            self._buffer.append((parts, frame))
+            self._cond.notify()
+
+    def _coalesce(self) -> None:
+        # Merge all per-bus frames into one holding the newest event per bus;
+        # frames without parts (control messages) are kept as they are
+        merged: Dict[int, str] = {}
+        kept: Deque[Tuple[Optional[Dict[int, str]], str]] = deque()
+        total = 0
+        for parts, frame in self._buffer:
+            if parts is None:
+                kept.append((parts, frame))
+                continue
+            total += len(parts)
+            for bus_id, event in parts.items():
+                merged.pop(bus_id, None)
+                merged[bus_id] = event
+        if merged:
+            self.coalesced += total - len(merged)
+            kept.append((merged, "".join(merged.values())))
+        self._buffer = kept
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "policy": self.policy,
+                "maxlen": self.maxlen,
+                "pending": len(self._buffer),
+                "published": self.published,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+            }
 
     def close(self) -> None:
-        with self._lock:
+        with self._cond:
+            if self._closed:
+                return
             self._closed = True
+            self._cond.notify_all()
         if self.on_close:
             self.on_close()
 
+    def _drain(self) -> Tuple[bool, List[str]]:
+        with self._cond:
+            if self._closed:
+                return True, []
+            chunks = [frame for _, frame in self._buffer]
+            self._buffer.clear()
+            self.delivered += len(chunks)
+        return False, chunks
+
     def stream(self) -> Generator[str, None, None]:
         try:
             # Initial comment to establish stream
             yield ":ok\n\n"
             while True:
-                chunk: Optional[str] = None
-                with self._lock:
-                    if self._buffer:
-                        chunk = self._buffer.pop(0)
-                if chunk is None:
-                    # heartbeat every 15s
+                with self._cond:
+                    if not self._buffer and not self._closed:
+                        # Woken by publish/close; otherwise heartbeat every 15s
+                        self._cond.wait(timeout=KEEPALIVE_SECONDS)
+                    if self._closed:
+                        return
+                    chunks = [frame for _, frame in self._buffer]
+                    self._buffer.clear()
+                    self.delivered += len(chunks)
+                if not chunks:
+                    yield f":keepalive {int(time.time())}\n\n"
+                    continue
+                yield "".join(chunks)
+        finally:
+            self.close()
+
+
+class LoopBridge:
+    """Wakes asyncio subscribers from the dispatcher thread.
+
+    Publishing to N subscribers costs one call_soon_threadsafe per dispatcher
+    tick instead of one per subscriber: woken subscribers are collected and
+    their events are set together on the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._lock = Lock()
+        # Anything with an asyncio.Event `ready` (AsyncSubscriber, WebSocket sessions)
+        self._ready: Set["AsyncSubscriber"] = set()
+        self._scheduled = False
+
+    def wake(self, sub: "AsyncSubscriber") -> None:
+        with self._lock:
+            self._ready.add(sub)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._run)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    def _run(self) -> None:
+        with self._lock:
+            ready = self._ready
+            self._ready = set()
+            self._scheduled = False
+        for sub in ready:
+            sub.ready.set()
+
+
+class AsyncSubscriber(Subscriber):
+    """Subscriber whose stream is an async generator; no thread is held while idle."""
+
+    def __init__(self, bridge: LoopBridge, maxlen: int = DEFAULT_BUFFER_SIZE, policy: str = DROP_OLDEST) -> None:
+        super().__init__(maxlen=maxlen, policy=policy)
+        self._bridge = bridge
+        self.ready = asyncio.Event()
+
+    def publish(self, frame: str, parts: Optional[Dict[int, str]] = None) -> None:
+        super().publish(frame, parts)
+        self._bridge.wake(self)
+
+    def close(self) -> None:
+        super().close()
+        self._bridge.wake(self)
+
+    async def stream_async(self) -> AsyncGenerator[str, None]:
+        try:
+            yield ":ok\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(self.ready.wait(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.ready.clear()
+                closed, chunks = self._drain()
+                if closed:
+                    return
+                if not chunks:
                     yield f":keepalive {int(time.time())}\n\n"
-                    time.sleep(15)
                     continue
-                yield f"data: {chunk}\n\n"
+                yield "".join(chunks)
         finally:
             self.close()
 
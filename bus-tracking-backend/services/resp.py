@@ -0,0 +1,124 @@
+"""Minimal Redis protocol (RESP2) client over a plain socket.
+
+Only what the realtime broker needs: commands, pipelines and a pub/sub
+connection. Works against Redis, KeyDB, Valkey or any RESP-speaking stand-in.
+"""
+import socket
+from typing import List, Optional, Sequence, Union
+from urllib.parse import unquote, urlparse
+
+
+DEFAULT_PORT = 6379
+DEFAULT_TIMEOUT = 5.0
+
+Arg = Union[str, bytes, int, float]
+
+
+class RespError(Exception):
+    """Error reply from the server (-ERR ...)."""
+
+
+def encode_command(args: Sequence[Arg]) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        else:
+            data = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+class RespConnection:
+    def __init__(self, url: str, timeout: Optional[float] = DEFAULT_TIMEOUT) -> None:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"unsupported broker URL scheme {parsed.scheme!r}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or DEFAULT_PORT
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        path = (parsed.path or "").lstrip("/")
+        self.db = int(path) if path else 0
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self.execute(*(["AUTH", self.username, self.password] if self.username else ["AUTH", self.password]))
+        if self.db:
+            self.execute("SELECT", self.db)
+
+    def close(self) -> None:
+        # Swapped out first: the broker closes a subscription while its reader thread may do the same
+        sock, file, self._sock, self._file = self._sock, self._file, None, None
+        if sock is not None:
+            try:
+                # shutdown() also wakes a thread blocked reading this socket
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                file.close()
+                sock.close()
+            except OSError:
+                pass
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def settimeout(self, timeout: Optional[float]) -> None:
+        self.timeout = timeout
+        if self._sock is not None:
+            self._sock.settimeout(timeout)
+
+    def send(self, *commands: Sequence[Arg]) -> None:
+        if self._sock is None:
+            self.connect()
+        self._sock.sendall(b"".join(encode_command(c) for c in commands))
+
+    def read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("broker closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise ConnectionError(f"unexpected reply {line!r}")
+
+    def execute(self, *args: Arg):
+        self.send(args)
+        return self.read_reply()
+
+    def pipeline(self, commands: List[Sequence[Arg]]) -> list:
+        """Send all commands in one write, then read every reply (errors are returned, not raised)."""
+        self.send(*commands)
+        replies = []
+        for _ in commands:
+            try:
+                replies.append(self.read_reply())
+            except RespError as exc:
+                replies.append(exc)
+        return replies
@@ -0,0 +1,275 @@
+"""Rollover and retention for vehicle_positions.
+
+SQLite: yesterday's (and older) rows move out of the hot table into per-day
+tables named vehicle_positions_YYYYMMDD, so the hot table only holds today.
+MySQL: the table is RANGE-partitioned by TO_DAYS(timestamp) (see migration
+a3f1c9d27b64); rollover splits daily partitions off the catch-all `pmax`.
+Other dialects keep a single table.
+
+Raw days older than the retention window are downsampled into
+vehicle_position_minutes, then the day table/partition is dropped (or the rows
+deleted). Run `python -m services.retention` daily, or enable RETENTION_JOBS_ENABLED.
+"""
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Engine
+
+from models import VehiclePosition, VehiclePositionMinute
+
+
+logger = logging.getLogger(__name__)
+
+HOT_TABLE = VehiclePosition.__tablename__
+DAY_TABLE_PREFIX = f"{HOT_TABLE}_"
+_DAY_TABLE_RE = re.compile(rf"^{DAY_TABLE_PREFIX}(\d{{8}})$")
+_PARTITION_RE = re.compile(r"^p(\d{8})$")
+
+# Daily MySQL partitions created ahead of time
+PARTITIONS_AHEAD = 3
+
+
+def day_table_name(day: date) -> str:
+    return f"{DAY_TABLE_PREFIX}{day:%Y%m%d}"
+
+
+def day_table(name: str, metadata: Optional[MetaData] = None) -> Table:
+    """Same columns as vehicle_positions, without the FK, plus its own composite index."""
+    return Table(
+        name,
+        metadata or MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("bus_id", Integer, nullable=False),
+        Column("lat", Float, nullable=False),
+        Column("lon", Float, nullable=False),
+        Column("heading", Float),
+        Column("speed", Float),
+        Column("timestamp", DateTime, nullable=False),
+        Index(f"ix_{name}_bus_id_timestamp", "bus_id", "timestamp"),
+    )
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def archived_days(engine: Engine) -> List[date]:
+    days = []
+    for name in inspect(engine).get_table_names():
+        match = _DAY_TABLE_RE.match(name)
+        if match:
+            days.append(datetime.strptime(match.group(1), "%Y%m%d").date())
+    return sorted(days)
+
+
+def history_tables(engine: Engine, start: datetime, end: datetime) -> List[Table]:
+    """Tables holding raw rows for [start, end), oldest first."""
+    hot = VehiclePosition.__table__
+    if engine.dialect.name != "sqlite":
+        return [hot]
+    tables = [day_table(day_table_name(d)) for d in archived_days(engine) if start.date() <= d <= end.date()]
+    return tables + [hot]
+
+
+def _sqlite_rollover(engine: Engine, today: date) -> int:
+    hot = VehiclePosition.__table__
+    cutoff = _day_start(today)
+    moved = 0
+    with engine.begin() as conn:
+        # Only days that have rows get a table; gaps (downtime, holidays) are skipped
+        days = conn.execute(
+            select(func.date(hot.c.timestamp)).where(hot.c.timestamp < cutoff).distinct()
+        ).scalars().all()
+        columns = [c.name for c in hot.columns]
+        for day in sorted(date.fromisoformat(str(d)) for d in days):
+            lo, hi = _day_start(day), _day_start(day + timedelta(days=1))
+            table = day_table(day_table_name(day))
+            table.create(conn, checkfirst=True)
+            rows = conn.execute(
+                insert(table).from_select(
+                    columns,
+                    select(*[hot.c[name] for name in columns]).where(hot.c.timestamp >= lo, hot.c.timestamp < hi),
+                )
+            ).rowcount
+            conn.execute(delete(hot).where(hot.c.timestamp >= lo, hot.c.timestamp < hi))
+            moved += max(rows or 0, 0)
+    return moved
+
+
+def _mysql_partitions(engine: Engine) -> List[str]:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+                "ORDER BY PARTITION_ORDINAL_POSITION"
+            ),
+            {"table": HOT_TABLE},
+        )
+        return [r[0] for r in rows]
+
+
+def _mysql_rollover(engine: Engine, today: date) -> int:
+    existing = set(_mysql_partitions(engine))
+    if "pmax" not in existing:
+        logger.warning("%s is not partitioned; run the a3f1c9d27b64 migration", HOT_TABLE)
+        return 0
+    latest = max((m.group(1) for m in map(_PARTITION_RE.match, existing) if m), default=None)
+    first = today if latest is None else datetime.strptime(latest, "%Y%m%d").date() + timedelta(days=1)
+    new_parts = []
+    day = first
+    while day <= today + timedelta(days=PARTITIONS_AHEAD):
+        upper = day + timedelta(days=1)
+        new_parts.append(f"PARTITION p{day:%Y%m%d} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}'))")
+        day = upper
+    if not new_parts:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE {HOT_TABLE} REORGANIZE PARTITION pmax INTO "
+            f"({', '.join(new_parts)}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+        ))
+    return len(new_parts)
+
+
+def rollover(engine: Engine, today: Optional[date] = None) -> int:
+    """Move/partition raw history by day. Returns rows moved (SQLite) or partitions added (MySQL)."""
+    today = today or datetime.utcnow().date()
+    if engine.dialect.name == "sqlite":
+        return _sqlite_rollover(engine, today)
+    if engine.dialect.name == "mysql":
+        return _mysql_rollover(engine, today)
+    return 0
+
+
+def _minute_bucket(engine: Engine, column):
+    if engine.dialect.name == "sqlite":
+        return func.strftime("%Y-%m-%d %H:%M:00", column)
+    if engine.dialect.name == "mysql":
+        return func.date_format(column, "%Y-%m-%d %H:%i:00")
+    return func.date_trunc("minute", column)
+
+
+def _downsample_into_minutes(conn, engine: Engine, table: Table, lo: datetime, hi: datetime) -> None:
+    minutes = VehiclePositionMinute.__table__
+    bucket = _minute_bucket(engine, table.c.timestamp)
+    query = (
+        select(
+            table.c.bus_id,
+            bucket,
+            func.count(),
+            func.avg(table.c.lat),
+            func.avg(table.c.lon),
+            func.avg(table.c.speed),
+            func.max(table.c.speed),
+        )
+        .where(table.c.timestamp >= lo, table.c.timestamp < hi)
+        .group_by(table.c.bus_id, bucket)
+    )
+    # Re-running a day replaces its rollups instead of duplicating them
+    conn.execute(delete(minutes).where(minutes.c.minute >= lo, minutes.c.minute < hi))
+    conn.execute(insert(minutes).from_select(
+        ["bus_id", "minute", "samples", "lat", "lon", "avg_speed", "max_speed"], query
+    ))
+
+
+def enforce_retention(engine: Engine, keep_days: int, today: Optional[date] = None) -> List[date]:
+    """Downsample raw days older than keep_days into per-minute rows, then drop the raw data."""
+    today = today or datetime.utcnow().date()
+    cutoff = today - timedelta(days=keep_days)
+    expired: List[date] = []
+
+    if engine.dialect.name == "sqlite":
+        for day in archived_days(engine):
+            if day >= cutoff:
+                continue
+            table = day_table(day_table_name(day))
+            with engine.begin() as conn:
+                _downsample_into_minutes(conn, engine, table, _day_start(day), _day_start(day + timedelta(days=1)))
+                table.drop(conn)
+            expired.append(day)
+        return expired
+
+    hot = VehiclePosition.__table__
+    if engine.dialect.name == "mysql":
+        for name in _mysql_partitions(engine):
+            match = _PARTITION_RE.match(name)
+            if not match:
+                continue
+            day = datetime.strptime(match.group(1), "%Y%m%d").date()
+            if day >= cutoff:
+                continue
+            hi = _day_start(day + timedelta(days=1))
+            with engine.begin() as conn:
+                # Partitions are dropped oldest first, so everything below `hi` is in this one. That
+                # includes rows older than the partitioning when this is the first dated partition.
+                lo = conn.execute(select(func.min(hot.c.timestamp)).where(hot.c.timestamp < hi)).scalar()
+                if lo is not None:
+                    _downsample_into_minutes(conn, engine, hot, min(_day_start(lo.date()), _day_start(day)), hi)
+                conn.execute(text(f"ALTER TABLE {HOT_TABLE} DROP PARTITION {name}"))
+            expired.append(day)
+        return expired
+
+    with engine.begin() as conn:
+        oldest = conn.execute(select(func.min(hot.c.timestamp)).where(hot.c.timestamp < _day_start(cutoff))).scalar()
+        if oldest is None:
+            return expired
+        lo, hi = _day_start(oldest.date()), _day_start(cutoff)
+        _downsample_into_minutes(conn, engine, hot, lo, hi)
+        conn.execute(delete(hot).where(hot.c.timestamp >= lo, hot.c.timestamp < hi))
+    day = oldest.date()
+    while day < cutoff:
+        expired.append(day)
+        day += timedelta(days=1)
+    return expired
+
+
+def run_maintenance(engine: Engine, keep_days: int) -> None:
+    moved = rollover(engine)
+    expired = enforce_retention(engine, keep_days)
+    logger.info("Position history maintenance: rollover=%d, downsampled days=%s", moved, [d.isoformat() for d in expired])
+
+
+def schedule_maintenance(app) -> None:
+    """Daily maintenance via APScheduler; enable in a single process only."""
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    from models import get_engine
+
+    engine = get_engine(app.config["DATABASE_URL"])
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(
+        run_maintenance,
+        "cron",
+        hour=0,
+        minute=5,
+        args=[engine, app.config["POSITION_RETENTION_DAYS"]],
+        id="position-history-maintenance",
+        replace_existing=True,
+    )
+    scheduler.start()
+
+
+if __name__ == "__main__":
+    from config import Config
+    from models import get_engine
+
+    logging.basicConfig(level=logging.INFO)
+    run_maintenance(get_engine(Config.DATABASE_URL), Config.POSITION_RETENTION_DAYS)
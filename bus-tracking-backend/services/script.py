@@ -1,19 +1,51 @@
-from fastapi import Query
-
-@app.get("/api/search")
-async def search_buses(source: str = Query(...), destination: str = Query(...)):
-    query = {"from": {"$regex": source, "$options": "i"}, "to": {"$regex": destination, "$options": "i"}}
-    buses = bus_collection.find(query)
-    return [
-        {
-            "bus_number": bus.get("bus_number"),
-            "service_name": bus.get("service_name"),
-            "from": bus.get("from"),
-            "to": bus.get("to"),
-            "depart": bus.get("depart"),
-            "arrive": bus.get("arrive"),
-            "fare": bus.get("fare"),
-            "seats": bus.get("seats"),
-        }
-        for bus in buses
-    ]
\ No newline at end of file
+"""Bus search over the Mongo buses collection (filled by utils/import_buses.py).
+
+Mount `router` in another FastAPI app, or run it on its own:
+
+    uvicorn services.script:app --port 8001
+"""
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import APIRouter, FastAPI, HTTPException, Query
+
+from services.bus_search import DEFAULT_PAGE_SIZE, MATCH_MODES, MAX_PAGE_SIZE, PREFIX, ensure_search_index, public_bus, search
+
+
+router = APIRouter()
+
+
+def get_bus_collection():
+    # Imported lazily: configurations connects to Mongo on import
+    from configurations import bus_collection
+
+    return bus_collection
+
+
+@router.get("/api/search")
+def search_buses(
+    source: str = Query(...),
+    destination: str = Query(...),
+    match: str = Query(PREFIX, description=f"one of {', '.join(MATCH_MODES)}"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """Buses whose from/to start with (or, with match=exact, equal) the given places, by departure.
+
+    Pass `next_cursor` back as `cursor` for the next page; it is null on the last one.
+    """
+    try:
+        page, next_cursor = search(get_bus_collection(), source, destination, match=match, limit=limit, cursor=cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"results": [public_bus(doc) for doc in page], "next_cursor": next_cursor}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_search_index(get_bus_collection())
+    yield
+
+
+app = FastAPI(title="Bus Search", lifespan=lifespan)
+app.include_router(router)
@@ -0,0 +1,211 @@
+import re
+from bisect import bisect_left
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.timetable import TimetableIndex, normalize_name, timetable
+
+
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+_VOWELS = set("aeiouy")
+
+# Minimum trigram similarity for a fuzzy candidate to be considered a match
+MIN_SIMILARITY = 0.3
+# Shorter skeletons ("rd" for both Radio and Road) are too ambiguous to match on
+MIN_SKELETON_LEN = 3
+
+
+@dataclass(frozen=True)
+class StopMatch:
+    stop_id: str
+    name: str
+    score: float
+
+
+def _clean(name: str) -> str:
+    return normalize_name(_NON_ALNUM.sub(" ", name.lower()))
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _skeleton(token: str) -> str:
+    """Consonant skeleton used to fold transliteration variants (Ballari/Bellary)."""
+    out = []
+    for i, ch in enumerate(token):
+        if i and ch in _VOWELS:
+            continue
+        if out and out[-1] == ch:
+            continue
+        out.append(ch)
+    return "".join(out)
+
+
+class StopIndex:
+    """Trigram + sorted-prefix index over stop names from routes.csv and the stops table.
+
+    The CSV part is rebuilt whenever the timetable reloads; stops loaded from the
+    database are kept across rebuilds. Names that normalize identically share one
+    canonical stop id (the first one seen, CSV ids first).
+    """
+
+    def __init__(self, source: TimetableIndex = timetable) -> None:
+        self._source = source
+        self._source_version = -1
+        self._lock = Lock()
+        self._db_stops: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        self._aliases: Dict[str, List[str]] = {}
+        self._canonical: Dict[str, str] = {}
+        self._by_norm: Dict[str, str] = {}
+        self._prefixes: List[Tuple[str, str]] = []
+        self._trigram_index: Dict[str, Set[str]] = {}
+        self._trigram_counts: Dict[str, int] = {}
+        self._skeletons: Dict[str, Set[str]] = {}
+
+    def load_db_stops(self, stops: Iterable[Tuple[int, str]]) -> None:
+        with self._lock:
+            self._db_stops = {str(stop_id): name for stop_id, name in stops}
+            self._source_version = -1
+
+    def _ensure_fresh(self) -> None:
+        # Touch the timetable first so an mtime change bumps its version
+        self._source.buses()
+        if self._source.version == self._source_version:
+            return
+        with self._lock:
+            if self._source.version != self._source_version:
+                self._build()
+
+    def _build(self) -> None:
+        names: Dict[str, str] = {}
+        aliases: Dict[str, List[str]] = {}
+        by_norm: Dict[str, str] = {}
+
+        def add(stop_id: str, name: str) -> None:
+            norm = _clean(name)
+            if not norm:
+                return
+            canonical = by_norm.setdefault(norm, stop_id)
+            if canonical == stop_id:
+                names[stop_id] = name
+            if stop_id not in aliases.setdefault(canonical, []):
+                aliases[canonical].append(stop_id)
+
+        version = self._source.version
+        for stops in self._source.buses().values():
+            for stop in stops:
+                add(stop.stop_id, stop.stop_name)
+        for stop_id, name in self._db_stops.items():
+            add(stop_id, name)
+
+        prefixes: List[Tuple[str, str]] = []
+        trigram_index: Dict[str, Set[str]] = {}
+        trigram_counts: Dict[str, int] = {}
+        skeletons: Dict[str, Set[str]] = {}
+        for norm, stop_id in by_norm.items():
+            prefixes.append((norm, stop_id))
+            for token in norm.split():
+                if token != norm:
+                    prefixes.append((token, stop_id))
+                skeleton = _skeleton(token)
+                if len(skeleton) >= MIN_SKELETON_LEN:
+                    skeletons.setdefault(skeleton, set()).add(stop_id)
+            grams = _trigrams(norm)
+            trigram_counts[stop_id] = len(grams)
+            for gram in grams:
+                trigram_index.setdefault(gram, set()).add(stop_id)
+        prefixes.sort()
+
+        self._names = names
+        self._aliases = aliases
+        self._canonical = {alias: canonical for canonical, ids in aliases.items() for alias in ids}
+        self._by_norm = by_norm
+        self._prefixes = prefixes
+        self._trigram_index = trigram_index
+        self._trigram_counts = trigram_counts
+        self._skeletons = skeletons
+        self._source_version = version
+
+    def name_of(self, stop_id: str) -> Optional[str]:
+        self._ensure_fresh()
+        return self._names.get(stop_id)
+
+    def aliases(self, stop_id: str) -> List[str]:
+        """Every source stop id (CSV or database) folded into a canonical id."""
+        self._ensure_fresh()
+        return self._aliases.get(stop_id, [stop_id])
+
+    def canonical_id(self, stop_id: str) -> str:
+        self._ensure_fresh()
+        return self._canonical.get(stop_id, stop_id)
+
+    def suggest(self, query: str, limit: int = 10) -> List[StopMatch]:
+        self._ensure_fresh()
+        q = _clean(query)
+        if not q:
+            return []
+        scores: Dict[str, float] = {}
+
+        def bump(stop_id: str, score: float) -> None:
+            if score > scores.get(stop_id, 0.0):
+                scores[stop_id] = score
+
+        exact = self._by_norm.get(q)
+        if exact is not None:
+            bump(exact, 1.0)
+
+        # Prefix hits on the full name or any word of it, via binary search
+        prefixes = self._prefixes
+        i = bisect_left(prefixes, (q, ""))
+        while i < len(prefixes) and prefixes[i][0].startswith(q):
+            key, stop_id = prefixes[i]
+            bump(stop_id, 0.9 if stop_id == self._by_norm.get(key) else 0.8)
+            i += 1
+
+        # Typos: shared-trigram counts gathered from the inverted index
+        grams = _trigrams(q)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for stop_id in self._trigram_index.get(gram, ()):
+                shared[stop_id] = shared.get(stop_id, 0) + 1
+        for stop_id, common in shared.items():
+            similarity = common / (len(grams) + self._trigram_counts[stop_id] - common)
+            if similarity >= MIN_SIMILARITY:
+                bump(stop_id, 0.7 * similarity)
+
+        # Transliteration variants: every long-enough query word matches a word skeleton
+        candidates: Optional[Set[str]] = None
+        for token in q.split():
+            skeleton = _skeleton(token)
+            if len(skeleton) < MIN_SKELETON_LEN:
+                continue
+            hits = self._skeletons.get(skeleton, set())
+            candidates = hits if candidates is None else candidates & hits
+            if not candidates:
+                break
+        for stop_id in candidates or ():
+            bump(stop_id, 0.6)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._names[item[0]]))
+        return [StopMatch(stop_id, self._names[stop_id], round(score, 3)) for stop_id, score in ranked[:limit]]
+
+    def resolve(self, query: str) -> List[str]:
+        """Canonical stop ids sharing the best score for the query."""
+        matches = self.suggest(query, limit=50)
+        if not matches:
+            return []
+        best = matches[0].score
+        return [m.stop_id for m in matches if m.score == best]
+
+
+stop_index = StopIndex()
+
+
+def load_db_stops(session) -> None:
+    from models import Stop
+
+    stop_index.load_db_stops(session.query(Stop.id, Stop.name).all())
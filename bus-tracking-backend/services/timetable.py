@@ -0,0 +1,123 @@
+import csv
+import logging
+import os
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "routes.csv")
+
+
+@dataclass(frozen=True)
+class StopTime:
+    stop_id: str
+    stop_name: str
+    arrival_time: str
+    departure_time: str
+    duration_in_minutes: int = 0
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.strip().lower().split())
+
+
+class TimetableIndex:
+    """In-memory view of routes.csv, reloaded only when the file's mtime changes.
+
+    Each bus keeps its stops as an ordered list, and stop names/ids map back to
+    (bus_id, index) pairs so a from/to query is two lookups and an index compare.
+    """
+
+    def __init__(self, csv_path: str = DEFAULT_CSV_PATH) -> None:
+        self._path = csv_path
+        self._mtime: Optional[float] = None
+        self._lock = Lock()
+        self.version = 0
+        self._buses: Dict[str, List[StopTime]] = {}
+        self._by_name: Dict[str, List[Tuple[str, int]]] = {}
+        self._by_stop_id: Dict[str, List[Tuple[str, int]]] = {}
+
+    def _ensure_fresh(self) -> None:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime and self.version:
+            return
+        with self._lock:
+            if mtime == self._mtime and self.version:
+                return
+            self._load(mtime)
+
+    def _load(self, mtime: Optional[float]) -> None:
+        buses: Dict[str, List[StopTime]] = {}
+        if mtime is None:
+            logger.warning("Routes CSV not found at %s", self._path)
+        else:
+            with open(self._path, "r", encoding="utf-8") as file:
+                for row in csv.DictReader(file):
+                    stop = StopTime(
+                        stop_id=row["stop_id"],
+                        stop_name=row["stop_name"],
+                        arrival_time=row.get("arrival_time") or "",
+                        departure_time=row.get("departure_time") or "",
+                        duration_in_minutes=int(row.get("duration_in_minutes") or 0),
+                    )
+                    buses.setdefault(row["bus_id"], []).append(stop)
+
+        by_name: Dict[str, List[Tuple[str, int]]] = {}
+        by_stop_id: Dict[str, List[Tuple[str, int]]] = {}
+        for bus_id, stops in buses.items():
+            for idx, stop in enumerate(stops):
+                by_name.setdefault(normalize_name(stop.stop_name), []).append((bus_id, idx))
+                by_stop_id.setdefault(stop.stop_id, []).append((bus_id, idx))
+
+        # Swap whole structures so concurrent readers never see a partial index
+        self._buses = buses
+        self._by_name = by_name
+        self._by_stop_id = by_stop_id
+        self._mtime = mtime
+        self.version += 1
+
+    def buses(self) -> Dict[str, List[StopTime]]:
+        self._ensure_fresh()
+        return self._buses
+
+    def bus_stops(self, bus_id: str) -> List[StopTime]:
+        self._ensure_fresh()
+        return self._buses.get(bus_id, [])
+
+    def lookup_name(self, name: str) -> List[Tuple[str, int]]:
+        self._ensure_fresh()
+        return self._by_name.get(normalize_name(name), [])
+
+    def lookup_stop_id(self, stop_id: str) -> List[Tuple[str, int]]:
+        self._ensure_fresh()
+        return self._by_stop_id.get(stop_id, [])
+
+    def find_direct(self, from_ids: List[str], to_ids: List[str]) -> List[Tuple[str, int, int]]:
+        """(bus_id, from_idx, to_idx) for every bus serving both stop-id sets.
+
+        Indices are not ordered; callers decide how to treat reverse travel.
+        """
+        self._ensure_fresh()
+        from_hits: Dict[str, int] = {}
+        for stop_id in from_ids:
+            for bus_id, idx in self._by_stop_id.get(stop_id, []):
+                from_hits.setdefault(bus_id, idx)
+        trips: List[Tuple[str, int, int]] = []
+        seen = set()
+        for stop_id in to_ids:
+            for bus_id, idx in self._by_stop_id.get(stop_id, []):
+                from_idx = from_hits.get(bus_id)
+                if from_idx is None or from_idx == idx or bus_id in seen:
+                    continue
+                seen.add(bus_id)
+                trips.append((bus_id, from_idx, idx))
+        return trips
+
+
+timetable = TimetableIndex()
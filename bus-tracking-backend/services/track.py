@@ -0,0 +1,178 @@
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from models import VehiclePositionMinute
+from services.geo import METERS_PER_DEGREE
+from services.persistence import from_db_time
+from services.retention import history_tables
+
+
+# Rows pulled per round trip while streaming history
+YIELD_PER = 5000
+
+
+class Track:
+    """Columnar path: parallel lat/lon/ts lists (ts in epoch seconds)."""
+
+    __slots__ = ("lat", "lon", "ts")
+
+    def __init__(self) -> None:
+        self.lat: List[float] = []
+        self.lon: List[float] = []
+        self.ts: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+def _oldest_raw(session, bus_id: int, start: datetime, end: datetime) -> Optional[datetime]:
+    oldest = None
+    for table in history_tables(session.get_bind(), start, end):
+        ts = session.execute(
+            select(func.min(table.c.timestamp)).where(table.c.bus_id == bus_id, table.c.timestamp >= start, table.c.timestamp < end)
+        ).scalar()
+        if ts is not None and (oldest is None or ts < oldest):
+            oldest = ts
+    return oldest
+
+
+def read_track(session, bus_id: int, start: datetime, end: datetime, keep_days: Optional[int] = None) -> Track:
+    """Stream a bus's history for [start, end) into columns, oldest first.
+
+    Raw rows come from every table covering the range (see services.retention).
+    The part of the range older than `keep_days` that the retention job has
+    already downsampled, i.e. before the bus's oldest remaining raw row, is
+    served from minute rollups. Pass keep_days=None when retention does not run.
+    """
+    track = Track()
+    lat_append, lon_append, ts_append = track.lat.append, track.lon.append, track.ts.append
+
+    raw_start = start
+    if keep_days is not None:
+        cutoff = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=keep_days)
+        if start < cutoff:
+            # Raw rows past the cutoff stay until the job downsamples them; prefer them while they exist
+            oldest = _oldest_raw(session, bus_id, start, end)
+            if oldest is not None:
+                cutoff = min(cutoff, oldest)
+        if start < cutoff:
+            minutes = VehiclePositionMinute.__table__
+            rows = session.execute(
+                select(minutes.c.lat, minutes.c.lon, minutes.c.minute)
+                .where(minutes.c.bus_id == bus_id, minutes.c.minute >= start, minutes.c.minute < min(end, cutoff))
+                .order_by(minutes.c.minute)
+                .execution_options(yield_per=YIELD_PER)
+            )
+            for lat, lon, ts in rows:
+                lat_append(lat)
+                lon_append(lon)
+                ts_append(from_db_time(ts))
+            raw_start = max(start, cutoff)
+
+    if raw_start < end:
+        for table in history_tables(session.get_bind(), raw_start, end):
+            rows = session.execute(
+                select(table.c.lat, table.c.lon, table.c.timestamp)
+                .where(table.c.bus_id == bus_id, table.c.timestamp >= raw_start, table.c.timestamp < end)
+                .order_by(table.c.timestamp)
+                .execution_options(yield_per=YIELD_PER)
+            )
+            for lat, lon, ts in rows:
+                lat_append(lat)
+                lon_append(lon)
+                ts_append(from_db_time(ts))
+    return track
+
+
+def simplify(track: Track, tolerance_m: float) -> Track:
+    """Douglas–Peucker on an equirectangular projection (iterative, no recursion limit)."""
+    n = len(track)
+    if tolerance_m <= 0 or n < 3:
+        return track
+    k = math.cos(math.radians(sum(track.lat) / n))
+    xs = [lon * k * METERS_PER_DEGREE for lon in track.lon]
+    ys = [lat * METERS_PER_DEGREE for lat in track.lat]
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack: List[Tuple[int, int]] = [(0, n - 1)]
+    tol2 = tolerance_m * tolerance_m
+    while stack:
+        first, last = stack.pop()
+        x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tol2
+        for i in range(first + 1, last):
+            px, py = xs[i] - x1, ys[i] - y1
+            if seg2 == 0:
+                d2 = px * px + py * py
+            else:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+            if d2 > worst_d2:
+                worst, worst_d2 = i, d2
+        if worst >= 0:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+
+    out = Track()
+    for i in range(n):
+        if keep[i]:
+            out.lat.append(track.lat[i])
+            out.lon.append(track.lon[i])
+            out.ts.append(track.ts[i])
+    return out
+
+
+def _encode_signed(value: int, chunks: List[str]) -> None:
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(lats: List[float], lons: List[float], precision: int = 5) -> str:
+    """Google encoded polyline (delta + zigzag + base64-ish), as used by Leaflet plugins."""
+    factor = 10 ** precision
+    chunks: List[str] = []
+    prev_lat = prev_lon = 0
+    for lat, lon in zip(lats, lons):
+        ilat, ilon = int(round(lat * factor)), int(round(lon * factor))
+        _encode_signed(ilat - prev_lat, chunks)
+        _encode_signed(ilon - prev_lon, chunks)
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(chunks)
+
+
+def delta_encode(values: List[float]) -> List[int]:
+    out: List[int] = []
+    prev = 0
+    for v in values:
+        iv = int(round(v))
+        out.append(iv - prev)
+        prev = iv
+    return out
+
+
+def columnar_payload(bus_id: int, track: Track, fmt: str) -> Dict[str, object]:
+    if fmt == "polyline":
+        return {
+            "bus_id": bus_id,
+            "count": len(track),
+            "polyline": encode_polyline(track.lat, track.lon),
+            "ts_delta": delta_encode(track.ts),
+        }
+    return {
+        "bus_id": bus_id,
+        "count": len(track),
+        "lat": [round(v, 6) for v in track.lat],
+        "lon": [round(v, 6) for v in track.lon],
+        "ts": [int(round(v)) for v in track.ts],
+    }
@@ -0,0 +1,161 @@
+"""Compact binary position frames for the WebSocket channel.
+
+All integers are little-endian:
+
+    frame   := kind:u8 (=1) n_full:u16 n_delta:u16 full{n_full} delta{n_delta}
+    offline := kind:u8 (=2) n:u16 bus_id:u32{n}      (buses that stopped reporting)
+    full  := bus_id:u32 lat:i32 lon:i32 heading:u16 speed:u16 ts:u32      (20 bytes)
+    delta := bus_id:u32 dlat:i16 dlon:i16 heading:u16 speed:u16 dts:u16   (14 bytes)
+
+lat/lon are micro-degrees (~0.1 m), heading is 1/100 degree, speed is
+cm/s and ts is epoch seconds. 0xFFFF marks an unknown heading/speed. A delta
+record is relative to the last record sent for that bus on the same
+connection; it is used only when the change fits in 16 bits.
+
+A frame holds at most 65,535 records of each kind; larger ticks are split
+into several frames (encode_frames / encode_offline_frames). Positions with
+non-finite or out-of-range coordinates are never sent.
+"""
+import math
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.realtime import Position
+
+
+FRAME_POSITIONS = 1
+FRAME_OFFLINE = 2
+UNKNOWN = 0xFFFF
+COORD_SCALE = 1_000_000
+# u16 record counts in the frame headers
+MAX_FRAME_RECORDS = 0xFFFF
+
+_HEADER = struct.Struct("<BHH")
+_FULL = struct.Struct("<IiiHHI")
+_DELTA = struct.Struct("<IhhHHH")
+_COUNT = struct.Struct("<BH")
+
+# Last state sent per bus: (lat, lon, ts) as encoded integers
+WireState = Tuple[int, int, int]
+
+
+def _u16(value: Optional[float], scale: float) -> int:
+    if value is None or not math.isfinite(value):
+        return UNKNOWN
+    return min(max(int(round(value * scale)), 0), UNKNOWN - 1)
+
+
+def encodable(pos: Position) -> bool:
+    return (
+        0 <= pos.bus_id < 2 ** 32
+        and math.isfinite(pos.latitude) and -90.0 <= pos.latitude <= 90.0
+        and math.isfinite(pos.longitude) and -180.0 <= pos.longitude <= 180.0
+        and math.isfinite(pos.timestamp) and 0 <= pos.timestamp < 2 ** 32
+    )
+
+
+def quantize(pos: Position) -> Tuple[int, int, int, int, int]:
+    return (
+        int(round(pos.latitude * COORD_SCALE)),
+        int(round(pos.longitude * COORD_SCALE)),
+        _u16(pos.heading % 360 if pos.heading is not None and math.isfinite(pos.heading) else None, 100),
+        _u16(pos.speed, 100),
+        int(pos.timestamp),
+    )
+
+
+def encode_full(pos: Position) -> bytes:
+    lat, lon, heading, speed, ts = quantize(pos)
+    return _FULL.pack(pos.bus_id, lat, lon, heading, speed, ts)
+
+
+def encode_frame(
+    positions: Iterable[Position],
+    sent: Optional[Dict[int, WireState]] = None,
+    full_cache: Optional[Dict[int, bytes]] = None,
+) -> bytes:
+    """Encode a batch; with `sent`, records are delta-encoded where possible and `sent` is updated.
+
+    `full_cache` maps bus id to an already-encoded full record, so a tick's
+    records are packed once and shared by every non-delta connection. At
+    most MAX_FRAME_RECORDS positions fit; see encode_frames.
+    """
+    full: List[bytes] = []
+    delta: List[bytes] = []
+    for pos in positions:
+        if not encodable(pos):
+            continue
+        lat, lon, heading, speed, ts = quantize(pos)
+        if sent is not None:
+            prev = sent.get(pos.bus_id)
+            sent[pos.bus_id] = (lat, lon, ts)
+            if prev is not None:
+                dlat, dlon, dts = lat - prev[0], lon - prev[1], ts - prev[2]
+                if -0x8000 <= dlat < 0x8000 and -0x8000 <= dlon < 0x8000 and 0 <= dts < 0x10000:
+                    delta.append(_DELTA.pack(pos.bus_id, dlat, dlon, heading, speed, dts))
+                    continue
+        record = full_cache.get(pos.bus_id) if full_cache is not None else None
+        full.append(record or _FULL.pack(pos.bus_id, lat, lon, heading, speed, ts))
+    return _HEADER.pack(FRAME_POSITIONS, len(full), len(delta)) + b"".join(full) + b"".join(delta)
+
+
+def encode_frames(
+    positions: Iterable[Position],
+    sent: Optional[Dict[int, WireState]] = None,
+    full_cache: Optional[Dict[int, bytes]] = None,
+) -> List[bytes]:
+    """encode_frame over chunks of MAX_FRAME_RECORDS, for ticks larger than one frame holds."""
+    positions = list(positions)
+    return [
+        encode_frame(positions[i:i + MAX_FRAME_RECORDS], sent, full_cache)
+        for i in range(0, len(positions), MAX_FRAME_RECORDS)
+    ]
+
+
+def encode_offline(bus_ids: List[int]) -> bytes:
+    return _COUNT.pack(FRAME_OFFLINE, len(bus_ids)) + struct.pack(f"<{len(bus_ids)}I", *bus_ids)
+
+
+def encode_offline_frames(bus_ids: List[int]) -> List[bytes]:
+    return [encode_offline(bus_ids[i:i + MAX_FRAME_RECORDS]) for i in range(0, len(bus_ids), MAX_FRAME_RECORDS)]
+
+
+def decode_frame(data: bytes, sent: Optional[Dict[int, WireState]] = None) -> List[Dict[str, object]]:
+    """Reference decoder (used for testing clients); applies deltas against `sent`.
+
+    Offline frames decode to [{"bus_id": .., "offline": True}, ..].
+    """
+    if data[0] == FRAME_OFFLINE:
+        _, count = _COUNT.unpack_from(data, 0)
+        bus_ids = struct.unpack_from(f"<{count}I", data, _COUNT.size)
+        for bus_id in bus_ids:
+            if sent is not None:
+                sent.pop(bus_id, None)
+        return [{"bus_id": bus_id, "offline": True} for bus_id in bus_ids]
+    kind, n_full, n_delta = _HEADER.unpack_from(data, 0)
+    if kind != FRAME_POSITIONS:
+        raise ValueError(f"unknown frame kind {kind}")
+    sent = {} if sent is None else sent
+    out: List[Dict[str, object]] = []
+    offset = _HEADER.size
+    records = []
+    for _ in range(n_full):
+        bus_id, lat, lon, heading, speed, ts = _FULL.unpack_from(data, offset)
+        offset += _FULL.size
+        records.append((bus_id, lat, lon, heading, speed, ts))
+    for _ in range(n_delta):
+        bus_id, dlat, dlon, heading, speed, dts = _DELTA.unpack_from(data, offset)
+        offset += _DELTA.size
+        prev = sent[bus_id]
+        records.append((bus_id, prev[0] + dlat, prev[1] + dlon, heading, speed, prev[2] + dts))
+    for bus_id, lat, lon, heading, speed, ts in records:
+        sent[bus_id] = (lat, lon, ts)
+        out.append({
+            "bus_id": bus_id,
+            "latitude": lat / COORD_SCALE,
+            "longitude": lon / COORD_SCALE,
+            "heading": None if heading == UNKNOWN else heading / 100,
+            "speed": None if speed == UNKNOWN else speed / 100,
+            "timestamp": ts,
+        })
+    return out
@@ -1,57 +1,246 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import mysql.connector
-import datetime
+from sqlalchemy import bindparam, inspect, text
+from threading import Lock
+from datetime import datetime
+import atexit
+import math
+import time
+
+from config import Config
+from models import create_session_factory, get_engine
+from services.booking import (
+    BookingError,
+    InventoryUnavailable,
+    SoldOut,
+    UnknownBus,
+    booking_engine,
+    bus_plates,
+    seed_inventory,
+    ticket_rows,
+)
+from services.eta import eta_engine
+from services.fleet import load_bus_routes
+from services.realtime import Position, hub
 
 app = Flask(__name__)
 CORS(app)
 
-# Database connection
-db = mysql.connector.connect(
-    host="localhost",
-    user="root",        # change to your MySQL username
-    password="password", # change to your MySQL password
-    database="transport_db"
+# Database connection pool (TRANSPORT_DB_URL); each request checks out its own connection.
+# Connections are opened lazily, so every gunicorn worker builds its own after fork.
+engine = get_engine(
+    Config.TRANSPORT_DB_URL,
+    pool_size=Config.TRANSPORT_DB_POOL_SIZE,
+    max_overflow=Config.TRANSPORT_DB_MAX_OVERFLOW,
+    pool_recycle=Config.TRANSPORT_DB_POOL_RECYCLE,
+    pool_timeout=Config.TRANSPORT_DB_POOL_TIMEOUT,
+)
+
+# The SQLAlchemy schema (DATABASE_URL): routes, stops and bus ids for ETAs, seat capacities
+schema_session = create_session_factory(Config.DATABASE_URL)
+
+# Statements are built once; SQLAlchemy caches their compiled form per dialect
+SELECT_BUSES = text("SELECT * FROM buses")
+SELECT_ROUTES = text("SELECT * FROM routes")
+INSERT_TICKET = text(
+    "INSERT INTO tickets (user_id, bus_id, trip, fare, timestamp) VALUES (:user_id, :bus_id, :trip, :fare, :timestamp)"
+)
+# The legacy tickets table predates trips (service days); the column is added on first use
+ADD_TICKET_TRIP = text("ALTER TABLE tickets ADD COLUMN trip VARCHAR(64) NULL")
+# Booking seqs whose tickets rows are committed, written in the same transaction as the rows
+CREATE_TICKET_BOOKINGS = text(
+    "CREATE TABLE IF NOT EXISTS ticket_bookings "
+    "(booking_seq BIGINT PRIMARY KEY, seats INT NOT NULL, committed_at DATETIME NOT NULL)"
+)
+INSERT_TICKET_BOOKING = text(
+    "INSERT INTO ticket_bookings (booking_seq, seats, committed_at) VALUES (:booking_seq, :seats, :committed_at)"
+)
+SELECT_COMMITTED_SEQS = text("SELECT booking_seq FROM ticket_bookings WHERE booking_seq IN :seqs").bindparams(
+    bindparam("seqs", expanding=True)
 )
-cursor = db.cursor(dictionary=True)
+SELECT_MAX_BOOKING_SEQ = text("SELECT MAX(booking_seq) FROM ticket_bookings")
+UPDATE_BUS_LOCATION = text("UPDATE buses SET current_lat=:lat, current_lng=:lng WHERE bus_id=:bus_id")
+
+
+def fetch_all(statement, **params):
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(statement, params).mappings()]
+
+
+def execute(statement, **params):
+    # begin() commits on success and rolls back on error before the connection returns to the pool
+    with engine.begin() as conn:
+        conn.execute(statement, params)
+
+
+def write_tickets(bookings):
+    """Group commit for the booking engine: all ticket rows of the batch in one transaction."""
+    with engine.begin() as conn:
+        # Replayed after a restart: skip bookings whose rows were committed before the crash
+        recovered = [b.seq for b in bookings if b.recovered]
+        done = set(conn.execute(SELECT_COMMITTED_SEQS, {"seqs": recovered}).scalars()) if recovered else set()
+        fresh = [b for b in bookings if b.seq not in done]
+        if not fresh:
+            return
+        conn.execute(INSERT_TICKET, ticket_rows(fresh))
+        committed_at = datetime.now().replace(microsecond=0)
+        conn.execute(INSERT_TICKET_BOOKING, [
+            {"booking_seq": b.seq, "seats": b.seats, "committed_at": committed_at} for b in fresh
+        ])
+
+
+# After losing the inventory lock to another process, requests fail fast for this long before retrying
+BOOKING_OPEN_RETRY_SECONDS = 30.0
+
+_booking_lock = Lock()
+_booking_ready = False
+_booking_retry_at = 0.0
+
+
+def _ensure_booking_open():
+    """Open the seat inventory in this process, or raise InventoryUnavailable.
+
+    Only one process can own the inventory (services/booking.py), so bookings
+    must be served by a single worker. Other workers answer 503 without
+    touching the database until the retry interval has passed.
+    """
+    global _booking_ready, _booking_retry_at
+    if _booking_ready:
+        return
+    with _booking_lock:
+        if _booking_ready:
+            return
+        if time.monotonic() < _booking_retry_at:
+            raise InventoryUnavailable("seat inventory is owned by another process; bookings go to a single worker")
+        with engine.begin() as conn:
+            conn.execute(CREATE_TICKET_BOOKINGS)
+            if "trip" not in {c["name"] for c in inspect(conn).get_columns("tickets")}:
+                conn.execute(ADD_TICKET_TRIP)
+            min_seq = conn.execute(SELECT_MAX_BOOKING_SEQ).scalar() or 0
+        booking_engine.configure(
+            Config.BOOKING_COMMIT_MS / 1000, Config.BOOKING_COMMIT_BATCH, Config.BOOKING_ADVANCE_DAYS
+        )
+        # Seeded before open(): nothing that can fail runs while this process holds the inventory lock
+        session = schema_session()
+        try:
+            collection = None
+            if Config.BOOKING_SEATS_FROM_MONGO:
+                from configurations import bus_collection as collection
+            seed_inventory(booking_engine, session, collection)
+        finally:
+            session.close()
+        try:
+            booking_engine.open(Config.BOOKING_WAL_PATH, write_tickets, min_seq=min_seq)
+        except InventoryUnavailable:
+            _booking_retry_at = time.monotonic() + BOOKING_OPEN_RETRY_SECONDS
+            raise
+        atexit.register(booking_engine.close)
+        _booking_ready = True
+
+# ETA geometry and bus -> route links live in the SQLAlchemy schema (DATABASE_URL)
+hub.add_flush_listener(eta_engine.observe_flush)
+_eta_lock = Lock()
+_eta_loaded = False
+# transport_db bus_id -> Bus.id; None while the two databases share ids
+_schema_bus_ids = None
+
+
+def _load_schema_bus_ids(session):
+    column = Config.TRANSPORT_BUS_PLATE_COLUMN
+    if not column:
+        return None
+    if not column.isidentifier():
+        raise ValueError(f"TRANSPORT_BUS_PLATE_COLUMN is not a column name: {column!r}")
+    plates = bus_plates(session)
+    ids = {}
+    for row in fetch_all(text(f"SELECT bus_id, {column} AS plate FROM buses")):
+        bus_id = plates.get(str(row["plate"] or "").strip().upper())
+        if bus_id is not None:
+            ids[int(row["bus_id"])] = bus_id
+    return ids
+
+
+def _ensure_eta_loaded():
+    global _eta_loaded, _schema_bus_ids
+    if _eta_loaded:
+        return
+    with _eta_lock:
+        if _eta_loaded:
+            return
+        session = schema_session()
+        try:
+            load_bus_routes(session)
+            eta_engine.load_routes(session)
+            _schema_bus_ids = _load_schema_bus_ids(session)
+        finally:
+            session.close()
+        _eta_loaded = True
+
+
+def schema_bus_id(transport_bus_id):
+    """Bus.id for a transport_db bus_id, or None when it has no match (see TRANSPORT_BUS_PLATE_COLUMN)."""
+    _ensure_eta_loaded()
+    if _schema_bus_ids is None:
+        return transport_bus_id
+    return _schema_bus_ids.get(transport_bus_id)
 
 # ------------------- APIs -------------------
 
 # 1. Get all buses with live location
 @app.route("/api/buses", methods=["GET"])
 def get_buses():
-    cursor.execute("SELECT * FROM buses")
-    buses = cursor.fetchall()
-    return jsonify(buses)
+    return jsonify(fetch_all(SELECT_BUSES))
 
-# 2. Get ETA for a specific bus (dummy calculation for now)
+# 2. Get ETA for a specific bus (minutes; null when the bus is unknown or past the stop)
 @app.route("/api/bus/<int:bus_id>/eta/<int:stop_id>", methods=["GET"])
 def get_eta(bus_id, stop_id):
-    # For now return random ETA (later calculate using distance + avg speed)
-    eta = 5
+    schema_id = schema_bus_id(bus_id)
+    seconds = None if schema_id is None else eta_engine.eta_seconds(schema_id, stop_id)
+    eta = None if seconds is None else max(0, int(math.ceil(seconds / 60.0)))
     return jsonify({"bus_id": bus_id, "stop_id": stop_id, "eta": eta})
 
 # 3. Get all routes
 @app.route("/api/routes", methods=["GET"])
 def get_routes():
-    cursor.execute("SELECT * FROM routes")
-    routes = cursor.fetchall()
-    return jsonify(routes)
+    return jsonify(fetch_all(SELECT_ROUTES))
 
-# 4. Book a ticket
+# 4. Book a ticket (seats reserved in memory, tickets rows group-committed in the background)
 @app.route("/api/ticket", methods=["POST"])
 def book_ticket():
-    data = request.json
-    user_id = data["user_id"]
-    bus_id = data["bus_id"]
-    fare = data["fare"]
+    data = request.get_json(silent=True)
+    try:
+        user_id = int(data["user_id"])
+        bus_id = int(data["bus_id"])
+        fare = float(data["fare"])
+        seats = int(data.get("seats", 1))
+    except KeyError as exc:
+        return jsonify({"error": f"missing field {exc.args[0]}"}), 400
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "user_id, bus_id, seats must be integers and fare a number"}), 400
+    if not math.isfinite(fare) or fare < 0:
+        return jsonify({"error": "fare must be a non-negative number"}), 400
+    try:
+        _ensure_booking_open()
+        booking = booking_engine.book(user_id=user_id, bus_id=bus_id, fare=fare, trip=data.get("trip"), seats=seats)
+    except UnknownBus as exc:
+        return jsonify({"error": str(exc)}), 404
+    except SoldOut as exc:
+        return jsonify({"error": str(exc)}), 409
+    except InventoryUnavailable as exc:
+        return jsonify({"error": str(exc)}), 503, {"Retry-After": str(int(BOOKING_OPEN_RETRY_SECONDS))}
+    except BookingError as exc:
+        return jsonify({"error": str(exc)}), 400
 
-    query = "INSERT INTO tickets (user_id, bus_id, fare, timestamp) VALUES (%s,%s,%s,%s)"
-    values = (user_id, bus_id, fare, datetime.datetime.now())
-    cursor.execute(query, values)
-    db.commit()
+    return jsonify({
+        "message": "Ticket booked successfully!",
+        "booking_id": booking.seq,
+        "trip": booking.trip,
+        "seats": booking.seats,
+    })
 
-    return jsonify({"message": "Ticket booked successfully!"})
+@app.route("/api/ticket/stats", methods=["GET"])
+def booking_stats():
+    return jsonify(booking_engine.stats())
 
 # 5. Add/update bus location (from GPS device or simulator)
 @app.route("/api/bus/update_location", methods=["POST"])
@@ -61,9 +250,12 @@ def update_location():
     lat = data["latitude"]
     lng = data["longitude"]
 
-    query = "UPDATE buses SET current_lat=%s, current_lng=%s WHERE bus_id=%s"
-    cursor.execute(query, (lat, lng, bus_id))
-    db.commit()
+    execute(UPDATE_BUS_LOCATION, lat=lat, lng=lng, bus_id=bus_id)
+
+    # Feed the ETA engine the same fix, under the schema's id for this bus
+    schema_id = schema_bus_id(int(bus_id))
+    if schema_id is not None:
+        hub.update_position(Position(bus_id=schema_id, latitude=float(lat), longitude=float(lng), timestamp=time.time()))
 
     return jsonify({"message": "Bus location updated successfully!"})
 
@@ -0,0 +1,180 @@
+import importlib
+import os
+import sys
+import threading
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from config import Config
+from services.booking import BookingEngine, BookingError, InventoryUnavailable, SoldOut
+
+
+class Writer:
+    """Group-commit target that records the batches it is given."""
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    def __call__(self, bookings) -> None:
+        self.batches.append(list(bookings))
+
+    @property
+    def seqs(self):
+        return [b.seq for batch in self.batches for b in batch]
+
+
+def open_engine(wal, writer, capacities=None, commit_interval: float = 0.01) -> BookingEngine:
+    engine = BookingEngine(commit_interval=commit_interval)
+    engine.load_capacities(capacities or {1: 2})
+    engine.open(str(wal), writer)
+    return engine
+
+
+def test_concurrent_bookings_never_oversell(tmp_path):
+    engine = open_engine(tmp_path / "bookings.wal", Writer(), {1: 5})
+    results = []
+
+    def book():
+        try:
+            results.append(engine.book(user_id=7, bus_id=1, fare=10.0).seq)
+        except SoldOut:
+            results.append(None)
+
+    threads = [threading.Thread(target=book) for _ in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.close()
+
+    sold = [seq for seq in results if seq is not None]
+    assert sorted(sold) == [1, 2, 3, 4, 5]
+    assert engine.remaining(1) == 0
+
+
+def test_trip_must_be_a_bookable_service_date(tmp_path):
+    engine = open_engine(tmp_path / "bookings.wal", Writer())
+    try:
+        # Made-up trips would each get a fresh counter for the same two seats
+        for trip in ["x0", "x1", 123, ["2024-01-01"], (date.today() - timedelta(days=1)).isoformat()]:
+            with pytest.raises(BookingError):
+                engine.book(user_id=7, bus_id=1, fare=10.0, trip=trip)
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        engine.book(user_id=7, bus_id=1, fare=10.0, seats=2)
+        assert engine.book(user_id=7, bus_id=1, fare=10.0, trip=tomorrow).trip == tomorrow
+        with pytest.raises(SoldOut):
+            engine.book(user_id=7, bus_id=1, fare=10.0, trip=date.today().isoformat())
+        with pytest.raises(BookingError):
+            engine.book(user_id=7, bus_id=1, fare=10.0, trip=(date.today() + timedelta(days=31)).isoformat())
+    finally:
+        engine.close()
+
+
+def test_replay_restores_counters_and_recommits_uncommitted(tmp_path):
+    wal = tmp_path / "bookings.wal"
+    # The commit thread never gets to run before the "crash": the process just loses its descriptors
+    engine = open_engine(wal, Writer(), commit_interval=3600)
+    first = engine.book(user_id=7, bus_id=1, fare=10.0)
+    second = engine.book(user_id=8, bus_id=1, fare=10.0)
+    os.close(engine._wal_fd)
+    os.close(engine._lock_fd)
+
+    writer = Writer()
+    engine = open_engine(wal, writer)
+    try:
+        with pytest.raises(SoldOut):
+            engine.book(user_id=9, bus_id=1, fare=10.0)
+        assert engine.commit()
+        assert writer.seqs == [first.seq, second.seq]
+        assert all(b.recovered for batch in writer.batches for b in batch)
+    finally:
+        engine.close()
+
+    # Committed bookings are not replayed again
+    writer = Writer()
+    engine = open_engine(wal, writer, {1: 3})
+    try:
+        assert engine.book(user_id=9, bus_id=1, fare=10.0).seq == second.seq + 1
+        assert engine.commit()
+        assert writer.seqs == [second.seq + 1]
+    finally:
+        engine.close()
+
+
+def test_second_process_cannot_open_inventory(tmp_path):
+    wal = tmp_path / "bookings.wal"
+    owner = open_engine(wal, Writer())
+    try:
+        with pytest.raises(InventoryUnavailable):
+            open_engine(wal, Writer())
+    finally:
+        owner.close()
+    open_engine(wal, Writer()).close()
+
+
+@pytest.fixture
+def legacy(tmp_path, monkeypatch):
+    """sqlcode.py against SQLite files, with a tickets table that predates trips."""
+    monkeypatch.setattr(Config, "TRANSPORT_DB_URL", f"sqlite:///{tmp_path / 'transport.db'}")
+    monkeypatch.setattr(Config, "DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setattr(Config, "BOOKING_WAL_PATH", str(tmp_path / "bookings.wal"))
+    monkeypatch.delitem(sys.modules, "sqlcode", raising=False)
+    module = importlib.import_module("sqlcode")
+    with module.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE tickets (ticket_id INTEGER PRIMARY KEY, user_id INT, bus_id INT, fare REAL, timestamp DATETIME)"
+        ))
+    monkeypatch.setattr(module, "seed_inventory", lambda engine, session, collection: engine.load_capacities({1: 2}))
+    yield module
+    module.booking_engine.close()
+    module.booking_engine._capacity.clear()
+    module.booking_engine._booked.clear()
+    module.engine.dispose()
+    monkeypatch.delitem(sys.modules, "sqlcode")
+
+
+def ticket_rows(module):
+    with module.engine.connect() as conn:
+        return conn.execute(text("SELECT user_id, bus_id, trip FROM tickets ORDER BY ticket_id")).all()
+
+
+def test_write_tickets_skips_recovered_bookings_already_stored(legacy):
+    legacy._ensure_booking_open()
+    engine = legacy.booking_engine
+    booked = [engine.book(user_id=u, bus_id=1, fare=5.0) for u in (7, 8)]
+    assert engine.commit()
+
+    # A crash before the commit marker: both are replayed, plus one that never reached the database
+    for b in booked:
+        b.recovered = True
+    engine.load_capacities({1: 3})
+    third = engine.book(user_id=9, bus_id=1, fare=5.0)
+    third.recovered = True
+    legacy.write_tickets(booked + [third])
+
+    today = date.today().isoformat()
+    assert ticket_rows(legacy) == [(7, 1, today), (8, 1, today), (9, 1, today)]
+
+
+def test_book_ticket_validation(legacy):
+    client = legacy.app.test_client()
+    assert client.post("/api/ticket", json={"user_id": 7, "bus_id": 1}).status_code == 400
+    assert client.post("/api/ticket", json={"user_id": "x", "bus_id": 1, "fare": 5}).status_code == 400
+    assert client.post("/api/ticket", data="1e400", content_type="application/json").status_code == 400
+    assert client.post("/api/ticket", json={"user_id": 7, "bus_id": 1, "fare": 5, "trip": {"a": 1}}).status_code == 400
+    ok = client.post("/api/ticket", json={"user_id": 7, "bus_id": 1, "fare": 5, "seats": 2})
+    assert ok.status_code == 200 and ok.get_json()["trip"] == date.today().isoformat()
+    assert client.post("/api/ticket", json={"user_id": 7, "bus_id": 1, "fare": 5}).status_code == 409
+
+
+def test_failed_seeding_does_not_hold_the_inventory_lock(legacy, monkeypatch):
+    def broken_seed(engine, session, collection):
+        raise RuntimeError("schema database down")
+
+    monkeypatch.setattr(legacy, "seed_inventory", broken_seed)
+    with pytest.raises(RuntimeError):
+        legacy._ensure_booking_open()
+    # Nothing was left holding <wal>.lock, so the inventory can still be opened
+    open_engine(Config.BOOKING_WAL_PATH, Writer()).close()
@@ -0,0 +1,173 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from services.broker import RedisTransport, _position
+from services.realtime import Position, RealtimeHub
+
+
+class FakeRedis:
+    """Just enough of a RESP server on localhost: HSET/HDEL/HGETALL, SUBSCRIBE/PUBLISH."""
+
+    def __init__(self) -> None:
+        self.hashes = {}
+        self.subscribers = []
+        # Close the publisher's connection after this many PUBLISHes, before replying
+        self.drop_after_publish = 0
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen()
+        self.url = f"redis://127.0.0.1:{self._server.getsockname()[1]}"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.close()
+        self.kick_subscribers()
+
+    def kick_subscribers(self) -> None:
+        subscribers, self.subscribers = self.subscribers, []
+        for conn in subscribers:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def snapshot_ids(self, key: bytes = b"bus-tracking:latest"):
+        return {int(k) for k in self.hashes.get(key, {})}
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _bulk(data: bytes) -> bytes:
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _serve(self, conn: socket.socket) -> None:
+        reader = conn.makefile("rb")
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(reader.readline()[1:-2])
+                    args.append(reader.read(length + 2)[:-2])
+                if not self._command(conn, args[0].upper(), args[1:]):
+                    return
+        except OSError:
+            pass
+
+    def _command(self, conn: socket.socket, cmd: bytes, args) -> bool:
+        if cmd == b"HSET":
+            fields = self.hashes.setdefault(args[0], {})
+            fields.update(zip(args[1::2], args[2::2]))
+            conn.sendall(b":%d\r\n" % (len(args) // 2))
+        elif cmd == b"HDEL":
+            fields = self.hashes.get(args[0], {})
+            conn.sendall(b":%d\r\n" % sum(fields.pop(k, None) is not None for k in args[1:]))
+        elif cmd == b"HGETALL":
+            items = [x for kv in self.hashes.get(args[0], {}).items() for x in kv]
+            conn.sendall(b"*%d\r\n" % len(items) + b"".join(map(self._bulk, items)))
+        elif cmd == b"SUBSCRIBE":
+            conn.sendall(b"*3\r\n" + self._bulk(b"subscribe") + self._bulk(args[0]) + b":1\r\n")
+            self.subscribers.append(conn)
+        elif cmd == b"PUBLISH":
+            message = b"*3\r\n" + self._bulk(b"message") + self._bulk(args[0]) + self._bulk(args[1])
+            for sub in list(self.subscribers):
+                try:
+                    sub.sendall(message)
+                except OSError:
+                    pass
+            if self.drop_after_publish:
+                self.drop_after_publish -= 1
+                conn.close()
+                return False
+            conn.sendall(b":%d\r\n" % len(self.subscribers))
+        else:
+            conn.sendall(b"+OK\r\n")
+        return True
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def redis():
+    server = FakeRedis()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def hub(redis):
+    realtime = RealtimeHub(ttl=0)
+    transport = RedisTransport(redis.url)
+    realtime.set_transport(transport)
+    applied = []
+    realtime.add_listener(applied.extend)
+    realtime.applied = applied
+    transport.ensure_running()
+    wait_for(lambda: redis.subscribers)
+    yield realtime
+    transport.close()
+
+
+def position(bus_id: int, lat: float = 12.9, ts: float = None) -> Position:
+    return Position(bus_id=bus_id, latitude=lat, longitude=77.6, heading=None, speed=None, timestamp=ts or time.time())
+
+
+def test_publish_reaches_subscription_and_snapshot(hub, redis):
+    hub.update_positions([position(1), position(2)])
+    wait_for(lambda: len(hub.applied) == 2)
+    assert hub.latest(1) is not None
+    assert redis.snapshot_ids() == {1, 2}
+    assert hub.transport_stats()["published"] == 1
+
+
+def test_subscription_reconnects_after_eof(hub, redis):
+    redis.kick_subscribers()
+    wait_for(lambda: redis.subscribers)
+    hub.update_positions([position(3)])
+    wait_for(lambda: [p.bus_id for p in hub.applied] == [3])
+    assert hub.transport_stats()["reconnects"] == 1
+
+
+def test_retried_publish_is_applied_once(hub, redis):
+    # The PUBLISH goes out but its reply is lost, so the transport sends the batch again
+    redis.drop_after_publish = 1
+    hub.update_positions([position(4)])
+    wait_for(lambda: hub.transport_stats()["duplicates"] == 1)
+    assert [p.bus_id for p in hub.applied] == [4]
+    assert hub.transport_stats()["fallbacks"] == 0
+
+
+def test_expired_buses_are_removed_from_snapshot(hub, redis):
+    hub.update_positions([position(5), position(6)])
+    wait_for(lambda: len(hub.applied) == 2)
+    hub.update_positions([position(7)])
+    wait_for(lambda: len(hub.applied) == 3)
+    hub.set_ttl(60)
+    # Only 5 and 6 go stale; 7 is seen again just before the expiry check
+    hub.update_positions([position(7)])
+    wait_for(lambda: len(hub.applied) == 4)
+    with hub._lock:
+        hub._last_seen[7] += 1000
+    assert sorted(hub.expire(now=time.time() + 120)) == [5, 6]
+    wait_for(lambda: redis.snapshot_ids() == {7})
+
+
+def test_records_from_older_workers_decode():
+    # Six-field records predate map matching
+    assert _position([7, 1.5, 2.5, 90.0, 10.0, 1700000000.0]).progress_m is None
@@ -0,0 +1,74 @@
+from services.journey import JourneyPlanner, format_hhmm
+from services.timetable import StopTime
+
+
+class FakeTimetable:
+    version = 1
+
+    def __init__(self, buses):
+        self._buses = buses
+
+    def buses(self):
+        return self._buses
+
+
+class FakeStops:
+    def canonical_id(self, stop_id):
+        return stop_id
+
+
+def trip(*calls):
+    return [StopTime(stop, stop, format_hhmm(t), format_hhmm(t)) for stop, t in calls]
+
+
+def planner(**buses):
+    return JourneyPlanner(FakeTimetable(buses), FakeStops())
+
+
+def summary(journeys):
+    return [(j.legs[-1].arrival, j.transfers, [leg.bus_id for leg in j.legs]) for j in journeys]
+
+
+def test_direct_bus_kept_when_a_transfer_arrives_earlier():
+    p = planner(
+        DIRECT=trip(("X", 500), ("Z", 600)),
+        FIRST=trip(("X", 505), ("Y", 520)),
+        SECOND=trip(("Y", 530), ("Z", 590)),
+    )
+    assert summary(p.plan(["X"], ["Z"], depart_after=480)) == [
+        (600, 0, ["DIRECT"]),
+        (590, 1, ["FIRST", "SECOND"]),
+    ]
+
+
+def test_transfer_dropped_when_direct_bus_is_as_fast():
+    p = planner(
+        DIRECT=trip(("X", 500), ("Z", 590)),
+        FIRST=trip(("X", 505), ("Y", 520)),
+        SECOND=trip(("Y", 530), ("Z", 590)),
+    )
+    assert summary(p.plan(["X"], ["Z"], depart_after=480)) == [(590, 0, ["DIRECT"])]
+
+
+def test_direct_bus_boarded_after_transfer_journey_departs():
+    # The direct bus leaves after the transfer journey's first leg, so it is only
+    # found once the scan has settled the one-transfer level
+    p = planner(
+        FIRST=trip(("X", 500), ("Y", 510)),
+        SECOND=trip(("Y", 515), ("Z", 540)),
+        DIRECT=trip(("X", 545), ("Z", 560)),
+    )
+    assert summary(p.plan(["X"], ["Z"], depart_after=480)) == [
+        (560, 0, ["DIRECT"]),
+        (540, 1, ["FIRST", "SECOND"]),
+    ]
+    assert summary(p.plan(["X"], ["Z"], depart_after=480, max_transfers=0)) == [(560, 0, ["DIRECT"])]
+
+
+def test_transfer_needs_change_buffer():
+    p = planner(
+        FIRST=trip(("X", 500), ("Y", 520)),
+        TIGHT=trip(("Y", 521), ("Z", 540)),
+        LATER=trip(("Y", 525), ("Z", 550)),
+    )
+    assert summary(p.plan(["X"], ["Z"], depart_after=480)) == [(550, 1, ["FIRST", "LATER"])]
@@ -1,37 +1,167 @@
+import argparse
 import csv
 import os
-from configurations import bus_collection
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from services.bus_search import backfill_search_fields, ensure_search_index, search_fields
 
 # Path to your CSV file
 CSV_FILE = "KSRTC_Ticket_Booking_counter_Awatar_counters_1.csv"
+DEFAULT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Row errors kept for the report (all of them are counted)
+MAX_REPORTED_ERRORS = 1000
+# Buses are upserted on this key, so re-running an import updates instead of duplicating
+KEY_FIELDS = ("bus_number", "depart")
 
-def import_buses():
-    if not os.path.exists(CSV_FILE):
-        print(f"⚠️ File not found: {CSV_FILE}")
-        return
 
-    with open(CSV_FILE, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        buses = []
+@dataclass
+class ImportReport:
+    rows: int = 0
+    upserted: int = 0
+    matched: int = 0
+    modified: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
 
+def _int(value: Optional[str], name: str) -> int:
+    if value is None or not value.strip():
+        return 0
+    try:
+        return int(float(value))
+    # "inf" and "1e400" parse as floats but have no int
+    except (ValueError, OverflowError):
+        raise ValueError(f"{name} is not a number: {value!r}")
+
+
+def parse_row(row: Dict[str, str]) -> dict:
+    bus = {
+        "bus_number": (row.get("Bus_No") or row.get("bus_no") or "").strip(),
+        "service_name": row.get("Service_Name") or row.get("service"),
+        "from": row.get("From"),
+        "to": row.get("To"),
+        "depart": (row.get("Depart_Time") or row.get("depart") or "").strip(),
+        "arrive": row.get("Arrive_Time") or row.get("arrive"),
+        "fare": _int(row.get("Fare"), "Fare"),
+        "seats": _int(row.get("Seats"), "Seats"),
+    }
+    if not bus["bus_number"]:
+        raise ValueError("missing bus number")
+    bus.update(search_fields(bus))
+    return bus
+
+
+def read_rows(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """(line number, row) pairs, streamed from the file."""
+    with open(path, newline="", encoding="utf-8") as csvfile:
+        reader = csv.DictReader(csvfile)
         for row in reader:
-            bus = {
-                "bus_number": row.get("Bus_No") or row.get("bus_no"),
-                "service_name": row.get("Service_Name") or row.get("service"),
-                "from": row.get("From"),
-                "to": row.get("To"),
-                "depart": row.get("Depart_Time") or row.get("depart"),
-                "arrive": row.get("Arrive_Time") or row.get("arrive"),
-                "fare": int(row.get("Fare", 0)),
-                "seats": int(row.get("Seats", 0)),
-            }
-            buses.append(bus)
-
-        if buses:
-            bus_collection.insert_many(buses)
-            print(f"✅ Inserted {len(buses)} buses into MongoDB")
-        else:
-            print("⚠️ No bus records found in CSV")
+            yield reader.line_num, row
+
+
+def chunks(rows: Iterable, size: int) -> Iterator[list]:
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ensure_key_index(collection) -> None:
+    try:
+        collection.create_index([(f, ASCENDING) for f in KEY_FIELDS], unique=True, name="bus_number_depart")
+    except OperationFailure as exc:
+        # Duplicates left by earlier non-upserting imports; upserts still work, just without the guarantee
+        print(f"⚠️ Could not create unique (bus_number, depart) index: {exc}")
+        collection.create_index([(f, ASCENDING) for f in KEY_FIELDS], name="bus_number_depart_lookup")
+
+
+def _write(collection, chunk: List[Tuple[int, dict]], report: ImportReport) -> None:
+    ops = [
+        UpdateOne({f: bus[f] for f in KEY_FIELDS}, {"$set": bus}, upsert=True)
+        for _, bus in chunk
+    ]
+    try:
+        result = collection.bulk_write(ops, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as exc:
+        details = exc.details
+        for err in details.get("writeErrors", []):
+            report.error(chunk[err["index"]][0], err.get("errmsg", "write failed"))
+    report.upserted += details.get("nUpserted", 0)
+    report.matched += details.get("nMatched", 0)
+    report.modified += details.get("nModified", 0)
+
+
+def import_buses(
+    csv_file: str = CSV_FILE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    collection=None,
+    progress_every: float = 5.0,
+) -> Optional[ImportReport]:
+    """Stream the CSV into Mongo as unordered bulk upserts of `batch_size` rows.
+
+    Memory stays bounded by one batch; bad rows are reported by line number
+    and skipped instead of aborting the file.
+    """
+    if not os.path.exists(csv_file):
+        print(f"⚠️ File not found: {csv_file}")
+        return None
+    if collection is None:
+        from configurations import bus_collection as collection
+    ensure_key_index(collection)
+    ensure_search_index(collection)
+    backfilled = backfill_search_fields(collection, batch_size)
+    if backfilled:
+        print(f"🔧 Added search fields to {backfilled} previously imported buses")
+
+    report = ImportReport()
+    started = last_progress = time.perf_counter()
+    for chunk in chunks(read_rows(csv_file), batch_size):
+        parsed: List[Tuple[int, dict]] = []
+        for line, row in chunk:
+            report.rows += 1
+            try:
+                parsed.append((line, parse_row(row)))
+            except ValueError as exc:
+                report.error(line, str(exc))
+        if parsed:
+            _write(collection, parsed, report)
+        now = time.perf_counter()
+        if now - last_progress >= progress_every:
+            last_progress = now
+            print(f"… {report.rows} rows, {report.rows / (now - started):.0f} rows/sec")
+    report.seconds = time.perf_counter() - started
+
+    print(
+        f"✅ {report.rows} rows in {report.seconds:.1f}s ({report.rows_per_sec:.0f} rows/sec): "
+        f"{report.upserted} new, {report.matched} existing ({report.modified} changed), {report.failed} failed"
+    )
+    for line, message in report.errors[:20]:
+        print(f"   line {line}: {message}")
+    return report
+
 
 if __name__ == "__main__":
-    import_buses()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import KSRTC counter CSVs into the Mongo buses collection")
+    parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    import_buses(args.csv_file, batch_size=args.batch_size)
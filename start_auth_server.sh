@@ -21,10 +21,10 @@ else
 fi
 
 # Check if dependencies are installed
-python3 -c "import fastapi, uvicorn, pymongo, email_validator" 2>/dev/null
+python3 -c "import fastapi, uvicorn, pymongo, motor, email_validator" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo "Installing dependencies..."
-    pip install fastapi uvicorn pymongo python-jose[cryptography] passlib[bcrypt] pydantic[email] email-validator
+    pip install fastapi uvicorn pymongo motor python-jose[cryptography] passlib[bcrypt] pydantic[email] email-validator
 fi
 
 echo "Starting FastAPI Auth Server on http://127.0.0.1:8000"
@@ -0,0 +1,73 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.users import InMemoryUserRepository, UserRepository, get_user_repository
+
+
+@pytest.fixture
+def users():
+    repo = InMemoryUserRepository()
+    app.dependency_overrides[get_user_repository] = lambda: repo
+    yield repo
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client(users):
+    # Not entered as a context manager, so the lifespan (and its Mongo connection) never runs
+    return TestClient(app)
+
+
+def register(client, email="Rider@Example.com", password="secret1"):
+    return client.post("/register", json={"name": "Rider", "email": email, "password": password})
+
+
+def test_repository_is_abstract():
+    with pytest.raises(TypeError):
+        UserRepository()
+
+
+def test_register_stores_user_in_repository(client, users):
+    response = register(client)
+
+    assert response.status_code == 201
+    body = response.json()
+    assert body["email"] == "rider@example.com"
+    assert "password" not in body
+    assert len(users) == 1
+
+
+def test_register_rejects_duplicate_email(client, users):
+    register(client)
+    response = register(client, email="rider@example.com")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+    assert len(users) == 1
+
+
+def test_login_and_profile(client):
+    user_id = register(client).json()["id"]
+
+    response = client.post("/login", json={"email": "rider@example.com", "password": "secret1"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    profile = client.get("/profile", headers={"Authorization": f"Bearer {token}"})
+    assert profile.status_code == 200
+    assert profile.json()["id"] == user_id
+
+
+def test_login_rejects_wrong_password(client):
+    register(client)
+
+    response = client.post("/login", json={"email": "rider@example.com", "password": "wrong-password"})
+
+    assert response.status_code == 401
+
+
+def test_profile_requires_valid_token(client):
+    response = client.get("/profile", headers={"Authorization": "Bearer not-a-token"})
+
+    assert response.status_code == 401